@@ -3,21 +3,34 @@ from flask_cors import CORS
 from flasgger import Swagger
 from routes.document_routes import document_bp
 from database.db import init_db
+from services.document_services import resume_jobs
+from config import ASYNC_UPLOADS, JSON_RAW_RESPONSES
+from commands import register_commands
+import jsonlib
+import metrics
 
 def create_app():
     app = Flask(__name__)
+    app.json = jsonlib.JSONProvider(app)
     app.json.sort_keys = False
     app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['ASYNC_UPLOADS'] = ASYNC_UPLOADS
+    app.config['JSON_RAW_RESPONSES'] = JSON_RAW_RESPONSES
 
     CORS(app)
     Swagger(app)
 
     init_db()
     app.register_blueprint(document_bp)
+    register_commands(app)
+    metrics.init_app(app)
 
     return app
 
 # Run normally
 if __name__ == "__main__":
     app = create_app()
+    # Only the server process picks up unfinished jobs; WSGI servers run
+    # `flask resume-jobs` once instead of resuming in every worker.
+    resume_jobs()
     app.run(debug=True, use_reloader=False)
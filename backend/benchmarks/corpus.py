@@ -0,0 +1,73 @@
+"""Synthetic single-product catalog PDFs shaped like uploads/Single_Product_Catalog.pdf."""
+import io
+import random
+
+from reportlab.pdfgen import canvas
+
+COLORS = ["Black", "Red", "Silver", "Blue", "Yellow", "White", "Multi"]
+LINES = ["R", "M", "T", "S"]
+CLASSES = ["H", "M", "L"]
+STYLES = ["U", "M", "W"]
+SIZES = ["S", "M", "L", "XL", "38", "42", "44", "48"]
+NAMES = ["Mountain Bike", "Road Bike", "Touring Frame", "Helmet", "Jersey", "Water Bottle", "Tire Tube"]
+
+
+def make_product(product_id: int, rng: random.Random) -> dict:
+    cost = round(rng.uniform(5, 2000), 2)
+    return {
+        "ProductID": str(product_id),
+        "Name": f"{rng.choice(NAMES)} {product_id}",
+        "ProductNumber": f"{rng.choice(['MB', 'RB', 'TF', 'HL'])}-{product_id:05d}",
+        "MakeFlag": str(rng.random() < 0.5),
+        "FinishedGoodsFlag": str(rng.random() < 0.8),
+        "Color": rng.choice(COLORS),
+        "StandardCost": f"${cost:.2f}",
+        "ListPrice": f"${cost * rng.uniform(1.2, 2):.2f}",
+        "Size": rng.choice(SIZES),
+        "ProductLine": rng.choice(LINES),
+        "Class": rng.choice(CLASSES),
+        "Style": rng.choice(STYLES),
+        "ProductSubcategoryID": str(rng.randint(1, 37)),
+        "ProductModelID": str(rng.randint(1, 128)),
+    }
+
+
+def catalog_lines(product: dict) -> list:
+    """The labelled product block of a catalog page."""
+    return [
+        "Product Catalog",
+        f"{product['Name']} (#{product['ProductNumber']})",
+        f"Product ID: {product['ProductID']}",
+        f"Make Flag: {product['MakeFlag']}",
+        f"Finished Goods Flag: {product['FinishedGoodsFlag']}",
+        f"Color: {product['Color']}",
+        f"Standard Cost: {product['StandardCost']}",
+        f"List Price: {product['ListPrice']}",
+        f"Size: {product['Size']}",
+        f"Product Line: {product['ProductLine']}",
+        f"Class: {product['Class']}",
+        f"Style: {product['Style']}",
+        f"Subcategory ID: {product['ProductSubcategoryID']}",
+        f"Model ID: {product['ProductModelID']}",
+    ]
+
+
+def make_catalog_pdf(pages: int = 1, seed: int = 0) -> bytes:
+    """Return a PDF whose first page is a labelled product block and the rest filler text."""
+    rng = random.Random(seed)
+    product = make_product(seed + 1, rng)
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+
+    lines = catalog_lines(product)
+    for page in range(pages):
+        y = 800
+        body = lines if page == 0 else [f"Page {page + 1} specifications and notes"] + [
+            " ".join(rng.choice(NAMES).lower() for _ in range(12)) for _ in range(40)
+        ]
+        for line in body:
+            pdf.drawString(60, y, line)
+            y -= 18
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,109 @@
+"""Local stand-in for the OpenRouter chat-completions API.
+
+Replies after a configurable delay with the product fields found in the
+prompt's labelled text (or empty strings), so the full upload path can be
+exercised without network access or API costs. Batch prompts
+(services/extractor.py's BATCH_PROMPT_TEMPLATE) get one object per document.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.extractor import METADATA_FIELDS
+
+LABELS = {
+    "ProductID": "Product ID",
+    "MakeFlag": "Make Flag",
+    "FinishedGoodsFlag": "Finished Goods Flag",
+    "Color": "Color",
+    "StandardCost": "Standard Cost",
+    "ListPrice": "List Price",
+    "Size": "Size",
+    "ProductLine": "Product Line",
+    "Class": "Class",
+    "Style": "Style",
+    "ProductSubcategoryID": "Subcategory ID",
+    "ProductModelID": "Model ID",
+}
+
+
+def fake_extract(prompt: str) -> dict:
+    result = {}
+    for field in METADATA_FIELDS:
+        label = LABELS.get(field)
+        match = re.search(rf"^{label}:\s*(.+)$", prompt, re.MULTILINE) if label else None
+        result[field] = match.group(1).strip() if match else ""
+    return result
+
+
+_DOCUMENT = re.compile(r"^[ \t]*\[Document (\d+)\]$", re.MULTILINE)
+
+
+def fake_answer(prompt: str):
+    parts = _DOCUMENT.split(prompt)
+    if len(parts) == 1:
+        return fake_extract(prompt)
+    # parts: [instructions, index, text, index, text, ...]
+    return [dict(index=int(index), **fake_extract(text)) for index, text in zip(parts[1::2], parts[2::2])]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(fake_answer(prompt))
+        payload = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4},
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class _Server(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections under concurrent load.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class LLMStub:
+    """Run the stub on a background thread: ``with LLMStub(latency=0.2) as stub: stub.url``."""
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.server = _Server((host, port), _Handler)
+        self.server.latency = latency
+        self.server.requests = 0
+        self.server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    @property
+    def requests(self) -> int:
+        return self.server.requests
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,308 @@
+"""Benchmark and load-test suite.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --sizes 10000,100000,1000000 --output bench.json
+    python -m benchmarks.run --sizes 10000 --compare bench.json
+
+Everything runs against a throwaway SQLite database and a local LLM stub
+(benchmarks/llm_stub.py), so no network access or API key is needed.
+Results are written as JSON and can be compared between commits.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _configure_environment(workdir: str, args) -> None:
+    # Must happen before config.py is imported by anything below.
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["EXTRACTOR_BACKENDS"] = args.extractors
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    # Measure the database itself, not the in-process read caches.
+    os.environ["DOCUMENT_CACHE_SIZE"] = "0"
+    os.environ["PAGE_CACHE_SIZE"] = "0"
+    # The stub has no rate limit; only --llm-rate turns the governor's bucket on.
+    os.environ["LLM_RATE_PER_MINUTE"] = str(args.llm_rate)
+    os.environ.setdefault("LLM_CONCURRENCY_MAX", "256")
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pct(0.50) * 1000,
+        "p95_ms": pct(0.95) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def bench_pdf_parsing(page_counts, repeat, workdir):
+    from benchmarks.corpus import make_catalog_pdf
+    from services import pdf_parser
+
+    results = {}
+    for pages in page_counts:
+        path = os.path.join(workdir, f"catalog_{pages}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_catalog_pdf(pages=pages, seed=pages))
+        results[f"{pages}_pages"] = measure(lambda: pdf_parser.extract_text_from_pdf(path), repeat)
+    return results
+
+
+def bench_upload(app, count, concurrency, latency):
+    from benchmarks.corpus import make_catalog_pdf
+
+    # Distinct seeds give distinct bytes, so the extraction cache never hits.
+    seed_base = random.randrange(1_000_000)
+    pdfs = [make_catalog_pdf(pages=1, seed=seed_base + i) for i in range(count)]
+
+    def upload(pdf):
+        with app.test_client() as client:
+            started = time.perf_counter()
+            response = client.post("/upload", data={"file": (io.BytesIO(pdf), "bench.pdf")},
+                                   content_type="multipart/form-data")
+            elapsed = time.perf_counter() - started
+        if response.status_code != 201:
+            raise RuntimeError(f"upload failed: {response.status_code} {response.get_data(as_text=True)}")
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(upload, pdfs))
+    wall = time.perf_counter() - started
+
+    result = summarize(samples)
+    result.update(concurrency=concurrency, llm_latency_ms=latency * 1000, throughput_per_s=count / wall)
+    return result
+
+
+def bench_batching(count, concurrency, stub):
+    """Extract short catalog texts with one LLM call each, then with llm_batch prompts."""
+    from benchmarks.corpus import catalog_lines, make_product
+    from services import extractor
+
+    rng = random.Random(count)
+    texts = ["\n".join(catalog_lines(make_product(i + 1, rng))) for i in range(count)]
+    results = {}
+    for name, backend in (("per_document", extractor.LLMExtractor()),
+                          ("batched", extractor.BatchingLLMExtractor())):
+        def run(text):
+            started = time.perf_counter()
+            extractor.extract_metadata_from_text(text, backends=[backend])
+            return time.perf_counter() - started
+
+        requests_before = stub.requests
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(run, texts))
+        wall = time.perf_counter() - started
+
+        results[name] = summarize(samples)
+        results[name].update(throughput_per_s=count / wall, llm_requests=stub.requests - requests_before)
+    results["concurrency"] = concurrency
+    return results
+
+
+def _grow_table(target, batch_size=10_000):
+    from benchmarks.corpus import make_product
+    from database import db
+
+    session = db.SessionLocal()
+    try:
+        current = session.query(db.Document).count()
+    finally:
+        session.close()
+
+    rng = random.Random(current)
+    while current < target:
+        n = min(batch_size, target - current)
+        records = [(f"http://bench/files/{current + i}.pdf", make_product(current + i + 1, rng)) for i in range(n)]
+        db.insert_documents(records)
+        current += n
+    return current
+
+
+def bench_json(page_sizes, repeat, app):
+    """Encode pages of documents: json module, orjson, and orjson with the stored metadata spliced in raw."""
+    import jsonlib
+    from database import db
+
+    _grow_table(max(page_sizes))
+    results = {}
+    with app.app_context():
+        for size in page_sizes:
+            def decoded():
+                return app.json.response(db.get_documents(limit=size)).get_data()
+
+            def raw():
+                return jsonlib.dumps_raw(db.get_documents(limit=size, raw=True)).encode()
+
+            orjson, jsonlib.orjson = jsonlib.orjson, None
+            try:
+                json_module = measure(decoded, repeat)
+            finally:
+                jsonlib.orjson = orjson
+            results[str(size)] = {
+                "json_module": json_module,
+                "orjson": measure(decoded, repeat),
+                "orjson_raw": measure(raw, repeat),
+            }
+    return results
+
+
+def bench_queries(sizes, repeat):
+    from database import db
+    from services.document_services import list_documents
+
+    results = {}
+    for size in sizes:
+        started = time.perf_counter()
+        rows = _grow_table(size)
+        load_seconds = time.perf_counter() - started
+
+        last_page = max(1, rows // 10)
+        results[str(size)] = {
+            "rows": rows,
+            "load_seconds": load_seconds,
+            "first_page": measure(lambda: list_documents("1", "10"), repeat),
+            "deep_offset_page": measure(lambda: list_documents(str(last_page), "10"), repeat),
+            "deep_cursor_page": measure(lambda: list_documents("1", "10", after=str(rows - 10), limit="10"), repeat),
+            "search_word": measure(lambda: db.get_documents(search_query="mountain"), repeat),
+            "search_prefix": measure(lambda: db.get_documents(search_query="helm"), repeat),
+            "search_rare": measure(lambda: db.get_documents(search_query=f"HL-{rows:05d}"), repeat),
+            "filter_color_price": measure(
+                lambda: db.get_documents(filters={"color": "Black", "list_price_min": 1000.0}, sort="-list_price"),
+                repeat),
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, path=()):
+    """Print the mean-latency ratio of every measurement present in both results."""
+    for key, value in current.items():
+        other = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict) and isinstance(other, dict):
+            if "mean_ms" in value and "mean_ms" in other and other["mean_ms"]:
+                ratio = value["mean_ms"] / other["mean_ms"]
+                print(f"{'.'.join(path + (key,)):55s} {other['mean_ms']:10.2f}ms -> {value['mean_ms']:10.2f}ms  x{ratio:.2f}")
+            else:
+                compare(value, other, path + (key,))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="Comma-separated table sizes for the query benchmarks.")
+    parser.add_argument("--pages", default="1,10,50,200", help="Comma-separated PDF page counts.")
+    parser.add_argument("--uploads", type=int, default=50, help="Uploads sent through POST /upload.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent upload clients.")
+    parser.add_argument("--batch-docs", type=int, default=200,
+                        help="Documents extracted per backend in the batching comparison.")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Latency of the LLM stub.")
+    parser.add_argument("--llm-rate", type=float, default=0,
+                        help="LLM_RATE_PER_MINUTE for the call governor; 0 leaves calls unthrottled.")
+    parser.add_argument("--extractors", default="rules,llm",
+                        help="EXTRACTOR_BACKENDS for uploads; \"llm\" sends every upload to the stub.")
+    parser.add_argument("--json-pages", default="100,1000",
+                        help="Comma-separated page sizes for the JSON encoding benchmark.")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions per measurement.")
+    parser.add_argument("--skip", default="", help="Comma-separated sections to skip: pdf,upload,batching,json,queries.")
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout).")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    skip = set(filter(None, args.skip.split(",")))
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        _configure_environment(workdir, args)
+
+        from app import create_app
+        from benchmarks.llm_stub import LLMStub
+        from services import llm_client
+
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "args": vars(args),
+            }
+        }
+
+        app = create_app()
+        app.config["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+        os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+
+        if "pdf" not in skip:
+            pages = [int(p) for p in args.pages.split(",")]
+            results["extract_text_from_pdf"] = bench_pdf_parsing(pages, args.repeat, workdir)
+
+        if "upload" not in skip:
+            latency = args.llm_latency_ms / 1000
+            with LLMStub(latency=latency) as stub:
+                llm_client.client.url = stub.url
+                results["upload"] = bench_upload(app, args.uploads, args.concurrency, latency)
+                results["upload"]["llm_requests"] = stub.requests
+
+        if "batching" not in skip:
+            with LLMStub(latency=args.llm_latency_ms / 1000) as stub:
+                llm_client.client.url = stub.url
+                results["llm_batching"] = bench_batching(args.batch_docs, args.concurrency, stub)
+
+        if "json" not in skip:
+            page_sizes = [int(s) for s in args.json_pages.split(",")]
+            results["json_responses"] = bench_json(page_sizes, args.repeat, app)
+
+        if "queries" not in skip:
+            sizes = sorted(int(s) for s in args.sizes.split(","))
+            results["get_documents"] = bench_queries(sizes, args.repeat)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
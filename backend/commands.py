@@ -0,0 +1,57 @@
+import json
+
+import click
+from flask import current_app
+
+from config import BULK_BATCH_SIZE, FILE_GC_GRACE
+from services.document_services import collect_garbage, resume_jobs, save_documents_bulk
+
+
+def _iter_records(path):
+    with open(path, 'rb') as f:
+        if path.endswith(('.ndjson', '.jsonl')):
+            # Stream line by line so large exports never sit in memory whole.
+            yield from (line for line in f if line.strip())
+            return
+        records = json.load(f)
+    if not isinstance(records, list):
+        raise click.ClickException("Expected a JSON array of documents")
+    yield from records
+
+
+@click.command('import-documents')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=BULK_BATCH_SIZE, show_default=True,
+              help='Documents inserted per transaction.')
+def import_documents_command(path, batch_size):
+    """Import {file_url, metadata} records from a JSON array or NDJSON file."""
+    results = save_documents_bulk(_iter_records(path), batch_size=batch_size)
+
+    failed = [result for result in results if "error" in result]
+    for result in failed:
+        click.echo(f"record {result['index']}: {result['error']}", err=True)
+    click.echo(f"Imported {len(results) - len(failed)} documents, {len(failed)} failed")
+
+
+@click.command('resume-jobs')
+def resume_jobs_command():
+    """Run upload jobs left unfinished by a stopped server, and wait for them."""
+    futures = resume_jobs()
+    for future in futures:
+        future.result()
+    click.echo(f"Resumed {len(futures)} jobs")
+
+
+@click.command('gc-files')
+@click.option('--grace', default=FILE_GC_GRACE, show_default=True, type=float,
+              help='Keep files uploaded within this many seconds.')
+def gc_files_command(grace):
+    """Delete uploaded files that no document or unfinished job refers to."""
+    removed = collect_garbage(current_app.config['UPLOAD_FOLDER'], grace)
+    click.echo(f"Removed {len(removed)} files")
+
+
+def register_commands(app):
+    app.cli.add_command(import_documents_command)
+    app.cli.add_command(resume_jobs_command)
+    app.cli.add_command(gc_files_command)
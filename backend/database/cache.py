@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    Each entry carries a ``stamp`` (a row version or database generation)
+    recorded when it was loaded, so callers can check it against the
+    database before trusting the value.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Any, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, Any, float]]:
+        """Return ``(value, stamp, checked_at)`` for a live entry, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stamp, expires_at, checked_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, stamp, checked_at
+
+    def set(self, key: Hashable, value: Any, stamp: Any = None) -> None:
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, stamp, now + self.ttl, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def touch(self, key: Hashable) -> None:
+        """Record that an entry's stamp was just confirmed against the database."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = entry[:3] + (time.monotonic(),)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            self._stats["hits" if hit else "misses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), maxsize=self.maxsize)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
@@ -1,50 +1,572 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Float, Integer, and_, create_engine, event, false, func, inspect, or_, text, update
 from sqlalchemy.orm import sessionmaker
-from database.models import Base, Document
-from config import DATABASE
-import json
+from database.cache import LRUCache
+from database.writer import GroupCommitWriter
+from database.models import (
+    Base, CacheGeneration, Document, ExtractionCache, Job, SEARCH_INDEX_DDL, TYPED_FIELDS, typed_values
+)
+from config import (
+    DATABASE,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_MMAP_SIZE,
+    SQLITE_CACHE_SIZE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_GROUP_COMMIT,
+    DB_GROUP_COMMIT_MAX_BATCH,
+    DB_GROUP_COMMIT_LINGER_MS,
+    DOCUMENT_CACHE_SIZE,
+    DOCUMENT_CACHE_TTL,
+    PAGE_CACHE_SIZE,
+    PAGE_CACHE_PAGES,
+    CACHE_STAMP_INTERVAL,
+)
+from metrics import DB_OPERATION_DURATION, register_collector, timed
+import jsonlib
+import re
+import time
+from datetime import datetime, timezone
 
-engine = create_engine(DATABASE, connect_args={"check_same_thread": False})
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size = {SQLITE_CACHE_SIZE}")
+    finally:
+        cursor.close()
+
+def create_db_engine(url: str = DATABASE):
+    """Create the engine: tuned pragmas for SQLite, a sized connection pool otherwise."""
+    if url.startswith("sqlite"):
+        db_engine = create_engine(url, connect_args={
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+        })
+        event.listen(db_engine, "connect", _set_sqlite_pragmas)
+        return db_engine
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+engine = create_db_engine(DATABASE)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read-through caches. Document entries are stamped with the row version,
+# page entries with the cache_generation counter that every write bumps.
+document_cache = LRUCache(DOCUMENT_CACHE_SIZE, DOCUMENT_CACHE_TTL)
+page_cache = LRUCache(PAGE_CACHE_SIZE, DOCUMENT_CACHE_TTL)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    added = add_missing_columns()
+    if any(attr in added.get(Document.__tablename__, ()) for attr, _ in TYPED_FIELDS.values()):
+        backfill_typed_fields()
+    ensure_search_index()
+
+def add_missing_columns():
+    """Add columns (and their indexes) that were added to the models after a table was created.
+
+    Returns the names of the added columns per table.
+    """
+    inspector = inspect(engine)
+    added = {}
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = f" NOT NULL DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}{default}')
+                added.setdefault(table.name, []).append(column.key)
+        for table_name in added:
+            for index in Base.metadata.tables[table_name].indexes:
+                index.create(conn, checkfirst=True)
+    return added
+
+def backfill_typed_fields(batch_size: int = 500):
+    session = SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            documents = (
+                session.query(Document)
+                .filter(Document.id > last_id)
+                .order_by(Document.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not documents:
+                break
+            for doc in documents:
+                doc.set_metadata(jsonlib.loads(doc.meta_json))
+            session.commit()
+            last_id = documents[-1].id
+    finally:
+        session.close()
+
+def ensure_search_index():
+    """Create and backfill the FTS5 index for databases created before it existed."""
+    if engine.dialect.name != "sqlite" or inspect(engine).has_table("documents_fts"):
+        return
+    with engine.begin() as conn:
+        for statement in SEARCH_INDEX_DDL:
+            conn.exec_driver_sql(statement)
+
+def cache_stats():
+    return {"documents": document_cache.stats(), "pages": page_cache.stats()}
 
+def _collect_cache_stats():
+    # The text format needs every sample of a metric together, so yield one metric at a time.
+    snapshots = cache_stats()
+    for cache_name, stats in snapshots.items():
+        for outcome in ("hits", "misses"):
+            yield ("document_cache_lookups_total", "counter", "Document/page cache lookups by outcome.",
+                   {"cache": cache_name, "outcome": outcome}, stats[outcome])
+    for cache_name, stats in snapshots.items():
+        yield ("document_cache_size", "gauge", "Entries held in the document/page caches.",
+               {"cache": cache_name}, stats["size"])
+
+register_collector(_collect_cache_stats)
+
+def _forget_document(doc_id):
+    document_cache.delete(doc_id)
+    document_cache.delete(("raw", doc_id))
+
+def clear_caches():
+    document_cache.clear()
+    page_cache.clear()
+
+def _cached(cache, key, current_stamp):
+    entry = cache.get(key)
+    if entry is not None:
+        value, stamp, checked_at = entry
+        if time.monotonic() - checked_at < CACHE_STAMP_INTERVAL:
+            cache.record(hit=True)
+            return value
+        if current_stamp() == stamp:
+            cache.touch(key)
+            cache.record(hit=True)
+            return value
+        cache.delete(key)
+    cache.record(hit=False)
+    return None
+
+def _generation(session):
+    return session.query(CacheGeneration.generation).filter(CacheGeneration.id == 1).scalar()
+
+def current_generation():
+    session = SessionLocal()
+    try:
+        return _generation(session)
+    finally:
+        session.close()
+
+def _bump_generation(session):
+    # Every document write updates this one row, so concurrent writers queue on
+    # its row lock until they commit. SQLite serialises writers anyway; on a
+    # server database this caps document writes at one transaction at a time,
+    # which group commit (DB_GROUP_COMMIT) amortises but does not lift.
+    session.execute(
+        update(CacheGeneration)
+        .where(CacheGeneration.id == 1)
+        .values(generation=CacheGeneration.generation + 1)
+    )
+
+def _fts_query(search_query: str) -> str:
+    # Quote every word so FTS5 operators in user input are taken literally,
+    # and prefix-match each one for search-as-you-type.
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", search_query))
+
+@timed(DB_OPERATION_DURATION, operation="insert_document")
 def insert_document(file_url: str, metadata: dict) -> int:
+    if group_writer is not None:
+        return group_writer.submit((file_url, metadata)).result()
+
     session = SessionLocal()
     try:
-        doc = Document(file_url=file_url, meta_json=json.dumps(metadata))
+        doc = Document(file_url=file_url)
+        doc.set_metadata(metadata)
         session.add(doc)
+        _bump_generation(session)
+        # Read the id before commit, which expires the instance and would reload it.
+        session.flush()
+        doc_id = doc.id
         session.commit()
-        return doc.id
+        page_cache.clear()
+        return doc_id
     finally:
         session.close()
 
-def get_documents(offset=0, limit=10, search_query=''):
+@timed(DB_OPERATION_DURATION, operation="insert_documents")
+def insert_documents(records) -> list:
+    """Insert ``(file_url, metadata)`` pairs in one transaction and return their ids."""
     session = SessionLocal()
     try:
-        query = session.query(Document)
-        if search_query:
-            query = query.filter(Document.meta_json.ilike(f"%{search_query.lower()}%"))
-        documents = query.order_by(Document.id).offset(offset).limit(limit).all()
-        return [doc.to_dict() for doc in documents]
+        docs = []
+        for file_url, metadata in records:
+            doc = Document(file_url=file_url)
+            doc.set_metadata(metadata)
+            docs.append(doc)
+        session.add_all(docs)
+        _bump_generation(session)
+        session.flush()
+        ids = [doc.id for doc in docs]
+        session.commit()
+        page_cache.clear()
+        return ids
     finally:
         session.close()
 
-def get_document_by_id(doc_id: int):
+# Concurrent insert_document calls share one transaction (and one fsync).
+group_writer = (
+    GroupCommitWriter(insert_documents, DB_GROUP_COMMIT_MAX_BATCH, DB_GROUP_COMMIT_LINGER_MS)
+    if DB_GROUP_COMMIT else None
+)
+
+def _apply_search(query, session, search_query: str, ranked: bool = True):
+    if not search_query:
+        return query
+    if session.get_bind().dialect.name != "sqlite":
+        return query.filter(Document.meta_json.ilike(f"%{search_query.lower()}%"))
+
+    match = _fts_query(search_query)
+    if not match:
+        # Only punctuation, e.g. "-": no word can match, and an unfiltered list would mislead.
+        return query.filter(false())
+    matches = (
+        text("SELECT rowid AS doc_id, rank FROM documents_fts WHERE documents_fts MATCH :match")
+        .bindparams(match=match)
+        .columns(doc_id=Integer, rank=Float)
+        .subquery()
+    )
+    query = query.join(matches, matches.c.doc_id == Document.id)
+    return query.order_by(matches.c.rank) if ranked else query
+
+def _apply_filters(query, filters: dict):
+    """Apply ``{attr: value}`` equality and ``{attr_min/attr_max: value}`` range filters."""
+    for key, value in (filters or {}).items():
+        if key.endswith("_min"):
+            query = query.filter(getattr(Document, key[:-4]) >= value)
+        elif key.endswith("_max"):
+            query = query.filter(getattr(Document, key[:-4]) <= value)
+        else:
+            query = query.filter(getattr(Document, key) == value)
+    return query
+
+def writer_stats():
+    """Counters of the group-commit writer, or None when DB_GROUP_COMMIT is off."""
+    return group_writer.stats() if group_writer is not None else None
+
+def _collect_writer_stats():
+    stats = writer_stats()
+    if stats is None:
+        return
+    yield ("db_group_commit_records_total", "counter", "Records written by the group-commit writer.",
+           {}, stats["records"])
+    yield ("db_group_commit_batches_total", "counter", "Transactions committed by the group-commit writer.",
+           {}, stats["batches"])
+    yield ("db_group_commit_retried_total", "counter", "Records written again alone after their group failed.",
+           {}, stats["retried"])
+    yield ("db_group_commit_failed_total", "counter", "Records the group-commit writer could not write.",
+           {}, stats["failed"])
+
+register_collector(_collect_writer_stats)
+
+def _raw_document(doc_id, meta_json, file_url):
+    return {"id": doc_id, "metadata": jsonlib.RawJSON(meta_json), "file_url": file_url}
+
+@timed(DB_OPERATION_DURATION, operation="get_documents")
+def get_documents(offset=0, limit=10, search_query='', after_id=None, filters=None, sort=None, raw=False):
+    """Return a page of documents.
+
+    With ``after_id`` the page is the next ``limit`` rows after that id in id
+    order (keyset pagination, no rank ordering); otherwise ``offset`` is used.
+    ``sort`` is a typed column attribute, prefixed with "-" for descending,
+    and takes precedence over search rank. With ``raw`` each document's
+    metadata is left as the stored JSON text (jsonlib.RawJSON) for
+    jsonlib.dumps_raw to splice into a response.
+    """
+    key = None
+    if (after_id is None and offset < PAGE_CACHE_PAGES * limit) or after_id == 0:
+        key = (offset, limit, search_query, after_id, tuple(sorted((filters or {}).items())), sort, raw)
+        cached = _cached(page_cache, key, current_generation)
+        if cached is not None:
+            return list(cached)
+
     session = SessionLocal()
     try:
+        # Read the stamp first: a write racing with the query below makes the
+        # entry look stale rather than letting it hide the write.
+        generation = _generation(session) if key else None
+        ranked = after_id is None and not sort
+        columns = (Document.id, Document.meta_json, Document.file_url) if raw else (Document,)
+        query = _apply_search(session.query(*columns), session, search_query, ranked=ranked)
+        query = _apply_filters(query, filters)
+        if after_id is not None:
+            query = query.filter(Document.id > after_id)
+        if sort:
+            column = getattr(Document, sort.lstrip("-"))
+            query = query.order_by(column.desc() if sort.startswith("-") else column.asc())
+        rows = query.order_by(Document.id).offset(offset).limit(limit).all()
+        documents = [_raw_document(*row) for row in rows] if raw else [doc.to_dict() for doc in rows]
+        if key:
+            page_cache.set(key, documents, generation)
+        return list(documents)
+    finally:
+        session.close()
+
+def iter_documents(search_query='', filters=None, sort=None, batch_size=1000):
+    """Yield every matching document, streaming rows from a server-side cursor.
+
+    Only ``batch_size`` rows are held in memory at a time, however many match.
+    """
+    session = SessionLocal()
+    try:
+        query = session.query(Document.id, Document.meta_json, Document.file_url)
+        query = _apply_search(query, session, search_query, ranked=not sort)
+        query = _apply_filters(query, filters)
+        if sort:
+            column = getattr(Document, sort.lstrip("-"))
+            query = query.order_by(column.desc() if sort.startswith("-") else column.asc())
+        query = query.order_by(Document.id).execution_options(yield_per=batch_size)
+        for doc_id, meta_json, file_url in query:
+            yield {"id": doc_id, "metadata": jsonlib.loads(meta_json), "file_url": file_url}
+    finally:
+        session.close()
+
+@timed(DB_OPERATION_DURATION, operation="get_document_by_id")
+def get_document_by_id(doc_id: int, raw=False, version=None):
+    """Return a document as a dict, served from the LRU cache while its version is unchanged.
+
+    The returned dict is shared with the cache and must not be mutated. With
+    ``raw`` its metadata is the stored JSON text, as in get_documents. Callers
+    that have just read the document's ``version`` pass it in, so a cache hit
+    needs no query of its own.
+    """
+    key = ("raw", doc_id) if raw else doc_id
+    current_version = (lambda: version) if version is not None else (lambda: get_document_version(doc_id))
+    cached = _cached(document_cache, key, current_version)
+    if cached is not None:
+        return cached
+
+    session = SessionLocal()
+    try:
+        if raw:
+            row = (session.query(Document.id, Document.meta_json, Document.file_url, Document.version)
+                   .filter(Document.id == doc_id).first())
+            if row is None:
+                return None
+            result = _raw_document(*row[:3])
+            document_cache.set(key, result, row[3])
+            return result
+
         doc = session.get(Document, doc_id)
-        return doc.to_dict() if doc else None
+        if not doc:
+            return None
+        result = doc.to_dict()
+        document_cache.set(doc_id, result, doc.version)
+        return result
     finally:
         session.close()
 
+@timed(DB_OPERATION_DURATION, operation="get_document_version")
+def get_document_version(doc_id: int):
+    session = SessionLocal()
+    try:
+        return session.query(Document.version).filter(Document.id == doc_id).scalar()
+    finally:
+        session.close()
+
+@timed(DB_OPERATION_DURATION, operation="update_document_metadata")
 def update_document_metadata(doc_id: int, metadata: dict):
     session = SessionLocal()
     try:
         doc = session.get(Document, doc_id)
         if doc:
-            doc.meta_json = json.dumps(metadata)
+            doc.set_metadata(metadata)
+            doc.version = Document.version + 1
+            _bump_generation(session)
             session.commit()
+            _forget_document(doc_id)
+            page_cache.clear()
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def merge_patch(target, patch):
+    """Apply a JSON Merge Patch (RFC 7396): objects merge, null deletes, anything else replaces."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+@timed(DB_OPERATION_DURATION, operation="patch_document_metadata")
+def patch_document_metadata(doc_id: int, patch: dict, expected_version: int = None):
+    """Merge ``patch`` into a document's metadata and return ``(version, metadata)``.
+
+    On SQLite the patch is applied by JSON1 ``json_patch`` inside the UPDATE,
+    so there is no read-modify-write window. With ``expected_version`` the
+    row is only changed while it is still at that version. Returns None when
+    the document is missing or at another version.
+    """
+    session = SessionLocal()
+    try:
+        conditions = [Document.id == doc_id]
+        if expected_version is not None:
+            conditions.append(Document.version == expected_version)
+
+        if session.get_bind().dialect.name == "sqlite":
+            row = session.execute(
+                update(Document)
+                .where(*conditions)
+                .values(meta_json=func.json_patch(Document.meta_json, jsonlib.dumps(patch)),
+                        version=Document.version + 1)
+                .returning(Document.version, Document.meta_json)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if row is None:
+                return None
+            version, metadata = row[0], jsonlib.loads(row[1])
+        else:
+            doc = session.query(Document).filter(*conditions).with_for_update().first()
+            if doc is None:
+                return None
+            metadata = merge_patch(jsonlib.loads(doc.meta_json), patch)
+            doc.meta_json = jsonlib.dumps(metadata)
+            doc.version = version = doc.version + 1
+
+        # The typed columns follow the merged blob, in the same transaction.
+        session.execute(
+            update(Document)
+            .where(Document.id == doc_id)
+            .values({getattr(Document, attr): value for attr, value in typed_values(metadata).items()})
+            .execution_options(synchronize_session=False)
+        )
+        _bump_generation(session)
+        session.commit()
+        _forget_document(doc_id)
+        page_cache.clear()
+        return version, metadata
+    finally:
+        session.close()
+
+def insert_job(file_path: str, file_url: str, content_hash: str = None) -> int:
+    session = SessionLocal()
+    try:
+        job = Job(file_path=file_path, file_url=file_url, content_hash=content_hash, status=Job.QUEUED)
+        session.add(job)
+        session.commit()
+        return job.id
+    finally:
+        session.close()
+
+def claim_job(job_id: int, owner: str, stale_before: datetime = None) -> bool:
+    """Mark a job running for ``owner`` and return whether this call got it.
+
+    Queued jobs can be claimed, and with ``stale_before`` also running jobs
+    not updated since then, whose worker is presumed dead. The check and the
+    update are one statement, so of several workers claiming the same job
+    exactly one succeeds.
+    """
+    claimable = Job.status == Job.QUEUED
+    if stale_before is not None:
+        claimable = or_(claimable, and_(Job.status == Job.RUNNING, Job.updated_at < stale_before))
+    session = SessionLocal()
+    try:
+        result = session.execute(
+            update(Job)
+            .where(Job.id == job_id, claimable)
+            .values(status=Job.RUNNING, owner=owner, updated_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        return result.rowcount == 1
+    finally:
+        session.close()
+
+def update_job(job_id: int, status: str, metadata: dict = None, error: str = None, owner: str = None) -> bool:
+    """Record a job's outcome; with ``owner``, only while that worker still holds the job."""
+    conditions = [Job.id == job_id]
+    if owner is not None:
+        conditions.append(Job.owner == owner)
+    session = SessionLocal()
+    try:
+        result = session.execute(
+            update(Job)
+            .where(*conditions)
+            .values(status=status, result_json=jsonlib.dumps(metadata) if metadata is not None else None,
+                    error=error, updated_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        return result.rowcount == 1
+    finally:
+        session.close()
+
+def get_job_by_id(job_id: int):
+    session = SessionLocal()
+    try:
+        job = session.get(Job, job_id)
+        return job.to_dict() if job else None
+    finally:
+        session.close()
+
+def get_unfinished_jobs(stale_before: datetime = None):
+    """Return ``(id, file_path, content_hash)`` of queued jobs and of running jobs not updated since ``stale_before``."""
+    unfinished = Job.status == Job.QUEUED
+    if stale_before is not None:
+        unfinished = or_(unfinished, and_(Job.status == Job.RUNNING, Job.updated_at < stale_before))
+    session = SessionLocal()
+    try:
+        jobs = session.query(Job).filter(unfinished).order_by(Job.id).all()
+        return [(job.id, job.file_path, job.content_hash) for job in jobs]
+    finally:
+        session.close()
+
+def referenced_file_keys():
+    """Storage keys named in the file_url of a document or of a queued or running job."""
+    session = SessionLocal()
+    try:
+        urls = session.query(Document.file_url).union(
+            session.query(Job.file_url).filter(Job.status.in_((Job.QUEUED, Job.RUNNING))))
+        return {file_url.rsplit("/", 1)[-1] for file_url, in urls}
+    finally:
+        session.close()
+
+def get_cached_extraction(content_hash: str):
+    session = SessionLocal()
+    try:
+        entry = session.get(ExtractionCache, content_hash)
+        return entry.to_dict() if entry else None
+    finally:
+        session.close()
+
+def put_cached_extraction(content_hash: str, text: str, metadata: dict, model: str, prompt_version: str):
+    session = SessionLocal()
+    try:
+        session.merge(ExtractionCache(
+            content_hash=content_hash,
+            text=text,
+            meta_json=jsonlib.dumps(metadata),
+            model=model,
+            prompt_version=prompt_version,
+        ))
+        session.commit()
+    finally:
+        session.close()
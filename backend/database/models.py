@@ -1,19 +1,231 @@
-from sqlalchemy import Column, Integer, String, Text
+from datetime import datetime, timezone
+from sqlalchemy import DDL, Column, DateTime, Float, Integer, String, Text, event
 from sqlalchemy.orm import declarative_base
-import json
+import math
+import re
+import jsonlib
 
 Base = declarative_base()
 
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+def _to_text(value):
+    value = str(value).strip() if value is not None else ''
+    return value or None
+
+
+# A plain or currency-formatted number: "-$1,200.50", "42", "€ 7.5". Anything
+# else ("1e30", "Approx. 5", "1,200 (was 1,500)") is not taken as a number.
+_NUMBER = re.compile(r"([-+]?)[$€£¥]?\s*(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d+))?")
+
+# The range of SQLite's INTEGER; larger values cannot be stored.
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _parse_number(value):
+    """Return the sign, whole digits and fraction digits of a number string, or None."""
+    match = _NUMBER.fullmatch(str(value).strip()) if value is not None else None
+    if match is None:
+        return None
+    sign, whole, fraction = match.groups()
+    return sign, whole.replace(",", ""), fraction or ""
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            number = float(value)
+        except OverflowError:
+            return None
+    else:
+        parts = _parse_number(value)
+        if parts is None:
+            return None
+        sign, whole, fraction = parts
+        number = float(f"{sign}{whole}.{fraction or 0}")
+    return number if math.isfinite(number) else None
+
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        number = value
+    elif isinstance(value, float):
+        number = int(value) if value.is_integer() else None
+    else:
+        parts = _parse_number(value)
+        if parts is None or parts[2].strip("0"):
+            return None
+        number = int(parts[0] + parts[1])
+    return number if number is not None and _INT_MIN <= number <= _INT_MAX else None
+
+
+# Extracted metadata fields copied into typed, indexed columns so they can be
+# filtered and sorted in SQL: metadata key -> (column attribute, converter).
+TYPED_FIELDS = {
+    "ProductID": ("product_id", _to_int),
+    "Name": ("name", _to_text),
+    "ProductNumber": ("product_number", _to_text),
+    "Color": ("color", _to_text),
+    "StandardCost": ("standard_cost", _to_float),
+    "ListPrice": ("list_price", _to_float),
+    "Size": ("size", _to_text),
+    "ProductLine": ("product_line", _to_text),
+    "Class": ("product_class", _to_text),
+    "Style": ("style", _to_text),
+    "ProductSubcategoryID": ("product_subcategory_id", _to_int),
+    "ProductModelID": ("product_model_id", _to_int),
+}
+
+
+def typed_values(metadata: dict) -> dict:
+    """Typed column values derived from a metadata blob, keyed by column attribute."""
+    return {attr: convert(metadata.get(key)) for key, (attr, convert) in TYPED_FIELDS.items()}
+
+
 class Document(Base):
     __tablename__ = 'documents'
 
     id = Column(Integer, primary_key=True)
     meta_json = Column("metadata", Text, nullable=False)
     file_url = Column(String, nullable=False)
+    # Bumped on every metadata change; used for ETags.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    product_id = Column(Integer, index=True)
+    name = Column(String, index=True)
+    product_number = Column(String, index=True)
+    color = Column(String, index=True)
+    standard_cost = Column(Float, index=True)
+    list_price = Column(Float, index=True)
+    size = Column(String, index=True)
+    product_line = Column(String, index=True)
+    product_class = Column("class", String, index=True)
+    style = Column(String, index=True)
+    product_subcategory_id = Column(Integer, index=True)
+    product_model_id = Column(Integer, index=True)
+
+    def set_metadata(self, metadata: dict):
+        """Store the metadata blob and refresh the typed columns derived from it."""
+        self.meta_json = jsonlib.dumps(metadata)
+        for attr, value in typed_values(metadata).items():
+            setattr(self, attr, value)
 
     def to_dict(self):
         return {
             "id": self.id,
-            "metadata": json.loads(self.meta_json),
+            "metadata": jsonlib.loads(self.meta_json),
             "file_url": self.file_url,
         }
+
+
+# SQLite FTS5 index over the metadata *values* of each document (keys such as
+# "Color" are not indexed). Triggers keep it in sync with every write to
+# documents, whoever makes it.
+_METADATA_VALUES = (
+    "(SELECT group_concat(value, ' ') FROM json_tree({row}.metadata) "
+    "WHERE type NOT IN ('object', 'array'))"
+)
+
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts "
+    "USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN "
+    "INSERT INTO documents_fts(rowid, body) VALUES (new.id, " + _METADATA_VALUES.format(row="new") + "); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF metadata ON documents BEGIN "
+    "DELETE FROM documents_fts WHERE rowid = old.id; "
+    "INSERT INTO documents_fts(rowid, body) VALUES (new.id, " + _METADATA_VALUES.format(row="new") + "); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN "
+    "DELETE FROM documents_fts WHERE rowid = old.id; "
+    "END",
+    "INSERT INTO documents_fts(rowid, body) "
+    "SELECT id, " + _METADATA_VALUES.format(row="documents") + " FROM documents",
+]
+
+for _statement in SEARCH_INDEX_DDL:
+    event.listen(Document.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+event.listen(
+    Document.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS documents_fts").execute_if(dialect="sqlite"),
+)
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default=QUEUED, index=True)
+    file_path = Column(String, nullable=False)
+    file_url = Column(String, nullable=False)
+    # SHA-256 of the upload, so a resumed job still fills the extraction cache.
+    content_hash = Column(String, nullable=True)
+    result_json = Column("result", Text, nullable=True)
+    error = Column(Text, nullable=True)
+    # The worker ("host:pid") that claimed the job; see database/db.py's claim_job.
+    owner = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+    updated_at = Column(DateTime, nullable=False, default=_utcnow, onupdate=_utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "metadata": jsonlib.loads(self.result_json) if self.result_json else None,
+            "file_url": self.file_url,
+            "error": self.error,
+        }
+
+
+class ExtractionCache(Base):
+    __tablename__ = 'extraction_cache'
+
+    content_hash = Column(String(64), primary_key=True)
+    text = Column(Text, nullable=False)
+    meta_json = Column("metadata", Text, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+
+    def to_dict(self):
+        return {
+            "content_hash": self.content_hash,
+            "text": self.text,
+            "metadata": jsonlib.loads(self.meta_json),
+            "model": self.model,
+            "prompt_version": self.prompt_version,
+        }
+
+
+class CacheGeneration(Base):
+    """Single-row counter bumped by every document write.
+
+    Processes compare it with the generation their cached document pages were
+    loaded under, so a write in one worker invalidates the others' caches.
+    Being a single row, it also serialises document writes on databases that
+    would otherwise run them concurrently.
+    """
+    __tablename__ = 'cache_generation'
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+event.listen(
+    CacheGeneration.__table__,
+    "after_create",
+    DDL("INSERT INTO cache_generation (id, generation) VALUES (1, 0)"),
+)
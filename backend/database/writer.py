@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """Write-behind queue that commits concurrent inserts in one transaction.
+
+    Callers ``submit`` a record and block on the returned future. A single
+    background thread takes the first queued record, waits up to
+    ``linger_ms`` for more (at most ``max_batch``), and hands the whole group
+    to ``write_batch``, which must insert them in one transaction and return
+    their ids in order. One commit then covers the whole group. If that
+    transaction fails, each record is written again on its own, so one bad
+    record fails only its own caller.
+    """
+
+    def __init__(self, write_batch: Callable[[Sequence[Any]], List[int]],
+                 max_batch: int = 100, linger_ms: float = 5):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.linger = linger_ms / 1000
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"records": 0, "batches": 0, "retried": 0, "failed": 0}
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def submit(self, record: Any) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((record, future))
+        return future
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Tuple[Any, Future]]) -> None:
+        ids = self.write_batch([record for record, _ in batch])
+        with self._lock:
+            self._stats["records"] += len(batch)
+            self._stats["batches"] += 1
+        for (_, future), doc_id in zip(batch, ids):
+            future.set_result(doc_id)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                self._write(batch)
+                continue
+            except Exception as e:
+                logger.exception("Group commit of %d records failed", len(batch))
+                if len(batch) == 1:
+                    self._fail(batch[0], e)
+                    continue
+
+            # Write the group one record per transaction, so only the bad record fails.
+            for entry in batch:
+                with self._lock:
+                    self._stats["retried"] += 1
+                try:
+                    self._write([entry])
+                except Exception as e:
+                    self._fail(entry, e)
+
+    def _fail(self, entry: Tuple[Any, Future], error: Exception) -> None:
+        with self._lock:
+            self._stats["failed"] += 1
+        entry[1].set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch"] = stats["records"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
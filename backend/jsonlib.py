@@ -0,0 +1,80 @@
+"""JSON encoding and decoding, through orjson when it is installed.
+
+``dumps`` and ``loads`` are drop-in replacements for the json module's, and
+fall back to it for what orjson refuses: integers beyond 64 bits on the way
+out, NaN and Infinity (which older rows may hold) on the way in. Output is
+compact UTF-8. ``JSONProvider`` makes Flask's ``jsonify`` use them too.
+
+``RawJSON`` marks text that is already JSON, such as a document's stored
+metadata; ``dumps_raw`` splices it into its output instead of decoding and
+re-encoding it.
+"""
+import json
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # the json module does the same, slower
+    orjson = None
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_OPTIONS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+class RawJSON(str):
+    """A string holding encoded JSON, written out verbatim by ``dumps_raw``."""
+
+    __slots__ = ()
+
+
+def dumps_raw(obj: Any) -> str:
+    """``dumps`` for dicts and lists that may contain RawJSON values."""
+    if isinstance(obj, RawJSON):
+        return str(obj)
+    if isinstance(obj, dict):
+        return "{" + ",".join(f"{dumps(str(key))}:{dumps_raw(value)}" for key, value in obj.items()) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(dumps_raw(item) for item in obj) + "]"
+    return dumps(obj)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with orjson doing the work when it can."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        indent = kwargs.get("indent")
+        if orjson is None or kwargs.get("cls") or indent not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        option = _OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
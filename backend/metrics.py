@@ -0,0 +1,228 @@
+"""Minimal, dependency-free Prometheus metrics.
+
+Counters, gauges and histograms are kept in process memory behind a lock per
+metric, so recording a sample costs a dict lookup and a few additions.
+``render()`` produces the Prometheus text exposition format served at
+GET /metrics.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return int(sum(state[:-1])) if state else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def register_collector(collect: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]) -> None:
+    """Add a callback yielding ``(name, kind, help, labels, value)`` samples at scrape time.
+
+    Used for values that already live elsewhere, such as cache counters.
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        samples = metric.samples()
+        if samples:
+            lines.extend(metric.header())
+            lines.extend(samples)
+
+    seen = set()
+    for collect in collectors:
+        for name, kind, documentation, labels, value in collect():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across the backend.
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+UPLOAD_STAGE_DURATION = Histogram(
+    "upload_stage_duration_seconds", "Time spent in each upload pipeline stage.", ("stage",))
+DB_OPERATION_DURATION = Histogram(
+    "db_operation_duration_seconds", "Time spent in database functions.", ("operation",))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM API.", ("type",))
+DOCUMENT_PAGES = Histogram(
+    "document_pages", "Pages per parsed PDF.", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+DOCUMENT_BYTES = Histogram(
+    "document_bytes", "Bytes per uploaded file.",
+    buckets=(16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6))
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator recording each call's duration in ``histogram``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app) -> None:
+    """Record per-route latency and in-flight requests, and serve GET /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            REQUESTS_IN_FLIGHT.dec()
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=request.method, route=route, status=response.status_code,
+            )
+        return response
+
+    @app.teardown_request
+    def _release_in_flight(exc):
+        # after_request is skipped when a view raises; keep the gauge balanced.
+        if g.pop("metrics_started", None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+    def metrics_view():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
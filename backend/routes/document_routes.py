@@ -1,17 +1,34 @@
-from flask import Blueprint, request, jsonify, send_from_directory, current_app, abort
+import math
+import zlib
+from flask import Blueprint, Response, request, jsonify, send_file, current_app, abort
 from flasgger import swag_from
+import jsonlib
+from services import extractor, llm_client, storage
+from services.governor import GovernorRejected
 from services.document_services import (
     process_upload,
     list_documents,
     save_document,
     get_document,
-    update_document
+    update_document,
+    enqueue_upload,
+    get_job,
+    process_batch_upload,
+    stream_upload,
+    parse_filters,
+    save_documents_bulk,
+    export_documents,
+    document_version,
+    format_etag,
+    patch_document,
+    get_cache_stats
 )
 
 document_bp = Blueprint('document', __name__)
 
-@document_bp.route('/upload', methods=['POST'])
-@swag_from({
+FILE_MAX_AGE = 365 * 24 * 60 * 60
+
+UPLOAD_SPEC = {
     'tags': ['Document'],
     'consumes': ['multipart/form-data'],
     'parameters': [
@@ -21,9 +38,25 @@ document_bp = Blueprint('document', __name__)
             'type': 'file',
             'required': True,
             'description': 'PDF file to upload'
+        },
+        {
+            'name': 'async',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Set to 1 to queue the extraction and poll GET /jobs/<id>'
+        },
+        {
+            'name': 'stream',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Set to 1 to receive text/event-stream progress events: saved, pages, '
+                           'started, token, fields, then done (metadata and file_url) or error'
         }
     ],
     'responses': {
+        200: {'description': 'With stream=1: server-sent progress events'},
         201: {
             'description': 'Metadata and file URL',
             'schema': {
@@ -34,39 +67,277 @@ document_bp = Blueprint('document', __name__)
                 }
             }
         },
+        202: {
+            'description': 'Extraction job queued',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'job_id': {'type': 'integer'},
+                    'status': {'type': 'string'}
+                }
+            }
+        },
         400: {'description': 'Invalid input'},
-        500: {'description': 'Internal server error'}
+        500: {'description': 'Internal server error'},
+        503: {'description': 'LLM API overloaded or unavailable; retry after the Retry-After header'}
     }
-})
-def upload():
+}
+
+
+def _upload_file():
     if 'file' not in request.files:
-        return jsonify({"error": "No file part in the request"}), 400
+        return None, (jsonify({"error": "No file part in the request"}), 400)
 
     file = request.files['file']
 
     if file.filename == '':
-        return jsonify({"error": "No file selected"}), 400
+        return None, (jsonify({"error": "No file selected"}), 400)
+    return file, None
+
+
+def _wants(name: str, default: str = '0') -> bool:
+    return request.args.get(name, default).lower() in ('1', 'true')
+
+
+def _json_response(obj, raw: bool) -> Response:
+    if raw:
+        return Response(jsonlib.dumps_raw(obj) + "\n", mimetype='application/json')
+    return jsonify(obj)
+
+
+def _unavailable(rejected: GovernorRejected):
+    # The LLM governor turned the call away; tell clients when to try again.
+    response = jsonify({"error": str(rejected)})
+    response.headers['Retry-After'] = str(max(1, math.ceil(rejected.retry_after)))
+    return response, 503
+
+
+@document_bp.route('/upload', methods=['POST'])
+@swag_from(UPLOAD_SPEC)
+def upload():
+    file, error = _upload_file()
+    if error:
+        return error
+
+    run_async = _wants('async', '1' if current_app.config['ASYNC_UPLOADS'] else '0')
 
     try:
+        if _wants('stream'):
+            events = stream_upload(file, current_app.config['UPLOAD_FOLDER'], request.host_url)
+            return _event_stream(events)
+        if run_async:
+            job = enqueue_upload(file, current_app.config['UPLOAD_FOLDER'], request.host_url)
+            response = jsonify(job)
+            response.headers['Location'] = f"/jobs/{job['job_id']}"
+            return response, 202
         result = process_upload(file, current_app.config['UPLOAD_FOLDER'], request.host_url)
         return jsonify(result), 201
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except GovernorRejected as e:
+        return _unavailable(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _event_stream(events):
+    lines = (f"event: {event}\ndata: {jsonlib.dumps(data)}\n\n" for event, data in events)
+    response = Response(lines, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies such as nginx from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@document_bp.route('/upload/batch', methods=['POST'])
+@swag_from({
+    'tags': ['Document'],
+    'consumes': ['multipart/form-data'],
+    'produces': ['application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'files',
+            'in': 'formData',
+            'type': 'array',
+            'items': {'type': 'file'},
+            'collectionFormat': 'multi',
+            'required': True,
+            'description': 'PDF files to upload'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'One JSON object per line, in completion order, with either '
+                           'metadata and file_url or an error for the file at index'
+        },
+        400: {'description': 'Invalid input'}
+    }
+})
+def upload_batch():
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({"error": "No files in the request"}), 400
+
+    results = process_batch_upload(files, current_app.config['UPLOAD_FOLDER'], request.host_url)
+    lines = (jsonlib.dumps(result) + "\n" for result in results)
+    return Response(lines, mimetype='application/x-ndjson')
+
+
+@document_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Document'],
+    'parameters': [
+        {'name': 'job_id', 'in': 'path', 'type': 'integer', 'required': True}
+    ],
+    'responses': {
+        200: {
+            'description': 'Job status, with metadata once done',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'status': {'type': 'string', 'enum': ['queued', 'running', 'done', 'failed']},
+                    'metadata': {'type': 'object'},
+                    'file_url': {'type': 'string'},
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {'description': 'Job not found'},
+        400: {'description': 'Invalid ID'}
+    }
+})
+def job_status(job_id):
+    try:
+        job = get_job(job_id)
+        if not job:
+            abort(404, description="Job not found")
+        return jsonify(job), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@document_bp.route('/cache/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Document'],
+    'responses': {
+        200: {
+            'description': 'Hit/miss counters of the extraction, document and page caches, and the '
+                           'group-commit writer\'s counters (null unless DB_GROUP_COMMIT is on)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'extraction': {'type': 'object'},
+                    'documents': {'type': 'object'},
+                    'pages': {'type': 'object'},
+                    'group_commit': {'type': 'object'}
+                }
+            }
+        }
+    }
+})
+def cache_stats():
+    return jsonify(get_cache_stats()), 200
+
+
+@document_bp.route('/llm/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Document'],
+    'responses': {
+        200: {
+            'description': 'LLM client call, retry and latency counters, and the call governor\'s state',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'calls': {'type': 'integer'},
+                    'retries': {'type': 'integer'},
+                    'errors': {'type': 'integer'},
+                    'latency_total': {'type': 'number'},
+                    'latency_last': {'type': 'number'},
+                    'latency_avg': {'type': 'number'},
+                    'governor': {
+                        'type': 'object',
+                        'properties': {
+                            'limit': {'type': 'integer'},
+                            'in_flight': {'type': 'integer'},
+                            'queued': {'type': 'integer'},
+                            'tokens': {'type': 'number'},
+                            'rate_per_minute': {'type': 'number'},
+                            'circuit': {'type': 'string', 'enum': ['closed', 'half_open', 'open']},
+                            'consecutive_failures': {'type': 'integer'},
+                            'granted': {'type': 'integer'},
+                            'decreases': {'type': 'integer'},
+                            'trips': {'type': 'integer'},
+                            'rejected': {'type': 'object'}
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def llm_stats():
+    return jsonify(llm_client.stats()), 200
+
+
+@document_bp.route('/extractor/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Document'],
+    'responses': {
+        200: {
+            'description': 'Per-backend extractor counters; hit_rate of "rules" is the share of LLM calls avoided',
+            'schema': {
+                'type': 'object',
+                'additionalProperties': {
+                    'type': 'object',
+                    'properties': {
+                        'calls': {'type': 'integer'},
+                        'hits': {'type': 'integer'},
+                        'complete': {'type': 'integer'},
+                        'invalid': {'type': 'integer'},
+                        'fields': {'type': 'integer'},
+                        'hit_rate': {'type': 'number'}
+                    }
+                }
+            }
+        }
+    }
+})
+def extractor_stats():
+    return jsonify(extractor.stats()), 200
+
+
 @document_bp.route('/documents', methods=['GET'])
 @swag_from({
     'tags': ['Document'],
     'parameters': [
         {'name': 'page', 'in': 'query', 'type': 'string', 'required': False, 'default': '1'},
         {'name': 'per_page', 'in': 'query', 'type': 'string', 'required': False, 'default': '10'},
-        {'name': 'search', 'in': 'query', 'type': 'string', 'required': False}
+        {'name': 'search', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'after', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Cursor mode: return documents with an id greater than this'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Cursor mode: page size'},
+        {'name': 'name', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'product_number', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'color', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'size', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'product_line', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'class', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'style', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'product_id', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'product_subcategory_id', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'product_model_id', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'list_price_min', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'list_price_max', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'standard_cost_min', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'standard_cost_max', 'in': 'query', 'type': 'number', 'required': False},
+        {'name': 'sort', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Field to sort by, e.g. list_price or -list_price for descending'}
     ],
     'responses': {
         200: {
-            'description': 'List of documents',
+            'description': 'List of documents; in cursor mode an object with items and next_cursor',
             'schema': {
                 'type': 'array',
                 'items': {
@@ -87,16 +358,68 @@ def list_all_documents():
     page = request.args.get('page', '1')
     per_page = request.args.get('per_page', '10')
     search = request.args.get('search', '').lower()
+    after = request.args.get('after')
+    limit = request.args.get('limit')
 
     try:
-        documents = list_documents(page, per_page, search)
-        return jsonify(documents), 200
+        filters = parse_filters(request.args)
+        raw = current_app.config.get('JSON_RAW_RESPONSES', False)
+        documents = list_documents(page, per_page, search, after=after, limit=limit,
+                                   filters=filters, sort=request.args.get('sort'), raw=raw)
+        return _json_response(documents, raw), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception:
         return jsonify({"error": "Failed to list documents"}), 500
 
 
+def _gzip_stream(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@document_bp.route('/documents/export', methods=['GET'])
+@swag_from({
+    'tags': ['Document'],
+    'produces': ['application/x-ndjson', 'text/csv'],
+    'parameters': [
+        {'name': 'format', 'in': 'query', 'type': 'string', 'required': False, 'default': 'ndjson',
+         'enum': ['ndjson', 'csv']},
+        {'name': 'search', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'sort', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Same filters and sort fields as GET /documents are accepted'}
+    ],
+    'responses': {
+        200: {'description': 'All matching documents, gzip-encoded if the client accepts it'},
+        400: {'description': 'Invalid input'}
+    }
+})
+def export_all_documents():
+    fmt = request.args.get('format', 'ndjson').lower()
+    search = request.args.get('search', '').lower()
+
+    try:
+        filters = parse_filters(request.args)
+        chunks = export_documents(fmt, search, filters=filters, sort=request.args.get('sort'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    headers = {
+        'Content-Disposition': f'attachment; filename=documents.{fmt}',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.accept_encodings:
+        headers['Content-Encoding'] = 'gzip'
+        chunks = _gzip_stream(chunks)
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
 @document_bp.route('/save', methods=['POST'])
 @swag_from({
     'tags': ['Document'],
@@ -133,11 +456,78 @@ def save():
         return jsonify({"error": "Failed to save document"}), 500
 
 
+@document_bp.route('/save/bulk', methods=['POST'])
+@swag_from({
+    'tags': ['Document'],
+    'consumes': ['application/json', 'application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'JSON array, or one JSON object per line with Content-Type application/x-ndjson',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'file_url': {'type': 'string'},
+                        'metadata': {'type': 'object'}
+                    },
+                    'required': ['file_url', 'metadata']
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Per-record id or error, in request order',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'saved': {'type': 'integer'},
+                    'failed': {'type': 'integer'},
+                    'results': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'index': {'type': 'integer'},
+                                'id': {'type': 'integer'},
+                                'error': {'type': 'string'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Body is not a JSON array or NDJSON'},
+        500: {'description': 'Failed to save documents'}
+    }
+})
+def save_bulk():
+    if request.mimetype == 'application/x-ndjson':
+        records = (line for line in request.stream if line.strip())
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({"error": "Expected a JSON array of documents"}), 400
+
+    try:
+        results = save_documents_bulk(records)
+    except Exception:
+        return jsonify({"error": "Failed to save documents"}), 500
+
+    failed = sum(1 for result in results if "error" in result)
+    return jsonify({"saved": len(results) - failed, "failed": failed, "results": results}), 200
+
+
 @document_bp.route('/document/<int:doc_id>', methods=['GET'])
 @swag_from({
     'tags': ['Document'],
     'parameters': [
-        {'name': 'doc_id', 'in': 'path', 'type': 'integer', 'required': True}
+        {'name': 'doc_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {'name': 'If-None-Match', 'in': 'header', 'type': 'string', 'required': False}
     ],
     'responses': {
         200: {
@@ -151,16 +541,32 @@ def save():
                 }
             }
         },
+        304: {'description': 'Document unchanged since the ETag in If-None-Match'},
         404: {'description': 'Document not found'},
         400: {'description': 'Invalid ID'}
     }
 })
 def get(doc_id):
     try:
-        doc = get_document(doc_id)
-        if not doc:
+        version = document_version(doc_id)
+        if version is None:
             abort(404, description="Document not found")
-        return jsonify(doc), 200
+        etag = format_etag(doc_id, version)
+
+        # Answer revalidations from the version column alone, without
+        # loading and re-serialising the metadata.
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            raw = current_app.config.get('JSON_RAW_RESPONSES', False)
+            # The version just read validates a cached copy without another query.
+            doc = get_document(doc_id, raw=raw, version=version)
+            if not doc:
+                abort(404, description="Document not found")
+            response = _json_response(doc, raw)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
@@ -200,6 +606,106 @@ def update(doc_id):
         return jsonify({"error": "Failed to update document"}), 500
 
 
+@document_bp.route('/document/<int:doc_id>', methods=['PATCH'])
+@swag_from({
+    'tags': ['Document'],
+    'consumes': ['application/merge-patch+json', 'application/json'],
+    'parameters': [
+        {'name': 'doc_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {
+            'name': 'If-Match',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'ETag from GET /document/<id>; the patch is refused if the document changed since'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'description': 'JSON Merge Patch (RFC 7396): listed fields are set, null removes a field',
+                'properties': {
+                    'metadata': {'type': 'object'}
+                },
+                'required': ['metadata']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Document patched; the ETag header carries the new version',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'version': {'type': 'integer'},
+                    'metadata': {'type': 'object'}
+                }
+            }
+        },
+        400: {'description': 'Invalid patch'},
+        404: {'description': 'Document not found'},
+        412: {'description': 'Document changed since the ETag in If-Match'},
+        500: {'description': 'Failed to update document'}
+    }
+})
+def patch(doc_id):
+    data = request.get_json(force=True, silent=True)
+    try:
+        version = document_version(doc_id)
+        if version is None:
+            return jsonify({"error": "Document not found"}), 404
+
+        expected_version = None
+        if request.if_match and not request.if_match.star_tag:
+            if not request.if_match.contains(format_etag(doc_id, version)):
+                return _precondition_failed(doc_id, version)
+            expected_version = version
+
+        result = patch_document(doc_id, data, expected_version)
+        if result is None:
+            # The document changed or was deleted between the check above and the update.
+            version = document_version(doc_id)
+            if version is None or expected_version is None:
+                return jsonify({"error": "Document not found"}), 404
+            return _precondition_failed(doc_id, version)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        return jsonify({"error": "Failed to update document"}), 500
+
+    response = jsonify(result)
+    response.set_etag(format_etag(doc_id, result["version"]))
+    return response
+
+
+def _precondition_failed(doc_id, version):
+    response = jsonify({"error": "Document was modified; fetch it again and retry", "version": version})
+    response.set_etag(format_etag(doc_id, version))
+    return response, 412
+
+
 @document_bp.route('/files/<filename>')
 def serve_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    # Files are stored under the hash of their bytes and never change, so
+    # browsers may cache them indefinitely and the key itself is the ETag.
+    # send_file already answers If-None-Match with 304 and Range requests
+    # with 206 partial content.
+    store = storage.get_storage(current_app.config['UPLOAD_FOLDER'])
+    try:
+        path = store.local_path(filename)
+        download_name = store.info(filename)["filename"]
+    except FileNotFoundError:
+        abort(404)
+    response = send_file(
+        path,
+        download_name=download_name,
+        conditional=True,
+        etag=filename,
+        max_age=FILE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,65 @@
+"""The event loop behind JOB_EXECUTOR=async.
+
+A single loop runs on a daemon thread for the life of the process, so the
+shared AsyncLLMClient keeps its connections on one loop no matter which
+request or job thread started the work. Blocking calls (pypdf, SQLite) are
+handed to a bounded thread pool, and ``bounded`` caps how many extractions
+are in flight at once, which keeps memory flat under load.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from config import ASYNC_MAX_EXTRACTIONS, ASYNC_PARSE_WORKERS
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool: Optional[ThreadPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _pool, _slots
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _pool = ThreadPoolExecutor(max_workers=ASYNC_PARSE_WORKERS, thread_name_prefix="aio-blocking")
+            _slots = asyncio.Semaphore(ASYNC_MAX_EXTRACTIONS)
+            threading.Thread(target=_loop.run_forever, name="aio-loop", daemon=True).start()
+        return _loop
+
+
+def submit(coro: Awaitable[T]) -> "Future[T]":
+    """Schedule ``coro`` on the shared loop from any thread."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+async def run(coro: Awaitable[T]) -> T:
+    """Await ``coro`` on the shared loop from a coroutine running on another loop."""
+    return await asyncio.wrap_future(submit(coro))
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call in the bounded thread pool without stalling the loop."""
+    get_loop()
+    return await asyncio.get_running_loop().run_in_executor(_pool, partial(fn, *args, **kwargs))
+
+
+async def bounded(coro: Awaitable[T]) -> T:
+    """Await ``coro`` once fewer than ASYNC_MAX_EXTRACTIONS others are running."""
+    get_loop()
+    async with _slots:
+        return await coro
+
+
+def shutdown() -> None:
+    global _loop, _pool, _slots
+    with _lock:
+        if _loop is not None:
+            _loop.call_soon_threadsafe(_loop.stop)
+            _pool.shutdown(wait=False)
+        _loop = _pool = _slots = None
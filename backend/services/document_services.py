@@ -1,13 +1,41 @@
-import os
-from typing import Optional, Dict, Any
+import csv
+import io
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Optional, Dict, Any, Iterable, List
 from werkzeug.utils import secure_filename
-from services import extractor, pdf_parser
+import jsonlib
+from metrics import DOCUMENT_BYTES, UPLOAD_STAGE_DURATION
+from config import (
+    BATCH_PARSE_WORKERS, BATCH_LLM_WORKERS, BULK_BATCH_SIZE, FILE_GC_GRACE, JOB_EXECUTOR, JOB_STALE_AFTER,
+    MAX_PER_PAGE
+)
+from services import aio, extraction_cache, extractor, job_queue, pdf_parser, singleflight, storage
+from services.governor import GovernorRejected
 from database.db import (
     insert_document,
+    insert_documents,
     get_documents,
+    iter_documents,
     get_document_by_id,
-    update_document_metadata
+    get_document_version,
+    update_document_metadata,
+    patch_document_metadata,
+    cache_stats,
+    writer_stats,
+    insert_job,
+    update_job,
+    get_job_by_id,
+    get_unfinished_jobs,
+    referenced_file_keys
 )
+from database.models import Job
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
@@ -16,40 +44,346 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def process_upload(file, upload_folder: str, host_url: str) -> Dict[str, Any]:
+def _save_upload(file, upload_folder: str):
+    """Store an upload and return its StoredFile and a local path to parse."""
     filename = secure_filename(file.filename)
 
     if not allowed_file(filename):
         raise ValueError("Unsupported file type")
 
-    path = os.path.join(upload_folder, filename)
+    store = storage.get_storage(upload_folder)
+    with UPLOAD_STAGE_DURATION.time(stage="save"):
+        stored = store.save(file.stream, filename)
+    DOCUMENT_BYTES.observe(stored.size)
+    return stored, store.local_path(stored.key)
 
-    # Resolve filename conflicts
-    if os.path.exists(path):
-        base, ext = os.path.splitext(filename)
-        counter = 1
-        while os.path.exists(path):
-            filename = f"{base}_{counter}{ext}"
-            path = os.path.join(upload_folder, filename)
-            counter += 1
 
-    file.save(path)
+def _file_url(host_url: str, key: str) -> str:
+    base_url = host_url.rstrip('/')
+    return f"{base_url}/files/{key}"
 
-    try:
+
+def collect_garbage(upload_folder: str, grace: float = FILE_GC_GRACE) -> List[str]:
+    """Delete stored files that no document or unfinished job refers to; return their keys.
+
+    Identical uploads share one file, so a failed upload leaves its file in
+    place: another upload of the same bytes may be using it. Files last
+    uploaded less than ``grace`` seconds ago are kept, as their document may
+    not have been saved yet.
+    """
+    store = storage.get_storage(upload_folder)
+    cutoff = time.time() - grace
+    candidates = [key for key, uploaded_at in store.iter_files() if uploaded_at < cutoff]
+    if not candidates:
+        return []
+
+    referenced = referenced_file_keys()
+    removed = [key for key in candidates if key not in referenced]
+    for key in removed:
+        store.delete(key)
+    return removed
+
+
+def extract_file(path: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+    with UPLOAD_STAGE_DURATION.time(stage="parse"):
         text = pdf_parser.extract_text_from_pdf(path)
+    with UPLOAD_STAGE_DURATION.time(stage="extract"):
         metadata = extractor.extract_metadata_from_text(text)
+    if content_hash:
+        extraction_cache.store(content_hash, text, metadata)
+    return metadata
+
+
+def process_upload(file, upload_folder: str, host_url: str) -> Dict[str, Any]:
+    stored, path = _save_upload(file, upload_folder)
+    file_url = _file_url(host_url, stored.key)
+
+    cached = extraction_cache.lookup(stored.content_hash)
+    if cached is not None:
+        return {"metadata": cached, "file_url": file_url}
+
+    try:
+        # Identical uploads in flight share one extraction; see services/singleflight.py.
+        metadata = singleflight.extractions.do(
+            stored.content_hash, extract_file, path, stored.content_hash,
+            recheck=partial(extraction_cache.lookup, stored.content_hash, record=False))
+    except GovernorRejected:
+        # The LLM is overloaded or down; callers answer 503 rather than 500.
+        raise
     except Exception as e:
-        if os.path.exists(path):
-            os.remove(path)
         raise RuntimeError(f"Failed to extract metadata: {str(e)}")
 
-    base_url = host_url.rstrip('/')
-    file_url = f"{base_url}/files/{filename}"
-
     return {"metadata": metadata, "file_url": file_url}
 
 
-def list_documents(page: str, per_page: str, search: Optional[str] = ''):
+async def extract_file_async(path: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Coroutine form of ``extract_file``; run it on the shared loop (services/aio.py)."""
+    with UPLOAD_STAGE_DURATION.time(stage="parse"):
+        text = await aio.run_blocking(pdf_parser.extract_text_from_pdf, path)
+    with UPLOAD_STAGE_DURATION.time(stage="extract"):
+        metadata = await extractor.extract_metadata_from_text_async(text)
+    if content_hash:
+        await aio.run_blocking(extraction_cache.store, content_hash, text, metadata)
+    return metadata
+
+
+def stream_upload(file, upload_folder: str, host_url: str):
+    """Save an upload and extract it in the background, reporting progress.
+
+    The file is saved before this returns, so the request's stream may be
+    closed afterwards. The returned generator yields ``(event, data)`` pairs:
+    ``saved`` right away, ``pages`` as each page is parsed, the extractor's
+    ``started``/``token``/``fields`` events, and finally ``done`` with the
+    metadata or ``error``.
+    """
+    stored, path = _save_upload(file, upload_folder)
+    file_url = _file_url(host_url, stored.key)
+    events = queue.Queue()
+    events.put(("saved", {"filename": stored.filename, "file_url": file_url}))
+
+    cached = extraction_cache.lookup(stored.content_hash)
+    if cached is not None:
+        events.put(("done", {"metadata": cached, "file_url": file_url, "cached": True}))
+        events.put(None)
+    else:
+        _get_llm_pool().submit(_extract_with_events, path, stored.content_hash, file_url, events)
+
+    def drain():
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+
+    return drain()
+
+
+def _extract_with_events(path: str, content_hash: str, file_url: str, events: queue.Queue) -> None:
+    def emit(event, data):
+        events.put((event, data))
+
+    try:
+        with UPLOAD_STAGE_DURATION.time(stage="parse"):
+            text = pdf_parser.extract_text_from_pdf(
+                path, progress=lambda done, total: emit("pages", {"parsed": done, "total": total}))
+        with UPLOAD_STAGE_DURATION.time(stage="extract"):
+            metadata = extractor.extract_metadata_from_text(text, on_event=emit)
+        extraction_cache.store(content_hash, text, metadata)
+        emit("done", {"metadata": metadata, "file_url": file_url})
+    except Exception as e:
+        emit("error", {"error": f"Failed to extract metadata: {str(e)}"})
+    finally:
+        events.put(None)
+
+
+_pools_lock = threading.Lock()
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_llm_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_parse_pool():
+    global _parse_pool
+    with _pools_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=BATCH_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
+def _submit_parse(path: str) -> Future:
+    global _parse_pool
+    pool = _get_parse_pool()
+    try:
+        return pool.submit(pdf_parser.extract_text_from_pdf, path)
+    except BrokenProcessPool:
+        # A worker died (out of memory or a crash on a bad PDF), which breaks the
+        # whole pool for good. Replace it and try once more.
+        with _pools_lock:
+            if _parse_pool is pool:
+                _parse_pool = None
+        pool.shutdown(wait=False)
+        return _get_parse_pool().submit(pdf_parser.extract_text_from_pdf, path)
+
+
+def _get_llm_pool():
+    global _llm_pool
+    with _pools_lock:
+        if _llm_pool is None:
+            _llm_pool = ThreadPoolExecutor(max_workers=BATCH_LLM_WORKERS, thread_name_prefix="llm")
+        return _llm_pool
+
+
+def _extract_parsed(text: str, content_hash: str) -> Dict[str, Any]:
+    with UPLOAD_STAGE_DURATION.time(stage="extract"):
+        metadata = extractor.extract_metadata_from_text(text)
+    extraction_cache.store(content_hash, text, metadata)
+    return metadata
+
+
+def process_batch_upload(files, upload_folder: str, host_url: str):
+    """Start extracting many uploads concurrently.
+
+    Every file is saved and queued before this returns, so the request's file
+    streams may be closed afterwards. The returned generator yields one result
+    per file as it finishes, carrying the file's ``index`` in the request and
+    either ``metadata``/``file_url`` or an ``error``; a failing file never
+    aborts the rest of the batch.
+    """
+    results = queue.Queue()
+
+    def fail(index, name, message):
+        results.put({"index": index, "filename": name, "error": message})
+
+    def on_extracted(index, name, stored, file_url, future):
+        try:
+            metadata = future.result()
+        except Exception as e:
+            fail(index, name, f"Failed to extract metadata: {str(e)}")
+            return
+        results.put({"index": index, "filename": name, "metadata": metadata, "file_url": file_url})
+
+    def on_parsed(index, name, stored, file_url, future):
+        try:
+            text = future.result()
+            llm_future = _get_llm_pool().submit(_extract_parsed, text, stored.content_hash)
+        except Exception as e:
+            fail(index, name, f"Failed to extract metadata: {str(e)}")
+            return
+        llm_future.add_done_callback(partial(on_extracted, index, name, stored, file_url))
+
+    for index, file in enumerate(files):
+        try:
+            stored, path = _save_upload(file, upload_folder)
+        except ValueError as e:
+            results.put({"index": index, "filename": file.filename, "error": str(e)})
+            continue
+
+        file_url = _file_url(host_url, stored.key)
+        cached = extraction_cache.lookup(stored.content_hash)
+        if cached is not None:
+            results.put({"index": index, "filename": file.filename, "metadata": cached, "file_url": file_url})
+            continue
+
+        try:
+            parse_future = _submit_parse(path)
+        except BrokenProcessPool as e:
+            results.put({"index": index, "filename": file.filename, "error": f"Failed to parse file: {e}"})
+            continue
+        parse_future.add_done_callback(
+            partial(on_parsed, index, file.filename, stored, file_url)
+        )
+
+    def drain(remaining):
+        for _ in range(remaining):
+            yield results.get()
+
+    return drain(len(files))
+
+
+def enqueue_upload(file, upload_folder: str, host_url: str) -> Dict[str, Any]:
+    stored, path = _save_upload(file, upload_folder)
+    job_id = insert_job(path, _file_url(host_url, stored.key), stored.content_hash)
+
+    cached = extraction_cache.lookup(stored.content_hash)
+    if cached is not None:
+        update_job(job_id, Job.DONE, metadata=cached)
+        return {"job_id": job_id, "status": Job.DONE}
+
+    if JOB_EXECUTOR == "async":
+        job_queue.submit_async(job_id, extract_file_async, path, stored.content_hash)
+    else:
+        job_queue.submit(job_id, extract_file, path, stored.content_hash)
+    return {"job_id": job_id, "status": Job.QUEUED}
+
+
+def get_job(job_id: int):
+    if not isinstance(job_id, int) or job_id < 1:
+        raise ValueError("Invalid job ID")
+
+    return get_job_by_id(job_id)
+
+
+def resume_jobs() -> list:
+    """Re-queue jobs left queued, or running with no update for JOB_STALE_AFTER seconds.
+
+    Called once by the server entry point (app.py, ``flask resume-jobs``), not
+    by every worker; claims keep a job that two processes resume from running
+    twice. Returns the jobs' futures.
+    """
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_AFTER)
+    return [job_queue.submit(job_id, extract_file, path, content_hash, stale_before=stale_before)
+            for job_id, path, content_hash in get_unfinished_jobs(stale_before)]
+
+
+# Query parameters accepted by GET /documents, mapped to typed Document columns.
+TEXT_FILTERS = {
+    "name": "name",
+    "product_number": "product_number",
+    "color": "color",
+    "size": "size",
+    "product_line": "product_line",
+    "class": "product_class",
+    "style": "style",
+}
+INT_FILTERS = {
+    "product_id": "product_id",
+    "product_subcategory_id": "product_subcategory_id",
+    "product_model_id": "product_model_id",
+}
+RANGE_FILTERS = {
+    "list_price": "list_price",
+    "standard_cost": "standard_cost",
+}
+SORT_FIELDS = {"id": "id", **TEXT_FILTERS, **INT_FILTERS, **RANGE_FILTERS}
+
+
+def parse_filters(args) -> Dict[str, Any]:
+    """Turn request query parameters into ``get_documents`` filters."""
+    filters = {}
+    for param, attr in TEXT_FILTERS.items():
+        if args.get(param):
+            filters[attr] = args.get(param)
+
+    for param, attr in INT_FILTERS.items():
+        if args.get(param):
+            try:
+                filters[attr] = int(args.get(param))
+            except ValueError:
+                raise ValueError(f"{param} must be an integer")
+
+    for param, attr in RANGE_FILTERS.items():
+        for bound in ("min", "max"):
+            value = args.get(f"{param}_{bound}")
+            if value:
+                try:
+                    filters[f"{attr}_{bound}"] = float(value)
+                except ValueError:
+                    raise ValueError(f"{param}_{bound} must be a number")
+    return filters
+
+
+def parse_sort(sort: Optional[str]) -> Optional[str]:
+    if not sort:
+        return None
+    descending = sort.startswith("-")
+    attr = SORT_FIELDS.get(sort.lstrip("-"))
+    if attr is None:
+        raise ValueError(f"Cannot sort by {sort.lstrip('-')}")
+    return f"-{attr}" if descending else attr
+
+
+def list_documents(page: str, per_page: str, search: Optional[str] = '',
+                   after: Optional[str] = None, limit: Optional[str] = None,
+                   filters: Optional[Dict[str, Any]] = None, sort: Optional[str] = None, raw: bool = False):
+    sort = parse_sort(sort)
+
+    if after is not None or limit is not None:
+        if sort:
+            raise ValueError("Sorting is not supported with after/limit pagination")
+        return _list_documents_after(after, limit if limit is not None else per_page, search, filters, raw)
+
     try:
         page = int(page)
         per_page = int(per_page)
@@ -59,11 +393,83 @@ def list_documents(page: str, per_page: str, search: Optional[str] = ''):
     if page < 1 or per_page < 1:
         raise ValueError("Page and per_page must be positive integers")
 
+    per_page = min(per_page, MAX_PER_PAGE)
     offset = (page - 1) * per_page
-    return get_documents(offset=offset, limit=per_page, search_query=search)
+    return get_documents(offset=offset, limit=per_page, search_query=search, filters=filters, sort=sort, raw=raw)
 
 
-def save_document(data: Dict[str, Any]) -> None:
+def _list_documents_after(after: Optional[str], limit: str, search: Optional[str],
+                          filters: Optional[Dict[str, Any]], raw: bool = False) -> Dict[str, Any]:
+    try:
+        after = int(after) if after is not None else 0
+        limit = int(limit)
+    except Exception:
+        raise ValueError("After and limit must be integers")
+
+    if after < 0 or limit < 1:
+        raise ValueError("After must be non-negative and limit positive")
+
+    limit = min(limit, MAX_PER_PAGE)
+    # One extra row tells us whether another page exists.
+    documents = get_documents(limit=limit + 1, search_query=search, after_id=after, filters=filters, raw=raw)
+    items = documents[:limit]
+    next_cursor = items[-1]["id"] if len(documents) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+EXPORT_FORMATS = {'ndjson', 'csv'}
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _buffered(pieces: Iterable[str]):
+    # Coalesce per-row strings into ~64 KiB chunks for the response stream.
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _csv_rows(documents):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def row(values):
+        writer.writerow(values)
+        line = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return line
+
+    yield row(["id", "file_url", *extractor.METADATA_FIELDS])
+    for doc in documents:
+        metadata = doc["metadata"]
+        values = []
+        for field in extractor.METADATA_FIELDS:
+            value = metadata.get(field, "")
+            values.append(jsonlib.dumps(value) if isinstance(value, (dict, list)) else value)
+        yield row([doc["id"], doc["file_url"], *values])
+
+
+def export_documents(fmt: str, search: Optional[str] = '', filters: Optional[Dict[str, Any]] = None,
+                     sort: Optional[str] = None):
+    """Return a generator of text chunks with every matching document as NDJSON or CSV."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Format must be one of: " + ", ".join(sorted(EXPORT_FORMATS)))
+
+    documents = iter_documents(search_query=search, filters=filters, sort=parse_sort(sort))
+    if fmt == 'csv':
+        return _buffered(_csv_rows(documents))
+    return _buffered(jsonlib.dumps(doc) + "\n" for doc in documents)
+
+
+def validate_document(data: Dict[str, Any]):
     if not isinstance(data, dict):
         raise ValueError("Invalid data format")
 
@@ -76,14 +482,94 @@ def save_document(data: Dict[str, Any]) -> None:
     if not metadata or not isinstance(metadata, dict):
         raise ValueError("Missing or invalid metadata")
 
+    return file_url, metadata
+
+
+def save_document(data: Dict[str, Any]) -> None:
+    file_url, metadata = validate_document(data)
     insert_document(file_url, metadata)
 
 
-def get_document(doc_id: int):
+def save_documents_bulk(records: Iterable[Any], batch_size: int = BULK_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Validate and insert many documents, ``batch_size`` rows per transaction.
+
+    A record is either a dict or one NDJSON line (str/bytes). Returns one
+    ``{"index", "id"}`` or ``{"index", "error"}`` entry per record, in order.
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be a positive integer")
+
+    results = []
+    batch = []
+
+    def insert(rows):
+        try:
+            ids = insert_documents([(file_url, metadata) for _, file_url, metadata in rows])
+        except Exception:
+            if len(rows) == 1:
+                results.append({"index": rows[0][0], "error": "Failed to save document"})
+                return
+            # One bad row rolls back the whole transaction; retry each half
+            # so the rows that can be saved still are.
+            middle = len(rows) // 2
+            insert(rows[:middle])
+            insert(rows[middle:])
+        else:
+            results.extend({"index": index, "id": doc_id} for (index, _, _), doc_id in zip(rows, ids))
+
+    def flush():
+        insert(batch)
+        batch.clear()
+
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, (str, bytes)):
+                try:
+                    record = jsonlib.loads(record)
+                except ValueError:
+                    raise ValueError("Invalid JSON")
+            file_url, metadata = validate_document(record)
+        except ValueError as e:
+            results.append({"index": index, "error": str(e)})
+            continue
+
+        batch.append((index, file_url, metadata))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    results.sort(key=lambda result: result["index"])
+    return results
+
+
+def get_document(doc_id: int, raw: bool = False, version: Optional[int] = None):
     if not isinstance(doc_id, int) or doc_id < 1:
         raise ValueError("Invalid document ID")
 
-    return get_document_by_id(doc_id)
+    return get_document_by_id(doc_id, raw=raw, version=version)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return {"extraction": extraction_cache.stats(), **cache_stats(), "group_commit": writer_stats()}
+
+
+def format_etag(doc_id: int, version: int) -> str:
+    return f"{doc_id}-{version}"
+
+
+def document_version(doc_id: int) -> Optional[int]:
+    if not isinstance(doc_id, int) or doc_id < 1:
+        raise ValueError("Invalid document ID")
+
+    return get_document_version(doc_id)
+
+
+def document_etag(doc_id: int) -> Optional[str]:
+    """Return the ETag of a document's current version, or None if it does not exist."""
+    version = document_version(doc_id)
+    return format_etag(doc_id, version) if version is not None else None
 
 
 def update_document(doc_id: int, data: Dict[str, Any]) -> None:
@@ -99,3 +585,31 @@ def update_document(doc_id: int, data: Dict[str, Any]) -> None:
         raise ValueError("Missing or invalid metadata")
 
     update_document_metadata(doc_id, metadata)
+
+
+def patch_document(doc_id: int, data: Dict[str, Any], expected_version: Optional[int] = None):
+    """Apply a JSON Merge Patch to a document and return its new version and metadata.
+
+    ``data`` is a merge patch of the document, in which only ``metadata`` may
+    appear. Returns None if the document is gone or no longer at
+    ``expected_version``.
+    """
+    if not isinstance(doc_id, int) or doc_id < 1:
+        raise ValueError("Invalid document ID")
+
+    if not isinstance(data, dict):
+        raise ValueError("Invalid data format")
+
+    unknown = sorted(set(data) - {"metadata"})
+    if unknown:
+        raise ValueError(f"Only metadata can be patched, not: {', '.join(unknown)}")
+
+    patch = data.get("metadata")
+    if not isinstance(patch, dict):
+        raise ValueError("Missing or invalid metadata")
+
+    result = patch_document_metadata(doc_id, patch, expected_version)
+    if result is None:
+        return None
+    version, metadata = result
+    return {"id": doc_id, "version": version, "metadata": metadata}
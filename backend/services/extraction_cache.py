@@ -0,0 +1,68 @@
+import threading
+from typing import Any, Dict, Optional
+
+import metrics
+from config import LLM_MODEL
+from database.db import get_cached_extraction, put_cached_extraction
+from services.extractor import PROMPT_VERSION
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stale": 0}
+
+
+def _count(*names: str) -> None:
+    with _lock:
+        for name in names:
+            _counters[name] += 1
+
+
+def lookup(content_hash: str, record: bool = True) -> Optional[Dict[str, Any]]:
+    """Return cached metadata for an upload, or None if it must be extracted.
+
+    Entries made with a different LLM model or prompt are treated as misses and
+    are overwritten by the next ``store`` for the same hash. Pass
+    ``record=False`` to look again for an upload whose lookup was already
+    counted, so hit_rate stays per upload.
+    """
+    entry = get_cached_extraction(content_hash)
+    if entry is None:
+        if record:
+            _count("misses")
+        return None
+
+    if entry["model"] != LLM_MODEL or entry["prompt_version"] != PROMPT_VERSION:
+        if record:
+            _count("stale", "misses")
+        return None
+
+    if record:
+        _count("hits")
+    return entry["metadata"]
+
+
+def store(content_hash: str, text: str, metadata: Dict[str, Any]) -> None:
+    put_cached_extraction(content_hash, text, metadata, LLM_MODEL, PROMPT_VERSION)
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["misses"]
+    counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+    return counters
+
+
+def reset_stats() -> None:
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
+
+
+def _collect_stats():
+    for name, value in stats().items():
+        if name != "hit_rate":
+            yield ("extraction_cache_lookups_total", "counter", "Extraction cache lookups by outcome.",
+                   {"outcome": name}, value)
+
+
+metrics.register_collector(_collect_stats)
@@ -1,56 +1,553 @@
-import requests
-import json
-from config import LLM_API_BASE, LLM_API_KEY, LLM_MODEL
-
-def extract_metadata_from_text(text):
-    prompt = f"""
-        Extract the following fields from the text in the exact order below, and respond strictly in JSON format without extra text or explanation:
-
-        {{
-        "ProductID": "",
-        "Name": "",
-        "ProductNumber": "",
-        "MakeFlag": "",
-        "FinishedGoodsFlag": "",
-        "Color": "",
-        "StandardCost": "",
-        "ListPrice": "",
-        "Size": "",
-        "ProductLine": "",
-        "Class": "",
-        "Style": "",
-        "ProductSubcategoryID": "",
-        "ProductModelID": ""
-        }}
-
-        If any field is missing in the text, return an empty string ("") for that field. Do not include any explanations, comments, or additional text.
-
-
-        Text:
-        {text}
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import jsonlib
+import metrics
+from config import (
+    LLM_MODEL,
+    EXTRACTOR_BACKENDS,
+    RULES_MIN_FIELDS,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_CHARS_PER_TOKEN,
+    PROMPT_SPAN_CONTEXT,
+    PROMPT_MAX_CHUNKS,
+    LLM_BATCH_TOKEN_BUDGET,
+    LLM_BATCH_MAX_DOCS,
+    LLM_BATCH_LINGER_MS,
+)
+from metrics import LLM_TOKENS
+from services import llm_client, prompt_builder
+from services.llm_batcher import Batcher
+
+PROMPT_TEMPLATE = """
+    Extract the following fields from the text in the exact order below, and respond strictly in JSON format without extra text or explanation:
+
+    {fields}
+
+    If any field is missing in the text, return an empty string ("") for that field. Do not include any explanations, comments, or additional text.
+
+
+    Text:
+    {text}
+"""
+
+# The fields requested by PROMPT_TEMPLATE, in order.
+METADATA_FIELDS = (
+    "ProductID",
+    "Name",
+    "ProductNumber",
+    "MakeFlag",
+    "FinishedGoodsFlag",
+    "Color",
+    "StandardCost",
+    "ListPrice",
+    "Size",
+    "ProductLine",
+    "Class",
+    "Style",
+    "ProductSubcategoryID",
+    "ProductModelID",
+)
+
+
+def _field_skeleton(fields: Iterable[str]) -> str:
+    lines = ",\n".join(f'    "{field}": ""' for field in fields)
+    return "{\n" + lines + "\n    }"
+
+
+def build_prompt(text: str, fields: Sequence[str] = METADATA_FIELDS) -> str:
+    return PROMPT_TEMPLATE.format(fields=_field_skeleton(fields), text=text)
+
+
+BATCH_PROMPT_TEMPLATE = """
+    Extract the following fields from each of the documents below, in the exact order below, and respond strictly in JSON format without extra text or explanation: a JSON array with one object per document, each giving the document's index:
+
+    {fields}
+
+    If any field is missing in a document, return an empty string ("") for that field. Do not include any explanations, comments, or additional text.
+
+
+    Documents:
+    {documents}
+"""
+
+
+def build_batch_prompt(texts: Sequence[str], fields: Sequence[str] = METADATA_FIELDS) -> str:
+    skeleton = _field_skeleton(fields).replace("{\n", '{\n    "index": 0,\n', 1)
+    documents = "\n\n".join(f"[Document {index}]\n{text}" for index, text in enumerate(texts))
+    return BATCH_PROMPT_TEMPLATE.format(fields=skeleton, documents=documents)
+
+
+class Extractor(ABC):
+    """A metadata extraction backend.
+
+    ``extract`` returns the subset of ``fields`` it could read from the text;
+    fields it cannot fill are left out so the next backend can try them.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def extract(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        ...
+
+    def stream(self, text: str, fields: Sequence[str], on_token: Callable[[str], None]) -> Dict[str, Any]:
+        """Like ``extract``, passing raw output to ``on_token`` as it arrives, if the backend can."""
+        return self.extract(text, fields)
+
+    async def extract_async(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        """Coroutine form of ``extract``; backends that do no I/O can keep this default."""
+        return self.extract(text, fields)
+
+
+# Labels used by the single-product catalog template, e.g. "Standard Cost: $500.00".
+FIELD_LABELS = {
+    "ProductID": ("Product ID", "ProductID"),
+    "Name": ("Name", "Product Name"),
+    "ProductNumber": ("Product Number", "ProductNumber"),
+    "MakeFlag": ("Make Flag", "MakeFlag"),
+    "FinishedGoodsFlag": ("Finished Goods Flag", "FinishedGoodsFlag"),
+    "Color": ("Color", "Colour"),
+    "StandardCost": ("Standard Cost", "StandardCost"),
+    "ListPrice": ("List Price", "ListPrice"),
+    "Size": ("Size",),
+    "ProductLine": ("Product Line", "ProductLine"),
+    "Class": ("Class",),
+    "Style": ("Style",),
+    "ProductSubcategoryID": ("Subcategory ID", "Product Subcategory ID", "ProductSubcategoryID"),
+    "ProductModelID": ("Model ID", "Product Model ID", "ProductModelID"),
+}
+
+# The template's heading line: "Mountain Bike (#MB-100)".
+_HEADING = re.compile(r"^[ \t]*(?P<name>[^\n:()]+?)[ \t]*\(#(?P<number>[^)\s]+)\)[ \t]*$", re.MULTILINE)
+
+
+def _prompt_version() -> str:
+    settings = [
+        build_prompt("{text}"), build_batch_prompt(["{text}"]), prompt_builder.SPAN_SEPARATOR,
+        EXTRACTOR_BACKENDS, RULES_MIN_FIELDS, FIELD_LABELS, _HEADING.pattern,
+        PROMPT_TOKEN_BUDGET, PROMPT_CHARS_PER_TOKEN, PROMPT_SPAN_CONTEXT, PROMPT_MAX_CHUNKS,
+    ]
+    return hashlib.sha256(jsonlib.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+# Changes whenever the prompts, the backend chain, the rules or the prompt budget
+# change, so extractions cached under other settings are not served (see
+# services/extraction_cache.py).
+PROMPT_VERSION = _prompt_version()
+
+
+def _label_pattern(labels: Sequence[str]):
+    alternatives = "|".join(re.escape(label) for label in labels)
+    return re.compile(rf"^[ \t]*(?:{alternatives})[ \t]*:[ \t]*(?P<value>\S[^\n]*?)[ \t]*$",
+                      re.MULTILINE | re.IGNORECASE)
+
+
+class RuleBasedExtractor(Extractor):
+    """Read fields straight from ``Label: value`` lines of templated catalogs.
+
+    Documents with fewer than ``min_fields`` recognised fields are treated as
+    not matching the template and yield nothing, so free text that happens to
+    contain "Color: ..." is still left to the LLM.
+    """
+
+    name = "rules"
+
+    def __init__(self, min_fields: int = RULES_MIN_FIELDS):
+        self.min_fields = min_fields
+        self._patterns = {field: _label_pattern(labels) for field, labels in FIELD_LABELS.items()}
+
+    def extract(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        found = {}
+        for field in fields:
+            pattern = self._patterns.get(field)
+            match = pattern.search(text) if pattern else None
+            if match:
+                found[field] = match.group("value")
+
+        if ("Name" in fields and "Name" not in found) or ("ProductNumber" in fields and "ProductNumber" not in found):
+            heading = _HEADING.search(text)
+            if heading:
+                if "Name" in fields:
+                    found.setdefault("Name", heading.group("name"))
+                if "ProductNumber" in fields:
+                    found.setdefault("ProductNumber", heading.group("number"))
+
+        return found if len(found) >= self.min_fields else {}
+
+
+# Lines worth keeping when a document exceeds the prompt budget (services/prompt_builder.py).
+SPAN_MARKERS = (
+    *(_label_pattern(labels) for labels in FIELD_LABELS.values()),
+    _HEADING,
+    re.compile(r"\b[A-Z]{2,3}-\d{2,}\b"),
+)
+
+
+class LLMExtractor(Extractor):
+    """Ask the chat-completions API for the fields; returns whatever JSON it answers.
+
+    Texts over the prompt budget are reduced or chunked by prompt_builder;
+    chunked answers are merged field by field.
+    """
+
+    name = "llm"
+
+    def extract(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        return self._extract_chunks(prompt_builder.plan(text, SPAN_MARKERS), fields)
+
+    def stream(self, text: str, fields: Sequence[str], on_token: Callable[[str], None]) -> Dict[str, Any]:
+        chunks = prompt_builder.plan(text, SPAN_MARKERS)
+        if len(chunks) > 1:
+            return self._extract_chunks(chunks, fields)
+        return self._stream_chunk(chunks[0], fields, on_token)
+
+    async def extract_async(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        chunks = prompt_builder.plan(text, SPAN_MARKERS)
+        results = await asyncio.gather(*(self._extract_chunk_async(chunk, fields) for chunk in chunks))
+        return results[0] if len(results) == 1 else prompt_builder.merge_results(results, fields)
+
+    def _extract_chunks(self, chunks: Sequence[str], fields: Sequence[str]) -> Dict[str, Any]:
+        results = prompt_builder.map_chunks(lambda chunk: self._extract_chunk(chunk, fields), chunks)
+        return results[0] if len(results) == 1 else prompt_builder.merge_results(results, fields)
+
+    @staticmethod
+    def _body(text: str, fields: Sequence[str], stream: bool = False) -> Dict[str, Any]:
+        return LLMExtractor._chat(build_prompt(text, fields), stream)
+
+    @staticmethod
+    def _chat(prompt: str, stream: bool = False) -> Dict[str, Any]:
+        body = {
+            "model": LLM_MODEL,
+            "messages": [
+                {"role": "system", "content": "You are a document information extractor."},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        if stream:
+            body["stream"] = True
+        return body
+
+    def _request(self, text: str, fields: Sequence[str], stream: bool = False):
+        return self._post(self._body(text, fields, stream), stream)
+
+    @staticmethod
+    def _post(body: Dict[str, Any], stream: bool = False):
+        response = llm_client.client.post(body, stream=stream)
+
+        if response.status_code != 200:
+            raise Exception(f"LLM API Error: {response.text}")
+        return response
+
+    @staticmethod
+    def _record_usage(usage: Optional[Dict[str, Any]]) -> None:
+        usage = usage or {}
+        for kind in ("prompt", "completion"):
+            if usage.get(f"{kind}_tokens"):
+                LLM_TOKENS.inc(usage[f"{kind}_tokens"], type=kind)
+
+    def _parse_completion(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        self._record_usage(data.get("usage"))
+
+        content = data["choices"][0]["message"]["content"]
+
+        parsed_data = jsonlib.loads(content)
+
+        return parsed_data
+
+    def _extract_chunk(self, text: str, fields: Sequence[str]) -> Dict[str, Any]:
+        return self._parse_completion(self._request(text, fields).json())
+
+    async def _extract_chunk_async(self, text: str, fields: Sequence[str]) -> Dict[str, Any]:
+        response = await llm_client.get_async_client().post(self._body(text, fields))
+
+        if response.status_code != 200:
+            raise Exception(f"LLM API Error: {response.text}")
+        return self._parse_completion(response.json())
+
+    def _stream_chunk(self, text: str, fields: Sequence[str], on_token: Callable[[str], None]) -> Dict[str, Any]:
+        # The API answers with server-sent events: "data: {chunk}" lines, then "data: [DONE]".
+        response = self._request(text, fields, stream=True)
+        content = []
+        try:
+            for raw in response.iter_lines():
+                line = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = jsonlib.loads(data)
+                self._record_usage(event.get("usage"))
+                choices = event.get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    content.append(delta)
+                    on_token(delta)
+        finally:
+            response.close()
+
+        return jsonlib.loads("".join(content))
+
+
+def _split_batch(content: str, requests: Sequence[Tuple[str, Sequence[str]]]) -> List[Optional[Dict[str, Any]]]:
+    """Match a batch answer back to its documents; None where a document has no usable object."""
+    try:
+        answer = jsonlib.loads(content)
+    except ValueError:
+        return [None] * len(requests)
+
+    if isinstance(answer, dict):
+        entries = answer.items()
+    elif isinstance(answer, list):
+        entries = ((item.get("index"), item) for item in answer if isinstance(item, dict))
+    else:
+        entries = ()
+    by_index: Dict[int, Dict[str, Any]] = {}
+    for index, item in entries:
+        if isinstance(item, dict) and not isinstance(index, bool):
+            try:
+                by_index.setdefault(int(index), item)
+            except (TypeError, ValueError):
+                continue
+
+    results = []
+    for index, (_, fields) in enumerate(requests):
+        item = by_index.get(index, {})
+        found = {field: item[field] for field in fields
+                 if field in item and isinstance(item[field], (str, int, float))}
+        results.append(found or None)
+    return results
+
+
+def _extract_batch(requests: Sequence[Tuple[str, Sequence[str]]]) -> List[Optional[Dict[str, Any]]]:
+    if len(requests) == 1:
+        text, fields = requests[0]
+        return [LLMExtractor()._extract_chunk(text, fields)]
+
+    # One field list serves the whole group; each document keeps only the fields it asked for.
+    fields = list(dict.fromkeys(field for _, wanted in requests for field in wanted))
+    response = LLMExtractor._post(LLMExtractor._chat(build_batch_prompt([text for text, _ in requests], fields)))
+    data = response.json()
+    LLMExtractor._record_usage(data.get("usage"))
+    return _split_batch(data["choices"][0]["message"]["content"], requests)
+
+
+_batcher_lock = threading.Lock()
+_batcher: Optional[Batcher] = None
+
+
+def _get_batcher() -> Batcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = Batcher("extraction", _extract_batch, LLM_BATCH_TOKEN_BUDGET,
+                               LLM_BATCH_MAX_DOCS, LLM_BATCH_LINGER_MS)
+        return _batcher
+
+
+class BatchingLLMExtractor(LLMExtractor):
+    """LLMExtractor that shares one prompt between documents extracted at the same time.
+
+    Short documents wait briefly in a Batcher (services/llm_batcher.py) and
+    are sent together, saving a round trip and the instructions per
+    document. A document the batch answer leaves out, or answers with
+    something other than an object of fields, is asked about again on its
+    own. Documents that need chunking are never batched.
+    """
+
+    name = "llm_batch"
+
+    def __init__(self, batcher: Optional[Batcher] = None):
+        self._batcher = batcher
+
+    @property
+    def batcher(self) -> Batcher:
+        return self._batcher or _get_batcher()
+
+    def _submit(self, chunk: str, fields: Sequence[str]):
+        return self.batcher.submit((chunk, tuple(fields)), prompt_builder.estimate_tokens(chunk))
+
+    def extract(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        chunks = prompt_builder.plan(text, SPAN_MARKERS)
+        if len(chunks) > 1:
+            return self._extract_chunks(chunks, fields)
+        found = self._submit(chunks[0], fields).result()
+        return self._extract_chunk(chunks[0], fields) if found is None else found
+
+    def stream(self, text: str, fields: Sequence[str], on_token: Callable[[str], None]) -> Dict[str, Any]:
+        # A batch answer covers several documents; there is nothing per document to stream.
+        return self.extract(text, fields)
+
+    async def extract_async(self, text: str, fields: Sequence[str] = METADATA_FIELDS) -> Dict[str, Any]:
+        chunks = prompt_builder.plan(text, SPAN_MARKERS)
+        if len(chunks) > 1:
+            return await super().extract_async(text, fields)
+        found = await asyncio.wrap_future(self._submit(chunks[0], fields))
+        return await self._extract_chunk_async(chunks[0], fields) if found is None else found
+
+
+BACKENDS = {
+    RuleBasedExtractor.name: RuleBasedExtractor,
+    LLMExtractor.name: LLMExtractor,
+    BatchingLLMExtractor.name: BatchingLLMExtractor,
+}
+
+
+def _build_chain(names: Iterable[str]) -> List[Extractor]:
+    try:
+        return [BACKENDS[name]() for name in names]
+    except KeyError as e:
+        raise ValueError(f"Unknown extractor backend: {e.args[0]}")
+
+
+chain = _build_chain(EXTRACTOR_BACKENDS)
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[str, int]] = {}
+
+
+def _record(backend: str, fields: int, complete: bool, invalid: bool = False) -> None:
+    with _lock:
+        counters = _counters.setdefault(backend, {"calls": 0, "hits": 0, "complete": 0, "invalid": 0, "fields": 0})
+        counters["calls"] += 1
+        counters["hits"] += int(fields > 0)
+        counters["complete"] += int(complete)
+        counters["invalid"] += int(invalid)
+        counters["fields"] += fields
+
+
+def _missing(metadata: Dict[str, Any]) -> List[str]:
+    return [field for field in METADATA_FIELDS if metadata.get(field) in (None, "")]
+
+
+def _merge(backend: Extractor, metadata: Dict[str, Any], found: Dict[str, Any], missing: Sequence[str]) -> List[str]:
+    """Add a backend's answer to ``metadata`` and return the fields it filled.
+
+    An answer that is not an object of fields (an LLM may return a list, a
+    string or null) fills nothing and is counted as ``invalid``.
     """
+    if not isinstance(found, dict):
+        _record(backend.name, 0, complete=False, invalid=True)
+        return []
+    filled = [field for field in missing if found.get(field) not in (None, "")]
+    # Backends may answer with extra keys; keep them, but never overwrite earlier values.
+    for key, value in found.items():
+        if metadata.get(key) in (None, ""):
+            metadata[key] = value
+    _record(backend.name, len(filled), complete=len(filled) == len(missing))
+    return filled
+
+
+def _ordered(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    ordered = {field: metadata[field] for field in METADATA_FIELDS if field in metadata}
+    ordered.update((key, value) for key, value in metadata.items() if key not in ordered)
+    return ordered
 
-    headers = {
-        "Authorization": f"Bearer {LLM_API_KEY}",
-        "Content-Type": "application/json"
-    }
 
-    body = {
-        "model": LLM_MODEL,
-        "messages": [
-            {"role": "system", "content": "You are a document information extractor."},
-            {"role": "user", "content": prompt}
-        ]
-    }
+# A completed "Field": "value" pair in partially streamed JSON.
+_PARTIAL_FIELD = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _stream(backend: Extractor, text: str, fields: Sequence[str],
+            on_event: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+    # Output after the last complete field; only this is scanned as tokens
+    # arrive, so a long answer is not re-read from the start on every token.
+    pending = ""
+    sent: Dict[str, str] = {}
+
+    def on_token(delta: str) -> None:
+        nonlocal pending
+        pending += delta
+        on_event("token", {"backend": backend.name, "text": delta})
+        partial = {}
+        consumed = 0
+        for match in _PARTIAL_FIELD.finditer(pending):
+            field, raw = match.groups()
+            consumed = match.end()
+            value = jsonlib.loads(f'"{raw}"')
+            if field in fields and value and sent.get(field) != value:
+                partial[field] = sent[field] = value
+        pending = pending[consumed:]
+        if partial:
+            on_event("fields", {"backend": backend.name, "fields": partial, "partial": True})
+
+    return backend.stream(text, fields, on_token)
+
+
+def extract_metadata_from_text(text, backends: Optional[Sequence[Extractor]] = None,
+                               on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+    """Run the extractor chain, asking each backend only for the fields still missing.
+
+    The first backend's values win; the chain stops as soon as every field in
+    METADATA_FIELDS is filled, so templated catalogs never reach the LLM.
+
+    With ``on_event``, progress is reported as it happens: ``started`` when a
+    backend is called, ``token`` for each piece of streamed LLM output,
+    ``fields`` with ``partial`` set for fields parsed from the stream so far,
+    and ``fields`` with everything a backend filled once it returns.
+    """
+    metadata: Dict[str, Any] = {}
+    for backend in chain if backends is None else backends:
+        missing = _missing(metadata)
+        if not missing:
+            break
+        if on_event is None:
+            found = backend.extract(text, missing)
+        else:
+            on_event("started", {"backend": backend.name, "fields": missing})
+            found = _stream(backend, text, missing, on_event)
+        filled = _merge(backend, metadata, found, missing)
+        if on_event is not None and filled:
+            on_event("fields", {"backend": backend.name, "fields": {field: metadata[field] for field in filled}})
+    return _ordered(metadata)
+
+
+async def extract_metadata_from_text_async(text, backends: Optional[Sequence[Extractor]] = None):
+    """Coroutine form of ``extract_metadata_from_text`` for JOB_EXECUTOR=async."""
+    metadata: Dict[str, Any] = {}
+    for backend in chain if backends is None else backends:
+        missing = _missing(metadata)
+        if not missing:
+            break
+        _merge(backend, metadata, await backend.extract_async(text, missing), missing)
+    return _ordered(metadata)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Per-backend counters.
+
+    ``calls`` counts documents a backend was asked about, ``hits`` those it
+    filled at least one field of, ``complete`` those it finished so no later
+    backend was called, and ``invalid`` those it answered with something
+    other than an object of fields. For the rule-based backend, ``hit_rate`` is the
+    share of LLM calls avoided.
+    """
+    with _lock:
+        result = {name: dict(counters) for name, counters in _counters.items()}
+    for counters in result.values():
+        counters["hit_rate"] = counters["complete"] / counters["calls"] if counters["calls"] else 0.0
+    return result
 
-    response = requests.post(LLM_API_BASE, headers=headers, json=body)
 
-    if response.status_code != 200:
-        raise Exception(f"LLM API Error: {response.text}")
+def reset_stats() -> None:
+    with _lock:
+        _counters.clear()
 
-    content = response.json()["choices"][0]["message"]["content"]
 
-    parsed_data = json.loads(content)
+def _collect_stats():
+    backends = stats()
+    for name, counters in backends.items():
+        for outcome in ("calls", "hits", "complete", "invalid"):
+            yield ("extractor_documents_total", "counter", "Documents offered to each extractor backend by outcome.",
+                   {"backend": name, "outcome": outcome}, counters[outcome])
+    for name, counters in backends.items():
+        yield ("extractor_fields_total", "counter", "Metadata fields filled by each extractor backend.",
+               {"backend": name}, counters["fields"])
 
-    return parsed_data
 
+metrics.register_collector(_collect_stats)
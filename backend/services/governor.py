@@ -0,0 +1,272 @@
+"""Process-wide admission control for LLM calls.
+
+Every HTTP attempt to the LLM API takes a slot from the governor first. A
+slot needs three things:
+
+* the circuit breaker to be closed: after LLM_BREAKER_THRESHOLD consecutive
+  failures (5xx or connection errors) calls are refused for
+  LLM_BREAKER_COOLDOWN seconds, then a single probe call decides whether it
+  closes again;
+* a free place under the concurrency limit, which follows AIMD: it grows by
+  about one per limit's worth of fast successes and halves on a 429, a 5xx
+  or a call slower than LLM_LATENCY_TARGET;
+* a token from a bucket refilled at LLM_RATE_PER_MINUTE.
+
+Callers that cannot get a slot wait up to LLM_QUEUE_TIMEOUT seconds and are
+then rejected with GovernorRejected; with a timeout of 0 they are rejected
+at once. Waits that cannot end before the deadline (an open breaker, a probe
+still in flight, or an empty bucket) are rejected straight away instead of
+holding a thread. The rejection carries a ``retry_after`` hint in seconds.
+"""
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+import metrics
+from config import (
+    LLM_RATE_PER_MINUTE,
+    LLM_RATE_BURST,
+    LLM_CONCURRENCY_INITIAL,
+    LLM_CONCURRENCY_MIN,
+    LLM_CONCURRENCY_MAX,
+    LLM_LATENCY_TARGET,
+    LLM_BREAKER_THRESHOLD,
+    LLM_BREAKER_COOLDOWN,
+    LLM_QUEUE_TIMEOUT,
+)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+# Outcomes passed to Slot.done.
+SUCCESS, THROTTLED, FAILURE = "success", "throttled", "failure"
+
+# Longest an async waiter sleeps before checking again; threads are woken
+# as soon as a slot is released.
+POLL_INTERVAL = 0.05
+
+
+class GovernorRejected(RuntimeError):
+    """Raised when no slot could be had before the deadline."""
+
+    def __init__(self, reason: str, message: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Slot:
+    """A granted call; report how it went with ``done`` (once)."""
+
+    def __init__(self, governor: "Governor", started: float, probe: bool):
+        self._governor = governor
+        self.started = started
+        self.probe = probe
+        self._finished = False
+
+    def done(self, outcome: str) -> None:
+        if not self._finished:
+            self._finished = True
+            self._governor._release(self, outcome)
+
+
+class Governor:
+    def __init__(self, rate_per_minute: float = LLM_RATE_PER_MINUTE, burst: int = LLM_RATE_BURST,
+                 initial_limit: int = LLM_CONCURRENCY_INITIAL, min_limit: int = LLM_CONCURRENCY_MIN,
+                 max_limit: int = LLM_CONCURRENCY_MAX, latency_target: float = LLM_LATENCY_TARGET,
+                 breaker_threshold: int = LLM_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = LLM_BREAKER_COOLDOWN,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1, burst)
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.queue_timeout = queue_timeout
+        self.initial_limit = initial_limit
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the learned limit, breaker state and counters; calls in flight are kept."""
+        with self._cond:
+            self._limit = float(min(self.max_limit, max(self.min_limit, self.initial_limit)))
+            self._tokens = float(self.burst)
+            self._refilled = self._clock()
+            # Calls started before the last decrease do not shrink the limit again.
+            self._decreased_at = -math.inf
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = 0.0
+            self._probing = False
+            self._stats = {"granted": 0, "decreases": 0, "trips": 0, "rejected": {"timeout": 0, "open": 0}}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_minute > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_per_minute / 60)
+        self._refilled = now
+
+    def _try_acquire(self, now: float):
+        """Grant a slot, or return why not and how long a wait may take."""
+        if self._state == OPEN:
+            if now - self._opened_at < self.breaker_cooldown:
+                return "open", self._opened_at + self.breaker_cooldown - now
+            self._state = HALF_OPEN
+        if self._state == HALF_OPEN and self._probing:
+            # Only the probe may call until it answers, and nothing says when.
+            return "open", math.inf
+        if self._in_flight >= self.limit:
+            return "timeout", None
+        if self.rate_per_minute > 0:
+            self._refill(now)
+            if self._tokens < 1:
+                return "timeout", (1 - self._tokens) * 60 / self.rate_per_minute
+            self._tokens -= 1
+
+        probe = self._state == HALF_OPEN
+        self._probing = self._probing or probe
+        self._in_flight += 1
+        self._stats["granted"] += 1
+        return Slot(self, now, probe), None
+
+    def _reject(self, reason: str, wait_for: Optional[float]) -> GovernorRejected:
+        self._stats["rejected"][reason] += 1
+        if reason == "open":
+            retry_after = self.breaker_cooldown if wait_for is None or math.isinf(wait_for) else wait_for
+            return GovernorRejected(reason, "LLM API unavailable: circuit breaker open", retry_after)
+        retry_after = 1.0 if wait_for is None else wait_for
+        return GovernorRejected(reason, "LLM API busy: no call slot within the queue timeout", retry_after)
+
+    def _poll(self, deadline: float) -> Union[Slot, float]:
+        """Grant a slot, or return how long to wait before trying again."""
+        now = self._clock()
+        result, wait_for = self._try_acquire(now)
+        if isinstance(result, Slot):
+            return result
+        remaining = deadline - now
+        if remaining <= 0 or (wait_for is not None and wait_for > remaining):
+            raise self._reject(result, wait_for)
+        return remaining if wait_for is None else min(remaining, wait_for)
+
+    def acquire(self, timeout: Optional[float] = None) -> Slot:
+        """Block until a slot is granted or ``timeout`` (LLM_QUEUE_TIMEOUT) runs out."""
+        deadline = self._clock() + (self.queue_timeout if timeout is None else timeout)
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    result = self._poll(deadline)
+                    if isinstance(result, Slot):
+                        return result
+                    self._cond.wait(result)
+            finally:
+                self._waiting -= 1
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> Slot:
+        """``acquire`` for coroutines: waits by sleeping rather than blocking the loop."""
+        deadline = self._clock() + (self.queue_timeout if timeout is None else timeout)
+        with self._cond:
+            self._waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    result = self._poll(deadline)
+                if isinstance(result, Slot):
+                    return result
+                await asyncio.sleep(min(result, POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+    def _release(self, slot: Slot, outcome: str) -> None:
+        with self._cond:
+            now = self._clock()
+            self._in_flight -= 1
+            if slot.probe:
+                self._probing = False
+
+            slow = outcome == SUCCESS and now - slot.started > self.latency_target
+            if outcome == SUCCESS and not slow:
+                # Until the first decrease the limit grows by one per success,
+                # like TCP slow start, to find the API's capacity quickly.
+                step = 1 if self._decreased_at == -math.inf else 1 / self._limit
+                self._limit = min(self.max_limit, self._limit + step)
+            elif slot.started > self._decreased_at:
+                self._limit = max(self.min_limit, self._limit / 2)
+                self._decreased_at = now
+                self._stats["decreases"] += 1
+            if outcome == THROTTLED:
+                # The API says we are over its rate; stop spending the burst.
+                self._tokens = min(self._tokens, 0.0)
+
+            if outcome == FAILURE:
+                self._failures += 1
+                if slot.probe or self._failures >= self.breaker_threshold:
+                    if self._state != OPEN:
+                        self._stats["trips"] += 1
+                    self._state = OPEN
+                    self._opened_at = now
+            else:
+                self._failures = 0
+                if slot.probe:
+                    self._state = CLOSED
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            state = self._state
+            if state == OPEN and self._clock() - self._opened_at >= self.breaker_cooldown:
+                state = HALF_OPEN
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queued": self._waiting,
+                "tokens": round(self._tokens, 2),
+                "rate_per_minute": self.rate_per_minute,
+                "circuit": state,
+                "consecutive_failures": self._failures,
+                "granted": self._stats["granted"],
+                "decreases": self._stats["decreases"],
+                "trips": self._stats["trips"],
+                "rejected": dict(self._stats["rejected"]),
+            }
+
+
+def outcome_for_status(status_code: int) -> str:
+    if status_code == 429:
+        return THROTTLED
+    if status_code >= 500:
+        return FAILURE
+    return SUCCESS
+
+
+llm = Governor()
+
+_CIRCUIT_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _collect_stats():
+    current = llm.stats()
+    yield "llm_concurrency_limit", "gauge", "Current AIMD limit on concurrent LLM calls.", {}, current["limit"]
+    yield "llm_in_flight", "gauge", "LLM calls holding a governor slot.", {}, current["in_flight"]
+    yield "llm_queue_depth", "gauge", "Callers waiting for a governor slot.", {}, current["queued"]
+    yield ("llm_circuit_state", "gauge", "LLM circuit breaker: 0 closed, 1 half-open, 2 open.", {},
+           _CIRCUIT_STATES[current["circuit"]])
+    for reason, count in current["rejected"].items():
+        yield ("llm_rejections_total", "counter", "LLM calls refused by the governor.",
+               {"reason": reason}, count)
+
+
+metrics.register_collector(_collect_stats)
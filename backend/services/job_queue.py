@@ -0,0 +1,105 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from config import JOB_EXECUTOR, JOB_WORKERS
+from database.db import claim_job, update_job
+from database.models import Job
+from services import aio
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_workers: Optional[ThreadPoolExecutor] = None
+_processes: Optional[ProcessPoolExecutor] = None
+
+
+def _get_workers() -> ThreadPoolExecutor:
+    global _workers, _processes
+    with _lock:
+        if _workers is None:
+            if JOB_EXECUTOR not in ("thread", "process", "async"):
+                raise ValueError("JOB_EXECUTOR must be 'thread', 'process' or 'async'")
+            _workers = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+            if JOB_EXECUTOR == "process":
+                # Threads only track job state; the parse + LLM work runs in
+                # child processes so pypdf is not serialised by the GIL.
+                _processes = ProcessPoolExecutor(
+                    max_workers=JOB_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+        return _workers
+
+
+def _owner() -> str:
+    # Evaluated per job: worker processes forked after import get their own pid.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _run(job_id: int, fn: Callable[..., Any], args: tuple,
+         on_error: Optional[Callable[[], None]], stale_before: Optional[datetime]) -> None:
+    owner = _owner()
+    if not claim_job(job_id, owner, stale_before):
+        logger.info("Job %s was claimed by another worker", job_id)
+        return
+    try:
+        if _processes is not None:
+            result = _processes.submit(fn, *args).result()
+        else:
+            result = fn(*args)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        if on_error:
+            on_error()
+        update_job(job_id, Job.FAILED, error=str(e), owner=owner)
+        return
+    update_job(job_id, Job.DONE, metadata=result, owner=owner)
+
+
+def submit(job_id: int, fn: Callable[..., Any], *args: Any,
+           on_error: Optional[Callable[[], None]] = None, stale_before: Optional[datetime] = None):
+    """Run ``fn(*args)`` in the worker pool and record its outcome on the job row.
+
+    The job only runs if this process claims it (database/db.py's claim_job):
+    when queued, or when running but not updated since ``stale_before``.
+    """
+    return _get_workers().submit(_run, job_id, fn, args, on_error, stale_before)
+
+
+async def _run_async(job_id: int, coro_fn: Callable[..., Any], args: tuple,
+                     on_error: Optional[Callable[[], None]]) -> None:
+    owner = _owner()
+    if not await aio.run_blocking(claim_job, job_id, owner):
+        logger.info("Job %s was claimed by another worker", job_id)
+        return
+    try:
+        result = await aio.bounded(coro_fn(*args))
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        if on_error:
+            on_error()
+        await aio.run_blocking(update_job, job_id, Job.FAILED, error=str(e), owner=owner)
+        return
+    await aio.run_blocking(update_job, job_id, Job.DONE, metadata=result, owner=owner)
+
+
+def submit_async(job_id: int, coro_fn: Callable[..., Any], *args: Any,
+                 on_error: Optional[Callable[[], None]] = None):
+    """Like ``submit`` for a coroutine function, run on the shared event loop (services/aio.py)."""
+    return aio.submit(_run_async(job_id, coro_fn, args, on_error))
+
+
+def shutdown(wait: bool = True) -> None:
+    global _workers, _processes
+    with _lock:
+        if _workers is not None:
+            _workers.shutdown(wait=wait)
+        if _processes is not None:
+            _processes.shutdown(wait=wait)
+        _workers = None
+        _processes = None
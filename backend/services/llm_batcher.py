@@ -0,0 +1,118 @@
+"""Group concurrent small requests into one LLM call.
+
+Callers ``submit`` an item with its estimated token cost and wait on the
+returned future. A background thread takes the first queued item, waits up
+to ``linger_ms`` for more, and hands the group to ``run_batch`` once the
+linger window closes, ``max_items`` are queued, or the next item would take
+the group past ``token_budget``; that item starts the next group. An item
+over the budget on its own still runs, alone.
+
+``run_batch`` returns one result per item, in order, with None for items
+the call left unanswered; an exception fails the whole group. A result list
+of the wrong length cannot be matched to the items, so every item in the
+group is left unanswered. Like
+database/writer.py's GroupCommitWriter, but bounded by tokens rather than
+rows.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Batcher:
+    def __init__(self, name: str, run_batch: Callable[[Sequence[Any]], List[Any]],
+                 token_budget: int, max_items: int = 16, linger_ms: float = 20):
+        self.name = name
+        self.run_batch = run_batch
+        self.token_budget = token_budget
+        self.max_items = max(1, max_items)
+        self.linger = linger_ms / 1000
+        self._queue: "queue.Queue[Tuple[Any, int, Future]]" = queue.Queue()
+        # An item that did not fit the previous group opens the next one.
+        self._carried: Optional[Tuple[Any, int, Future]] = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"items": 0, "unanswered": 0, "batches": 0, "tokens": 0}
+        _batchers.append(self)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"batch-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any, tokens: int) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, tokens, future))
+        return future
+
+    def _collect(self) -> List[Tuple[Any, int, Future]]:
+        first, self._carried = self._carried or self._queue.get(), None
+        batch, used = [first], first[1]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if used + entry[1] > self.token_budget:
+                self._carried = entry
+                break
+            batch.append(entry)
+            used += entry[1]
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                logger.warning("Batch of %d %s requests failed: %s", len(batch), self.name, e)
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            if len(results) != len(batch):
+                logger.warning("Batch of %d %s requests returned %d results", len(batch), self.name, len(results))
+                results = [None] * len(batch)
+
+            with self._lock:
+                self._stats["items"] += len(batch)
+                self._stats["unanswered"] += sum(result is None for result in results)
+                self._stats["batches"] += 1
+                self._stats["tokens"] += sum(tokens for _, tokens, _ in batch)
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch"] = stats["items"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+_batchers: List[Batcher] = []
+
+
+def _collect_stats():
+    snapshots = [(batcher.name, batcher.stats()) for batcher in _batchers]
+    for name, stats in snapshots:
+        yield ("llm_batches_total", "counter", "LLM calls made for a group of requests.",
+               {"batcher": name}, stats["batches"])
+    for name, stats in snapshots:
+        for outcome, count in (("answered", stats["items"] - stats["unanswered"]),
+                               ("unanswered", stats["unanswered"])):
+            yield ("llm_batch_items_total", "counter", "Requests sent in grouped LLM calls by outcome.",
+                   {"batcher": name, "outcome": outcome}, count)
+
+
+metrics.register_collector(_collect_stats)
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from services import governor as llm_governor
+from services.governor import Governor, GovernorRejected
+from config import (
+    LLM_API_BASE,
+    LLM_API_KEY,
+    LLM_POOL_SIZE,
+    LLM_ASYNC_POOL_SIZE,
+    LLM_CONNECT_TIMEOUT,
+    LLM_READ_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: rate limiting and gateway/availability errors.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class _RetryingClient:
+    """Backoff, retry bookkeeping and call statistics shared by both clients."""
+
+    def __init__(self, url: str, connect_timeout: float, read_timeout: float,
+                 max_retries: int, backoff_base: float, backoff_max: float,
+                 governor: Optional[Governor] = None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.governor = governor
+
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "errors": 0, "latency_total": 0.0, "latency_last": 0.0}
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_delay(self, headers, attempt: int) -> float:
+        retry_after = _parse_retry_after(headers.get("Retry-After"))
+        return min(self.backoff_max, retry_after) if retry_after is not None else self._backoff(attempt)
+
+    def _acquire(self, started: float, attempt: int):
+        if self.governor is None:
+            return None
+        try:
+            return self.governor.acquire()
+        except GovernorRejected:
+            self._record(started, attempt, failed=True)
+            raise
+
+    async def _acquire_async(self, started: float, attempt: int):
+        if self.governor is None:
+            return None
+        try:
+            return await self.governor.acquire_async()
+        except GovernorRejected:
+            self._record(started, attempt, failed=True)
+            raise
+
+    @staticmethod
+    def _release(slot, outcome: str) -> None:
+        if slot is not None:
+            slot.done(outcome)
+
+    def _record(self, started: float, retries: int, failed: bool) -> None:
+        latency = time.monotonic() - started
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["retries"] += retries
+            self._stats["errors"] += int(failed)
+            self._stats["latency_total"] += latency
+            self._stats["latency_last"] = latency
+        logger.debug("LLM call took %.3fs with %d retries", latency, retries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["latency_avg"] = stats["latency_total"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+class LLMClient(_RetryingClient):
+    """Keep-alive HTTP client for the chat-completions API with retries.
+
+    Connections are pooled per host, every request has connect/read timeouts,
+    and 429/5xx gateway responses or connection failures are retried with
+    full-jitter exponential backoff, honouring ``Retry-After`` when present.
+    With a ``governor``, every attempt first waits for one of its slots.
+    """
+
+    def __init__(self, url: str, api_key: Optional[str], pool_size: int = LLM_POOL_SIZE,
+                 connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = LLM_READ_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX,
+                 governor: Optional[Governor] = None):
+        super().__init__(url, connect_timeout, read_timeout, max_retries, backoff_base, backoff_max, governor)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def post(self, body: Dict[str, Any], **kwargs: Any) -> requests.Response:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            slot = self._acquire(started, attempt)
+            outcome = llm_governor.FAILURE
+            try:
+                response = self.session.post(self.url, json=body, timeout=self.timeout, **kwargs)
+                outcome = llm_governor.outcome_for_status(response.status_code)
+            except requests.ConnectionError:
+                # Covers connect timeouts; the request never reached the API.
+                if attempt >= self.max_retries:
+                    self._record(started, attempt, failed=True)
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self._record(started, attempt, failed=response.status_code != 200)
+                    return response
+                delay = self._retry_delay(response.headers, attempt)
+                response.close()
+            finally:
+                self._release(slot, outcome)
+
+            attempt += 1
+            logger.info("Retrying LLM call in %.2fs (attempt %d)", delay, attempt)
+            time.sleep(delay)
+
+
+class AsyncLLMClient(_RetryingClient):
+    """Non-blocking counterpart of LLMClient built on ``httpx.AsyncClient``.
+
+    Same timeouts, retry and backoff rules; waiting on the API costs a
+    coroutine instead of a thread. Use it from a single event loop.
+    """
+
+    def __init__(self, url: str, api_key: Optional[str], pool_size: int = LLM_ASYNC_POOL_SIZE,
+                 connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = LLM_READ_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX,
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 governor: Optional[Governor] = None):
+        super().__init__(url, connect_timeout, read_timeout, max_retries, backoff_base, backoff_max, governor)
+
+        self.session = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=transport,
+        )
+
+    async def post(self, body: Dict[str, Any]) -> httpx.Response:
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            slot = await self._acquire_async(started, attempt)
+            outcome = llm_governor.FAILURE
+            try:
+                response = await self.session.post(self.url, json=body)
+                outcome = llm_governor.outcome_for_status(response.status_code)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= self.max_retries:
+                    self._record(started, attempt, failed=True)
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self._record(started, attempt, failed=response.status_code != 200)
+                    return response
+                delay = self._retry_delay(response.headers, attempt)
+            finally:
+                self._release(slot, outcome)
+
+            attempt += 1
+            logger.info("Retrying LLM call in %.2fs (attempt %d)", delay, attempt)
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self.session.aclose()
+
+
+client = LLMClient(LLM_API_BASE, LLM_API_KEY, governor=llm_governor.llm)
+
+_async_lock = threading.Lock()
+_async_client: Optional[AsyncLLMClient] = None
+
+
+def get_async_client() -> AsyncLLMClient:
+    """The shared AsyncLLMClient, created on first use (JOB_EXECUTOR=async)."""
+    global _async_client
+    with _async_lock:
+        if _async_client is None:
+            _async_client = AsyncLLMClient(client.url, LLM_API_KEY, governor=llm_governor.llm)
+        return _async_client
+
+
+def stats() -> Dict[str, Any]:
+    """Counters of the blocking and async clients combined, plus the governor's state."""
+    clients = [client] + ([_async_client] if _async_client is not None else [])
+    snapshots = [c.stats() for c in clients]
+    combined = {name: sum(s[name] for s in snapshots)
+                for name in ("calls", "retries", "errors", "latency_total")}
+    combined["latency_last"] = max(s["latency_last"] for s in snapshots)
+    combined["latency_avg"] = combined["latency_total"] / combined["calls"] if combined["calls"] else 0.0
+    combined["governor"] = llm_governor.llm.stats()
+    return combined
+
+
+def _collect_stats():
+    combined = stats()
+    yield "llm_calls_total", "counter", "LLM API calls.", {}, combined["calls"]
+    yield "llm_retries_total", "counter", "LLM API call retries.", {}, combined["retries"]
+    yield "llm_errors_total", "counter", "LLM API calls that failed.", {}, combined["errors"]
+
+
+metrics.register_collector(_collect_stats)
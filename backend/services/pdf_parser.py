@@ -1,8 +1,99 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
 from pypdf import PdfReader
+from metrics import DOCUMENT_PAGES
+from config import PDF_MAX_PAGES, PDF_MAX_CHARS, PDF_PARALLEL_MIN_PAGES, PDF_PARALLEL_WORKERS
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def iter_page_texts(reader: PdfReader, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of each page in ``[start, stop)`` lazily, one page at a time."""
+    pages = reader.pages
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    for index in range(start, stop):
+        yield pages[index].extract_text() or ''
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    return list(iter_page_texts(PdfReader(file_path), start, stop))
+
+
+def _iter_parallel(file_path: str, page_count: int) -> Iterator[str]:
+    workers = max(1, PDF_PARALLEL_WORKERS)
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    futures = [_get_pool().submit(_extract_page_range, file_path, start, stop) for start, stop in ranges]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
 
-def extract_text_from_pdf(file_path):
+
+def _with_progress(texts: Iterable[str], total: int, progress: Callable[[int, int], None]) -> Iterator[str]:
+    for done, text in enumerate(texts, 1):
+        yield text
+        progress(done, total)
+
+
+def _join_limited(texts: Iterable[str], max_chars: int) -> str:
+    parts = []
+    size = 0
+    for text in texts:
+        if max_chars and size + len(text) >= max_chars:
+            parts.append(text[:max_chars - size])
+            break
+        parts.append(text)
+        size += len(text)
+    return ''.join(parts)
+
+
+def extract_text_from_pdf(file_path, max_pages: int = PDF_MAX_PAGES, max_chars: int = PDF_MAX_CHARS,
+                          parallel: Optional[bool] = None,
+                          progress: Optional[Callable[[int, int], None]] = None):
+    """Return the text of the first ``max_pages`` pages, cut at ``max_chars``.
+
+    Pages are read lazily and joined once, so extraction stops as soon as
+    either limit is reached. Documents with at least PDF_PARALLEL_MIN_PAGES
+    pages are split into page ranges extracted in a process pool, unless
+    ``parallel`` says otherwise or this is already a worker process.
+    ``progress(done, total)`` is called after each page is read.
+    """
     reader = PdfReader(file_path)
-    text = ''
-    for page in reader.pages:
-        text += page.extract_text() or ''
-    return text.strip()
+    page_count = len(reader.pages)
+    DOCUMENT_PAGES.observe(page_count)
+    if max_pages:
+        page_count = min(page_count, max_pages)
+
+    if parallel is None:
+        parallel = (
+            bool(PDF_PARALLEL_MIN_PAGES)
+            and page_count >= PDF_PARALLEL_MIN_PAGES
+            and multiprocessing.parent_process() is None
+        )
+
+    if parallel and page_count > 1:
+        texts = _iter_parallel(file_path, page_count)
+    else:
+        texts = iter_page_texts(reader, 0, page_count)
+    if progress is not None:
+        texts = _with_progress(texts, page_count, progress)
+
+    return _join_limited(texts, max_chars).strip()
@@ -0,0 +1,154 @@
+"""Fit document text into the LLM's token budget.
+
+Texts within PROMPT_TOKEN_BUDGET are sent whole. Longer ones are reduced to
+the lines around field labels and product numbers; when even those do not
+fit, the relevant text is split into chunks that are extracted concurrently
+and merged field by field. Tokens are estimated from character counts, which
+is close enough for budgeting without a model-specific tokenizer.
+"""
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+
+from config import (
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_CHARS_PER_TOKEN,
+    PROMPT_SPAN_CONTEXT,
+    PROMPT_MAX_CHUNKS,
+    PROMPT_CHUNK_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+SPAN_SEPARATOR = "\n...\n"
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=PROMPT_CHUNK_WORKERS, thread_name_prefix="llm-chunk")
+        return _pool
+
+
+def estimate_tokens(text: str) -> int:
+    return int(-(-len(text) // PROMPT_CHARS_PER_TOKEN))
+
+
+def _windows(lines: Sequence[str], markers: Sequence[Pattern], context: int) -> List[Tuple[int, int]]:
+    windows: List[Tuple[int, int]] = []
+    for index, line in enumerate(lines):
+        if any(marker.search(line) for marker in markers):
+            start, stop = max(0, index - context), min(len(lines), index + context + 1)
+            if windows and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], stop))
+            else:
+                windows.append((start, stop))
+    return windows
+
+
+def select_spans(text: str, budget: int = PROMPT_TOKEN_BUDGET, markers: Sequence[Pattern] = (),
+                 context: int = PROMPT_SPAN_CONTEXT) -> Tuple[str, bool]:
+    """Return the text around ``markers`` that fits in ``budget`` tokens.
+
+    The flag is True when every matching window fit. Without any match the
+    start of the document is returned instead, with the flag False.
+    """
+    if estimate_tokens(text) <= budget:
+        return text, True
+
+    lines = text.splitlines()
+    windows = _windows(lines, markers, context)
+    if not windows:
+        return text[:int(budget * PROMPT_CHARS_PER_TOKEN)], False
+
+    spans = []
+    used = 0
+    complete = True
+    for start, stop in windows:
+        span = "\n".join(lines[start:stop])
+        cost = estimate_tokens(span + SPAN_SEPARATOR)
+        if used + cost > budget:
+            complete = False
+            continue
+        spans.append(span)
+        used += cost
+    return SPAN_SEPARATOR.join(spans), complete
+
+
+def chunk_text(text: str, budget: int = PROMPT_TOKEN_BUDGET) -> List[str]:
+    """Split ``text`` on line boundaries into chunks of at most ``budget`` tokens."""
+    max_chars = max(1, int(budget * PROMPT_CHARS_PER_TOKEN))
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines():
+        # A single overlong line is cut into pieces of its own.
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [""]
+        for piece in pieces:
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def plan(text: str, markers: Sequence[Pattern] = (), budget: int = PROMPT_TOKEN_BUDGET,
+         max_chunks: int = PROMPT_MAX_CHUNKS) -> List[str]:
+    """Return the text to send, as one prompt or several chunks."""
+    total = estimate_tokens(text)
+    if total <= budget:
+        chunks = [text]
+    else:
+        selected, complete = select_spans(text, budget, markers)
+        if complete or max_chunks <= 1:
+            chunks = [selected]
+        else:
+            selected, _ = select_spans(text, budget * max_chunks, markers)
+            chunks = chunk_text(selected, budget)[:max_chunks]
+
+    sent = sum(estimate_tokens(chunk) for chunk in chunks)
+    if total > budget:
+        logger.info("Prompt text cut from %d to %d tokens in %d chunk(s), %.1f%% truncated",
+                    total, sent, len(chunks), 100 * (1 - sent / total))
+    else:
+        logger.debug("Prompt text of %d tokens sent whole", total)
+    return chunks
+
+
+def map_chunks(fn: Callable[[str], Dict[str, Any]], chunks: Sequence[str]) -> List[Dict[str, Any]]:
+    """Call ``fn`` on every chunk, concurrently when there is more than one."""
+    if len(chunks) == 1:
+        return [fn(chunks[0])]
+    return list(_get_pool().map(fn, chunks))
+
+
+def merge_results(results: Sequence[Dict[str, Any]], fields: Sequence[str]) -> Dict[str, Any]:
+    """Merge per-chunk answers field by field.
+
+    Each field takes the value most chunks agree on, ignoring empty answers;
+    ties go to the earliest chunk. Keys outside ``fields`` keep their first
+    non-empty value.
+    """
+    merged: Dict[str, Any] = {}
+    for field in fields:
+        values = [result.get(field) for result in results if result.get(field) not in (None, "")]
+        if values:
+            counts = Counter(str(value) for value in values)
+            best = max(counts.values())
+            merged[field] = next(value for value in values if counts[str(value)] == best)
+        else:
+            merged[field] = ""
+    for result in results:
+        for key, value in result.items():
+            if key not in merged and value not in (None, ""):
+                merged[key] = value
+    return merged
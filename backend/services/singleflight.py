@@ -0,0 +1,145 @@
+"""Run identical work once, however many callers ask for it at the same time.
+
+``Group.do(key, fn)`` runs ``fn`` for the first caller with a given key;
+callers arriving while it runs wait for that result, or exception, instead
+of starting their own. Waiters hold nothing but the wait itself: no LLM pool
+thread, no ASYNC_MAX_EXTRACTIONS slot and no governor token. Sync and async
+callers share one table, so a request thread and a coroutine uploading the
+same bytes coalesce too.
+
+With a ``lock_dir`` the leader also takes an fcntl lock on
+``<lock_dir>/<key>.lock``, so leaders in other worker processes on the same
+host queue behind it. ``recheck`` runs once that lock is held, which lets a
+result another process stored in the meantime be reused.
+"""
+import asyncio
+import contextlib
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import metrics
+from config import SINGLEFLIGHT_LOCK_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process variant
+    fcntl = None
+
+T = TypeVar("T")
+
+
+class Group:
+    def __init__(self, name: str, lock_dir: Optional[str] = None):
+        if lock_dir and fcntl is None:
+            raise ValueError("File locks need fcntl, which this platform lacks")
+        self.name = name
+        self.lock_dir = lock_dir or None
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+        _groups.append(self)
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self._stats["leaders"] += 1
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        # Forget the key first: callers arriving after this start afresh.
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _acquire_host_lock(self, key: str):
+        if self.lock_dir is None:
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        handle = open(os.path.join(self.lock_dir, f"{key}.lock"), "a+")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    @staticmethod
+    def _release_host_lock(handle) -> None:
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    @contextlib.contextmanager
+    def _host_lock(self, key: str):
+        handle = self._acquire_host_lock(key)
+        try:
+            yield
+        finally:
+            self._release_host_lock(handle)
+
+    def do(self, key: str, fn: Callable[..., T], *args: Any,
+           recheck: Optional[Callable[[], Optional[T]]] = None, **kwargs: Any) -> T:
+        """Return ``fn(*args, **kwargs)``, shared with concurrent callers of the same key."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            with self._host_lock(key):
+                result = recheck() if recheck else None
+                if result is None:
+                    result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: str, coro_fn: Callable[..., Awaitable[T]], *args: Any,
+                       recheck: Optional[Callable[[], Optional[T]]] = None, **kwargs: Any) -> T:
+        """``do`` for coroutines: followers await the leader without blocking their loop."""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            loop = asyncio.get_running_loop()
+            handle = await loop.run_in_executor(None, self._acquire_host_lock, key)
+            try:
+                result = recheck() if recheck else None
+                if result is None:
+                    result = await coro_fn(*args, **kwargs)
+            finally:
+                self._release_host_lock(handle)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+_groups: List[Group] = []
+
+# Extractions keyed by the upload's content hash.
+extractions = Group("extraction", lock_dir=SINGLEFLIGHT_LOCK_DIR)
+
+
+def _collect_stats():
+    snapshots = [(group.name, group.stats()) for group in _groups]
+    for name, stats in snapshots:
+        for role in ("leaders", "coalesced"):
+            yield ("singleflight_calls_total", "counter", "Calls that did the work (leaders) or shared it.",
+                   {"group": name, "role": role}, stats[role])
+    for name, stats in snapshots:
+        yield ("singleflight_in_flight", "gauge", "Keys being worked on.", {"group": name}, stats["in_flight"])
+
+
+metrics.register_collector(_collect_stats)
@@ -0,0 +1,272 @@
+"""Content-addressed storage for uploaded files.
+
+Files are stored under the SHA-256 of their bytes, so identical uploads are
+kept once and names never collide. The original filename is kept as
+metadata next to the content. Because identical uploads share a file, a
+failed upload never deletes it; ``iter_files`` lets a garbage collector find
+files nothing refers to instead. ``LocalStorage`` shards files on disk as
+``<root>/ab/cd/<sha256>.pdf`` and writes through a temp file and
+``os.replace``, so readers never see a partial file. ``MemoryStorage``
+keeps everything in a dict and stands in for object stores in tests.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional, Tuple
+
+from werkzeug.security import safe_join
+
+import jsonlib
+from config import STORAGE_BACKEND
+
+CHUNK_SIZE = 64 * 1024
+
+# "<64 hex chars>.<ext>", the key of every content-addressed file.
+_KEY = re.compile(r"^(?P<hash>[0-9a-f]{64})(?P<ext>\.[a-z0-9]+)?$")
+
+
+class StoredFile(NamedTuple):
+    key: str
+    content_hash: str
+    size: int
+    filename: str
+    # False when identical bytes were already stored.
+    created: bool
+
+
+def _key_for(content_hash: str, filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    return content_hash + ext
+
+
+class StorageBackend(ABC):
+    """Interface every storage backend implements."""
+
+    @abstractmethod
+    def save(self, stream: BinaryIO, filename: str) -> StoredFile:
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Return the file's bytes as a readable binary file; FileNotFoundError if missing."""
+
+    @abstractmethod
+    def info(self, key: str) -> Dict[str, object]:
+        """Return the file's metadata (``filename``, ``size``); FileNotFoundError if missing."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def local_path(self, key: str) -> str:
+        """A path on local disk holding the file, for parsers and send_file.
+
+        Backends without a filesystem of their own copy the file into a local
+        cache first. Raises FileNotFoundError if the key is unknown.
+        """
+
+    @abstractmethod
+    def iter_files(self) -> Iterator[Tuple[str, float]]:
+        """Yield ``(key, uploaded_at)`` for every content-addressed file.
+
+        ``uploaded_at`` is the time of the latest upload of those bytes, so a
+        file saved again is not collected while the new upload uses it.
+        """
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        self._tmp = os.path.join(root, ".tmp")
+
+    def _sharded(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _find(self, key: str) -> Optional[str]:
+        if _KEY.match(key):
+            path = self._sharded(key)
+            if os.path.exists(path):
+                return path
+        # Uploads from before content addressing sit flat in the root.
+        legacy = safe_join(self.root, key)
+        if legacy and os.path.isfile(legacy):
+            return legacy
+        return None
+
+    def local_path(self, key: str) -> str:
+        path = self._find(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return path
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self._tmp)
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp, path)
+
+    def _read_meta(self, path: str) -> Dict[str, object]:
+        with open(path + ".json") as f:
+            return jsonlib.loads(f.read())
+
+    def _write_meta(self, path: str, filename: str, size: int) -> None:
+        # uploaded_at lives in the sidecar rather than the file's mtime, which
+        # send_file's Last-Modified header depends on.
+        meta = {"filename": filename, "size": size, "uploaded_at": time.time()}
+        self._write_atomic(path + ".json", jsonlib.dumps(meta).encode())
+
+    def save(self, stream: BinaryIO, filename: str) -> StoredFile:
+        digest = hashlib.sha256()
+        size = 0
+        os.makedirs(self._tmp, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            content_hash = digest.hexdigest()
+            key = _key_for(content_hash, filename)
+            path = self._sharded(key)
+            if os.path.exists(path):
+                os.remove(tmp)
+                try:
+                    first_name = self._read_meta(path)["filename"]
+                except FileNotFoundError:
+                    first_name = filename
+                self._write_meta(path, first_name, size)
+                return StoredFile(key, content_hash, size, filename, created=False)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_meta(path, filename, size)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return StoredFile(key, content_hash, size, filename, created=True)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.local_path(key), "rb")
+
+    def info(self, key: str) -> Dict[str, object]:
+        path = self.local_path(key)
+        try:
+            meta = self._read_meta(path)
+        except FileNotFoundError:
+            return {"filename": os.path.basename(path), "size": os.path.getsize(path)}
+        return {"filename": meta["filename"], "size": meta["size"]}
+
+    def delete(self, key: str) -> None:
+        path = self._find(key)
+        if path is None:
+            return
+        for victim in (path, path + ".json"):
+            if os.path.exists(victim):
+                os.remove(victim)
+
+    def iter_files(self) -> Iterator[Tuple[str, float]]:
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if name != ".tmp"]
+            for key in filenames:
+                path = os.path.join(dirpath, key)
+                # Legacy uploads in the root are not content-addressed and never collected.
+                if not _KEY.match(key) or path != self._sharded(key):
+                    continue
+                try:
+                    uploaded_at = self._read_meta(path).get("uploaded_at")
+                    yield key, uploaded_at if uploaded_at is not None else os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+
+
+class MemoryStorage(StorageBackend):
+    """Keeps files in process memory, like an object store keyed by content hash.
+
+    ``local_path`` downloads into ``cache_dir`` on first use, as a remote
+    backend would before handing a file to pypdf.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or tempfile.mkdtemp(prefix="storage-cache-")
+        self._lock = threading.Lock()
+        self._objects: Dict[str, bytes] = {}
+        self._meta: Dict[str, Dict[str, object]] = {}
+        self._uploaded: Dict[str, float] = {}
+
+    def save(self, stream: BinaryIO, filename: str) -> StoredFile:
+        data = stream.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        key = _key_for(content_hash, filename)
+        with self._lock:
+            self._uploaded[key] = time.time()
+            if key in self._objects:
+                return StoredFile(key, content_hash, len(data), filename, created=False)
+            self._objects[key] = data
+            self._meta[key] = {"filename": filename, "size": len(data)}
+        return StoredFile(key, content_hash, len(data), filename, created=True)
+
+    def _get(self, key: str) -> bytes:
+        with self._lock:
+            if key not in self._objects:
+                raise FileNotFoundError(key)
+            return self._objects[key]
+
+    def open(self, key: str) -> BinaryIO:
+        return io.BytesIO(self._get(key))
+
+    def info(self, key: str) -> Dict[str, object]:
+        self._get(key)
+        with self._lock:
+            return dict(self._meta[key])
+
+    def local_path(self, key: str) -> str:
+        data = self._get(key)
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.exists(path):
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(tmp, path)
+        return path
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._objects.pop(key, None)
+            self._meta.pop(key, None)
+            self._uploaded.pop(key, None)
+        path = os.path.join(self.cache_dir, key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def iter_files(self) -> Iterator[Tuple[str, float]]:
+        with self._lock:
+            return iter(list(self._uploaded.items()))
+
+
+BACKENDS = {
+    "local": LocalStorage,
+    "memory": lambda root: MemoryStorage(),
+}
+
+_lock = threading.Lock()
+_instances: Dict[str, StorageBackend] = {}
+
+
+def get_storage(root: str) -> StorageBackend:
+    """The STORAGE_BACKEND instance for an upload folder, created once per folder."""
+    with _lock:
+        backend = _instances.get(root)
+        if backend is None:
+            if STORAGE_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+            backend = _instances[root] = BACKENDS[STORAGE_BACKEND](root)
+        return backend
@@ -1,10 +1,20 @@
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from app import create_app
 from database.models import Base
 from database.db import SessionLocal
 
+@pytest.fixture(autouse=True)
+def llm_governor(monkeypatch):
+    """The shared LLM governor, reset and without a rate limit for every test."""
+    from services import governor
+    monkeypatch.setattr(governor.llm, "rate_per_minute", 0)
+    governor.llm.reset()
+    yield governor.llm
+    governor.llm.reset()
+
 @pytest.fixture
 def app():
     app = create_app()
@@ -22,7 +32,8 @@ def runner(app):
 
 @pytest.fixture(scope="function")
 def session():
-    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    # StaticPool shares the one in-memory database with background threads.
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
     TestingSessionLocal = sessionmaker(bind=engine)
 
     # Create all tables
@@ -32,6 +43,7 @@ def session():
     import database.db as db_module
     original_SessionLocal = db_module.SessionLocal
     db_module.SessionLocal = TestingSessionLocal
+    db_module.clear_caches()
 
     # Provide the session to the test
     db = TestingSessionLocal()
@@ -41,3 +53,4 @@ def session():
         db.close()
         Base.metadata.drop_all(bind=engine)
         db_module.SessionLocal = original_SessionLocal
+        db_module.clear_caches()
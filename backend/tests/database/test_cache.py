@@ -0,0 +1,69 @@
+import time
+from unittest.mock import patch
+
+from database.cache import LRUCache
+import database.db as db
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0] == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_document_cache_hits_and_invalidates_on_update(session):
+    doc_id = db.insert_document("url", {"title": "v1"})
+
+    db.get_document_by_id(doc_id)
+    with patch.object(db.Document, "to_dict", side_effect=AssertionError("not cached")):
+        assert db.get_document_by_id(doc_id)["metadata"] == {"title": "v1"}
+    assert db.document_cache.stats()["hits"] == 1
+
+    db.update_document_metadata(doc_id, {"title": "v2"})
+    assert db.get_document_by_id(doc_id)["metadata"] == {"title": "v2"}
+
+
+def test_document_cache_detects_writes_from_other_processes(session):
+    doc_id = db.insert_document("url", {"title": "v1"})
+    db.get_document_by_id(doc_id)
+
+    # Simulate another worker: write directly, bypassing this process's invalidation.
+    doc = session.get(db.Document, doc_id)
+    doc.set_metadata({"title": "elsewhere"})
+    doc.version = 2
+    session.commit()
+
+    assert db.get_document_by_id(doc_id)["metadata"] == {"title": "elsewhere"}
+
+
+def test_page_cache_follows_generation(session):
+    db.insert_document("url1", {"title": "one"})
+    assert len(db.get_documents()) == 1
+    assert len(db.get_documents()) == 1
+    assert db.page_cache.stats()["hits"] == 1
+
+    db.insert_document("url2", {"title": "two"})
+    assert len(db.get_documents()) == 2
+
+    session.add(db.Document(file_url="url3", meta_json="{}"))
+    session.execute(db.update(db.CacheGeneration).values(generation=db.CacheGeneration.generation + 1))
+    session.commit()
+    assert len(db.get_documents()) == 3
+
+
+def test_deep_pages_are_not_cached(session):
+    db.get_documents(offset=db.PAGE_CACHE_PAGES * 10, limit=10)
+    assert db.page_cache.stats()["size"] == 0
@@ -1,8 +1,27 @@
+import json
+from unittest.mock import patch
+from sqlalchemy import event
+import jsonlib
+import metrics
+from database.models import Document
+from database.writer import GroupCommitWriter
 from database.db import (
     insert_document,
+    insert_documents,
+    create_db_engine,
     get_documents,
+    iter_documents,
     get_document_by_id,
+    get_document_version,
     update_document_metadata,
+    merge_patch,
+    patch_document_metadata,
+    insert_job,
+    update_job,
+    claim_job,
+    get_job_by_id,
+    get_unfinished_jobs,
+    referenced_file_keys,
 )
 
 def test_insert_and_get_document(session):
@@ -47,3 +66,258 @@ def test_update_document_metadata(session):
 def test_get_document_by_id_not_found(session):
     doc = get_document_by_id(9999)  # Non-existing ID
     assert doc is None
+
+def test_job_lifecycle(session):
+    job_id = insert_job("uploads/a.pdf", "http://localhost/files/a.pdf", "abc123")
+    job = get_job_by_id(job_id)
+    assert job["status"] == "queued"
+    assert job["metadata"] is None
+    assert get_unfinished_jobs() == [(job_id, "uploads/a.pdf", "abc123")]
+
+    update_job(job_id, "done", metadata={"Name": "Bike"})
+    job = get_job_by_id(job_id)
+    assert job["status"] == "done"
+    assert job["metadata"] == {"Name": "Bike"}
+    assert get_unfinished_jobs() == []
+
+def test_claim_job_once(session):
+    job_id = insert_job("uploads/a.pdf", "http://localhost/files/a.pdf")
+
+    assert claim_job(job_id, "host:1")
+    assert not claim_job(job_id, "host:2")
+    assert get_job_by_id(job_id)["status"] == "running"
+    assert get_unfinished_jobs() == []
+
+    # Only the owner records the outcome.
+    assert not update_job(job_id, "done", metadata={}, owner="host:2")
+    assert update_job(job_id, "done", metadata={"Name": "Bike"}, owner="host:1")
+    assert get_job_by_id(job_id)["status"] == "done"
+
+def test_stale_running_job_is_resumable(session):
+    from datetime import datetime, timedelta, timezone
+    job_id = insert_job("uploads/a.pdf", "http://localhost/files/a.pdf")
+    claim_job(job_id, "host:1")
+    now = datetime.now(timezone.utc)
+
+    # A job still being worked on is left alone.
+    assert get_unfinished_jobs(stale_before=now - timedelta(minutes=15)) == []
+    assert not claim_job(job_id, "host:2", stale_before=now - timedelta(minutes=15))
+
+    later = now + timedelta(minutes=1)
+    assert get_unfinished_jobs(stale_before=later) == [(job_id, "uploads/a.pdf", None)]
+    assert claim_job(job_id, "host:2", stale_before=later)
+    assert not claim_job(job_id, "host:3", stale_before=later - timedelta(minutes=2))
+
+def test_referenced_file_keys(session):
+    insert_document("http://localhost/files/saved.pdf", {"Name": "Bike"})
+    insert_job("uploads/queued.pdf", "http://localhost/files/queued.pdf")
+    failed = insert_job("uploads/failed.pdf", "http://localhost/files/failed.pdf")
+    update_job(failed, "failed", error="bad pdf")
+
+    assert referenced_file_keys() == {"saved.pdf", "queued.pdf"}
+
+def test_get_job_by_id_not_found(session):
+    assert get_job_by_id(9999) is None
+
+def test_search_matches_values_not_keys(session):
+    insert_document("url1", {"Name": "Road Bike", "Color": "Black"})
+    insert_document("url2", {"Name": "Helmet", "Color": "Red"})
+
+    assert [d["file_url"] for d in get_documents(search_query="color")] == []
+    assert [d["file_url"] for d in get_documents(search_query="black")] == ["url1"]
+
+def test_search_prefix_and_ranking(session):
+    insert_document("url1", {"Name": "Bike rack", "Style": "Bike"})
+    insert_document("url2", {"Name": "Helmet"})
+    insert_document("url3", {"Name": "Mountain Bike", "Style": "Bike", "Class": "Bike"})
+
+    results = [d["file_url"] for d in get_documents(search_query="bik")]
+    assert results[0] == "url3"
+    assert set(results) == {"url1", "url3"}
+
+def test_search_index_follows_updates(session):
+    doc_id = insert_document("url1", {"Color": "Red"})
+    update_document_metadata(doc_id, {"Color": "Silver"})
+
+    assert get_documents(search_query="red") == []
+    assert [d["id"] for d in get_documents(search_query="silver")] == [doc_id]
+
+def test_search_ignores_fts_syntax(session):
+    insert_document("url1", {"Name": "Bike"})
+
+    assert [d["file_url"] for d in get_documents(search_query='bike"*) (')] == ["url1"]
+
+def test_punctuation_only_search_matches_nothing(session):
+    insert_document("url1", {"Name": "Bike"})
+
+    assert get_documents(search_query="-") == []
+    assert list(iter_documents(search_query="?!")) == []
+
+def test_get_documents_after_id(session):
+    ids = [insert_document(f"url{i}", {"Name": f"Bike {i}"}) for i in range(5)]
+
+    page = get_documents(limit=2, after_id=ids[1])
+    assert [d["id"] for d in page] == ids[2:4]
+
+    page = get_documents(limit=10, search_query="bike", after_id=ids[3])
+    assert [d["id"] for d in page] == ids[4:]
+
+def test_insert_fills_typed_columns(session):
+    doc_id = insert_document("url", {"Color": " Black ", "ListPrice": "$1,200.50", "ProductModelID": "12",
+                                     "StandardCost": "", "Class": "H"})
+    doc = session.get(Document, doc_id)
+    assert doc.color == "Black"
+    assert doc.list_price == 1200.5
+    assert doc.product_model_id == 12
+    assert doc.standard_cost is None
+    assert doc.product_class == "H"
+
+    update_document_metadata(doc_id, {"Color": "Red"})
+    session.expire_all()
+    doc = session.get(Document, doc_id)
+    assert doc.color == "Red"
+    assert doc.list_price is None
+
+def test_get_documents_filters_and_sort(session):
+    insert_document("a", {"Color": "Black", "ListPrice": "50", "ProductLine": "R"})
+    insert_document("b", {"Color": "Black", "ListPrice": "150", "ProductLine": "R"})
+    insert_document("c", {"Color": "Black", "ListPrice": "300", "ProductLine": "M"})
+    insert_document("d", {"Color": "Red", "ListPrice": "500", "ProductLine": "R"})
+
+    docs = get_documents(filters={"color": "Black", "list_price_min": 100})
+    assert [d["file_url"] for d in docs] == ["b", "c"]
+
+    docs = get_documents(filters={"product_line": "R"}, sort="-list_price")
+    assert [d["file_url"] for d in docs] == ["d", "b", "a"]
+
+def test_insert_documents(session):
+    ids = insert_documents([("url1", {"Color": "Red"}), ("url2", {"Color": "Blue"})])
+
+    assert len(ids) == 2
+    assert get_document_by_id(ids[1])["metadata"] == {"Color": "Blue"}
+    assert session.get(Document, ids[0]).color == "Red"
+
+def test_iter_documents_streams_all_matches(session):
+    for i in range(5):
+        insert_document(f"url{i}", {"Color": "Red" if i % 2 else "Blue", "ListPrice": str(i)})
+
+    docs = list(iter_documents(filters={"color": "Red"}, batch_size=1))
+    assert [d["file_url"] for d in docs] == ["url1", "url3"]
+
+    docs = list(iter_documents(search_query="blue", sort="-list_price", batch_size=2))
+    assert [d["file_url"] for d in docs] == ["url4", "url2", "url0"]
+
+def test_update_bumps_version(session):
+    doc_id = insert_document("url", {"title": "v1"})
+    assert get_document_version(doc_id) == 1
+
+    update_document_metadata(doc_id, {"title": "v2"})
+    assert get_document_version(doc_id) == 2
+    assert get_document_version(9999) is None
+
+def test_sqlite_engine_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    engine.dispose()
+
+def test_inserts_do_not_read_rows_back(session):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        ids = insert_documents([(f"url{i}", {"Name": f"Bike {i}"}) for i in range(5)])
+        ids.append(insert_document("url5", {"Name": "Bike 5"}))
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert len(set(ids)) == 6
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+def test_cached_document_validated_by_known_version(session):
+    doc_id = insert_document("url", {"Name": "Bike"})
+    get_document_by_id(doc_id)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert get_document_by_id(doc_id, version=1)["metadata"] == {"Name": "Bike"}
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert statements == []
+
+    # A newer version than the cached one reloads the document.
+    update_document_metadata(doc_id, {"Name": "Road Bike"})
+    assert get_document_by_id(doc_id, version=2)["metadata"] == {"Name": "Road Bike"}
+
+def test_insert_document_through_group_writer(session):
+    writer = GroupCommitWriter(insert_documents, linger_ms=1)
+    with patch("database.db.group_writer", writer):
+        doc_id = insert_document("url", {"title": "grouped"})
+
+        rendered = metrics.render()
+
+    assert get_document_by_id(doc_id)["metadata"] == {"title": "grouped"}
+    assert writer.stats()["batches"] == 1
+    assert "db_group_commit_records_total 1" in rendered
+
+def test_cache_metrics_group_samples_by_name():
+    names = [line.split("{")[0] for line in metrics.render().splitlines()
+             if line.startswith("document_cache_")]
+
+    assert names == ["document_cache_lookups_total"] * 4 + ["document_cache_size"] * 2
+
+def test_merge_patch():
+    target = {"Name": "Bike", "Color": "Red", "Specs": {"Size": "L", "Weight": 10}}
+    patch = {"Color": None, "Specs": {"Weight": 9}, "Style": "U"}
+
+    assert merge_patch(target, patch) == {"Name": "Bike", "Specs": {"Size": "L", "Weight": 9}, "Style": "U"}
+    assert merge_patch(target, ["replaced"]) == ["replaced"]
+
+def test_patch_document_metadata(session):
+    doc_id = insert_document("url", {"Name": "Bike", "Color": "Red", "ListPrice": "$800.00"})
+
+    version, metadata = patch_document_metadata(doc_id, {"Color": "Silver", "ListPrice": None})
+
+    assert version == 2
+    assert metadata == {"Name": "Bike", "Color": "Silver"}
+    assert get_document_by_id(doc_id)["metadata"] == metadata
+    doc = session.get(Document, doc_id)
+    assert doc.color == "Silver"
+    assert doc.list_price is None
+    assert doc.name == "Bike"
+    assert [d["id"] for d in get_documents(search_query="silver")] == [doc_id]
+
+def test_patch_document_metadata_checks_version(session):
+    doc_id = insert_document("url", {"Color": "Red"})
+
+    assert patch_document_metadata(doc_id, {"Color": "Blue"}, expected_version=2) is None
+    assert patch_document_metadata(9999, {"Color": "Blue"}) is None
+    assert get_document_version(doc_id) == 1
+
+    assert patch_document_metadata(doc_id, {"Color": "Blue"}, expected_version=1)[0] == 2
+
+def test_raw_documents_keep_stored_json(session):
+    doc_id = insert_document("url", {"Name": "Bike", "Color": "Red"})
+
+    page = get_documents(raw=True)
+    doc = get_document_by_id(doc_id, raw=True)
+
+    assert page == [doc]
+    assert isinstance(doc["metadata"], jsonlib.RawJSON)
+    assert json.loads(doc["metadata"]) == {"Name": "Bike", "Color": "Red"}
+    assert get_document_by_id(doc_id)["metadata"] == {"Name": "Bike", "Color": "Red"}
+
+    update_document_metadata(doc_id, {"Name": "Bike", "Color": "Blue"})
+    assert json.loads(get_document_by_id(doc_id, raw=True)["metadata"])["Color"] == "Blue"
+    assert get_document_by_id(9999, raw=True) is None
@@ -1,6 +1,6 @@
 import pytest
 import json
-from database.models import Document
+from database.models import Document, _to_float, _to_int
 
 def test_document_to_dict():
     metadata_dict = {"title": "Sample", "author": "Tester"}
@@ -14,3 +14,49 @@ def test_document_to_dict():
     assert result["id"] == 1
     assert result["metadata"] == metadata_dict
     assert result["file_url"] == file_url
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("$1,200.50", 1200.5),
+    ("-$5", -5.0),
+    ("€ 7.5", 7.5),
+    ("42", 42.0),
+    (3, 3.0),
+    ("1e30", None),
+    ("Approx. 5", None),
+    ("1,200 (was 1,500)", None),
+    ("12,34", None),
+    ("", None),
+    (None, None),
+    (True, None),
+    (float("inf"), None),
+    (10 ** 400, None),
+])
+def test_to_float_is_strict(value, expected):
+    assert _to_float(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("7", 7),
+    ("1,000", 1000),
+    ("12.00", 12),
+    (5.0, 5),
+    ("12.5", None),
+    ("ID 7", None),
+    ("1e30", None),
+    (1e30, None),
+    ("9" * 25, None),
+    (2 ** 63, None),
+    (-2 ** 63, -2 ** 63),
+])
+def test_to_int_is_strict(value, expected):
+    assert _to_int(value) == expected
+
+
+def test_unparseable_numbers_leave_typed_columns_empty():
+    doc = Document(file_url="url")
+    doc.set_metadata({"ProductID": "99999999999999999999999", "ListPrice": "Approx. 5", "Color": "Red"})
+
+    assert doc.product_id is None
+    assert doc.list_price is None
+    assert doc.color == "Red"
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from database.writer import GroupCommitWriter
+
+
+def test_concurrent_submits_share_batches():
+    batches = []
+    release = threading.Event()
+
+    def write_batch(records):
+        release.wait(1)
+        batches.append(list(records))
+        start = sum(len(b) for b in batches[:-1])
+        return [start + i + 1 for i in range(len(records))]
+
+    writer = GroupCommitWriter(write_batch, max_batch=50, linger_ms=20)
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        futures = [pool.submit(lambda n=n: writer.submit(("url", {"n": n})).result(timeout=5))
+                   for n in range(10)]
+        release.set()
+        ids = sorted(f.result() for f in futures)
+
+    assert ids == list(range(1, 11))
+    assert len(batches) < 10
+    assert writer.stats()["records"] == 10
+
+
+def test_failed_batch_fails_only_the_bad_record():
+    batches = []
+
+    def write_batch(records):
+        batches.append(len(records))
+        if any(meta.get("bad") for _, meta in records):
+            raise RuntimeError("CHECK constraint failed")
+        return [meta["n"] for _, meta in records]
+
+    writer = GroupCommitWriter(write_batch, max_batch=3, linger_ms=200)
+    futures = [writer.submit(("url", {"n": 1})), writer.submit(("url", {"n": 2, "bad": True})),
+               writer.submit(("url", {"n": 3}))]
+
+    assert futures[0].result(timeout=5) == 1
+    with pytest.raises(RuntimeError, match="CHECK"):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 3
+    assert batches == [3, 1, 1, 1]
+    stats = writer.stats()
+    assert (stats["records"], stats["retried"], stats["failed"]) == (2, 3, 1)
+
+
+def test_failed_writes_propagate_and_the_writer_keeps_serving():
+    def write_batch(records):
+        raise RuntimeError("database is locked")
+
+    writer = GroupCommitWriter(write_batch, linger_ms=1)
+    with pytest.raises(RuntimeError, match="locked"):
+        writer.submit(("url", {})).result(timeout=5)
+
+    # The writer thread keeps serving later records.
+    with pytest.raises(RuntimeError):
+        writer.submit(("url", {})).result(timeout=5)
@@ -1,6 +1,13 @@
+import gzip
+import hashlib
 import io
+import json
 import os
+import re
+import shutil
+import time
 import pytest
+from unittest.mock import patch
 from reportlab.pdfgen import canvas
 
 UPLOAD_FOLDER = "tests/uploads"
@@ -14,14 +21,33 @@ def create_sample_pdf():
     buffer.seek(0)
     return buffer
 
-@pytest.fixture(scope="module", autouse=True)
+CATALOG_TEXT = """Product Catalog
+Mountain Bike (#MB-100)
+Product ID: 1
+Make Flag: True
+Finished Goods Flag: True
+Color: Red
+Standard Cost: $500.00
+List Price: $800.00
+Size: L
+Product Line: M
+Class: H
+Style: U
+Subcategory ID: 1
+Model ID: 101"""
+
+@pytest.fixture(autouse=True)
 def setup_upload_folder():
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
     yield
     # Cleanup uploaded files after tests (optional)
     for f in os.listdir(UPLOAD_FOLDER):
-        os.remove(os.path.join(UPLOAD_FOLDER, f))
+        path = os.path.join(UPLOAD_FOLDER, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
 
 def test_upload_success(client):
     pdf_file = create_sample_pdf()
@@ -139,8 +165,348 @@ def test_serve_file(client):
     }
     upload_resp = client.post('/upload', data=data, content_type='multipart/form-data')
     assert upload_resp.status_code == 201
-    filename = 'serve_test.pdf'
+    file_url = upload_resp.get_json()["file_url"]
+
+    response = client.get(file_url)
+    assert response.status_code == 200
+
+def test_serve_file_by_content_hash(client):
+    pdf_bytes = create_sample_pdf().getvalue()
+    with patch('services.document_services.extractor.extract_metadata_from_text', return_value={"Name": "Stored"}):
+        upload_resp = client.post('/upload', data={'file': (io.BytesIO(pdf_bytes), 'stored.pdf')},
+                                  content_type='multipart/form-data')
+    key = upload_resp.get_json()["file_url"].rsplit('/', 1)[1]
+    assert key == hashlib.sha256(pdf_bytes).hexdigest() + ".pdf"
+
+    response = client.get(f'/files/{key}')
+    assert response.status_code == 200
+    assert response.get_data() == pdf_bytes
+    assert 'stored.pdf' in response.headers['Content-Disposition']
+    assert response.headers['ETag'] == f'"{key}"'
+
+    # A duplicate upload leaves the ETag, and so the client's cached copy, valid.
+    with patch('services.document_services.extractor.extract_metadata_from_text', return_value={"Name": "Stored"}):
+        client.post('/upload', data={'file': (io.BytesIO(pdf_bytes), 'again.pdf')},
+                    content_type='multipart/form-data')
+    assert client.get(f'/files/{key}', headers={'If-None-Match': f'"{key}"'}).status_code == 304
+
+def test_serve_file_missing(client):
+    assert client.get('/files/missing.pdf').status_code == 404
+
+
+def test_upload_returns_metadata(client):
+    data = {'file': (create_sample_pdf(), 'extracted.pdf')}
+    with patch('services.document_services.extractor.extract_metadata_from_text', return_value={"Name": "Extracted"}):
+        response = client.post('/upload', data=data, content_type='multipart/form-data')
+    assert response.status_code == 201
+    assert response.get_json()["metadata"] == {"Name": "Extracted"}
+
+def test_upload_rejected_by_governor_is_503(client):
+    from services.governor import GovernorRejected
+    rejected = GovernorRejected("open", "LLM API unavailable: circuit breaker open", 12.3)
+    data = {'file': (create_sample_pdf(), 'rejected.pdf')}
+    with patch('services.document_services.extractor.extract_metadata_from_text', side_effect=rejected):
+        response = client.post('/upload', data=data, content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '13'
+    assert "circuit breaker" in response.get_json()["error"]
+
+def test_llm_stats_include_governor(client):
+    governor = client.get('/llm/stats').get_json()["governor"]
+    assert governor["circuit"] == "closed"
+    assert set(governor["rejected"]) == {"timeout", "open"}
+
+def test_upload_async_returns_job(client):
+    pdf_file = create_sample_pdf()
+    data = {
+        'file': (pdf_file, 'async_test.pdf')
+    }
+    with patch('services.document_services.extractor.extract_metadata_from_text', return_value={"Name": "Async"}):
+        response = client.post('/upload?async=1', data=data, content_type='multipart/form-data')
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+
+        deadline = time.time() + 5
+        job = client.get(f'/jobs/{job_id}').get_json()
+        while job["status"] in ("queued", "running") and time.time() < deadline:
+            time.sleep(0.05)
+            job = client.get(f'/jobs/{job_id}').get_json()
+
+    assert job["status"] == "done"
+    assert job["metadata"] == {"Name": "Async"}
+    assert re.search(r"/files/[0-9a-f]{64}\.pdf$", job["file_url"])
+
+def test_get_job_not_found(client):
+    response = client.get('/jobs/999999')
+    assert response.status_code == 404
+
+def test_stats_endpoints(client):
+    stats = client.get('/cache/stats').get_json()
+    assert set(stats) == {"extraction", "documents", "pages", "group_commit"}
+    assert set(stats["extraction"]) >= {"hits", "misses", "hit_rate"}
+    assert set(stats["documents"]) >= {"hits", "misses", "hit_rate"}
+    assert set(client.get('/llm/stats').get_json()) >= {"calls", "retries", "latency_avg"}
+
+def test_extractor_stats_reports_rule_hits(client):
+    from services import extractor
+    extractor.reset_stats()
+    extractor.extract_metadata_from_text(CATALOG_TEXT)
+
+    stats = client.get('/extractor/stats').get_json()
+    assert stats["rules"]["complete"] == 1
+    assert stats["rules"]["hit_rate"] == 1.0
+    assert "llm" not in stats
+
+def test_upload_batch_streams_ndjson(client):
+    data = {
+        'files': [
+            (create_sample_pdf(), 'batch_a.pdf'),
+            (io.BytesIO(b"not a pdf"), 'batch_b.pdf'),
+        ]
+    }
+    with patch('services.document_services.extractor.extract_metadata_from_text',
+               return_value={"Name": "Batch"}):
+        response = client.post('/upload/batch', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    results = {line["index"]: line for line in lines}
+    assert results[0]["metadata"] == {"Name": "Batch"}
+    assert "error" in results[1]
+
+def test_upload_stream_sends_events(client):
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer)
+    for y, line in enumerate(CATALOG_TEXT.splitlines()):
+        p.drawString(60, 800 - 18 * y, line)
+    p.showPage()
+    p.save()
+    buffer.seek(0)
+
+    response = client.post('/upload?stream=1', data={'file': (buffer, 'streamed.pdf')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.get_data(as_text=True).strip().split("\n\n")
+    ]
+    assert events[0][0] == "saved"
+    assert ("pages", {"parsed": 1, "total": 1}) in events
+    assert events[-1][0] == "done"
+    assert events[-1][1]["metadata"]["Name"] == "Mountain Bike"
+
+def test_upload_stream_rejects_unsupported_file(client):
+    response = client.post('/upload?stream=1', data={'file': (io.BytesIO(b"text"), 'notes.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_upload_batch_no_files(client):
+    response = client.post('/upload/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_list_documents_cursor(client):
+    response = client.get('/documents?after=0&limit=1')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body) == {"items", "next_cursor"}
+    assert len(body["items"]) <= 1
+
+def test_list_documents_filters(client):
+    client.post('/save', json={
+        "file_url": "http://example.com/filtered.pdf",
+        "metadata": {"Color": "Ultraviolet", "ListPrice": "$999.00"}
+    })
+
+    response = client.get('/documents?color=Ultraviolet&list_price_min=900&sort=-list_price')
+    assert response.status_code == 200
+    docs = response.get_json()
+    assert docs and all(doc["metadata"]["Color"] == "Ultraviolet" for doc in docs)
 
-    response = client.get(f'/files/{filename}')
+    assert client.get('/documents?list_price_min=abc').status_code == 400
+    assert client.get('/documents?sort=metadata').status_code == 400
+
+def test_save_bulk_json(client):
+    response = client.post('/save/bulk', json=[
+        {"file_url": "http://example.com/bulk1.pdf", "metadata": {"title": "Bulk 1"}},
+        {"file_url": "http://example.com/bulk2.pdf"},
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["saved"] == 1 and body["failed"] == 1
+    assert "id" in body["results"][0]
+    assert "error" in body["results"][1]
+
+def test_save_bulk_ndjson(client):
+    lines = [
+        json.dumps({"file_url": "http://example.com/bulk3.pdf", "metadata": {"title": "Bulk 3"}}),
+        "",
+        json.dumps({"file_url": "http://example.com/bulk4.pdf", "metadata": {"title": "Bulk 4"}}),
+    ]
+    response = client.post('/save/bulk', data="\n".join(lines), content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.get_json()["saved"] == 2
+
+def test_save_bulk_rejects_non_array(client):
+    response = client.post('/save/bulk', json={"file_url": "x"})
+    assert response.status_code == 400
+
+def test_app_does_not_resume_jobs(app):
+    from app import create_app
+
+    with patch('services.document_services.get_unfinished_jobs') as mock_unfinished:
+        create_app()
+
+    mock_unfinished.assert_not_called()
+
+def test_resume_jobs_command(runner):
+    from services.document_services import extract_file
+
+    with patch('services.document_services.get_unfinished_jobs', return_value=[(1, 'uploads/a.pdf', 'abc123')]), \
+         patch('services.document_services.job_queue.submit') as mock_submit:
+        result = runner.invoke(args=["resume-jobs"])
+
+    assert result.exit_code == 0
+    assert "Resumed 1 jobs" in result.output
+    assert mock_submit.call_args.args == (1, extract_file, 'uploads/a.pdf', 'abc123')
+    assert mock_submit.call_args.kwargs["stale_before"] is not None
+    mock_submit.return_value.result.assert_called_once()
+
+def test_gc_files_command(runner):
+    with patch('commands.collect_garbage', return_value=["a.pdf", "b.pdf"]) as mock_collect:
+        result = runner.invoke(args=["gc-files", "--grace", "60"])
+
+    assert result.exit_code == 0
+    assert "Removed 2 files" in result.output
+    assert mock_collect.call_args.args[1] == 60.0
+
+def test_import_documents_command(runner, tmp_path):
+    path = tmp_path / "docs.ndjson"
+    path.write_text(
+        json.dumps({"file_url": "http://example.com/cli.pdf", "metadata": {"title": "CLI"}}) + "\n"
+        + json.dumps({"metadata": {"title": "no url"}}) + "\n"
+    )
+    result = runner.invoke(args=["import-documents", str(path), "--batch-size", "10"])
+
+    assert result.exit_code == 0
+    assert "Imported 1 documents, 1 failed" in result.output
+
+def test_export_documents(client):
+    client.post('/save', json={
+        "file_url": "http://example.com/export.pdf",
+        "metadata": {"Name": "Exported", "Color": "Teal"}
+    })
+
+    response = client.get('/documents/export?format=csv&color=Teal')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert "Exported" in response.get_data(as_text=True)
+
+    response = client.get('/documents/export?color=Teal', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert all(json.loads(line)["metadata"]["Color"] == "Teal" for line in lines)
+
+    assert client.get('/documents/export?format=xml').status_code == 400
+
+def test_get_document_etag_and_304(client):
+    client.post('/save', json={"file_url": "http://example.com/etag.pdf", "metadata": {"title": "ETag"}})
+    doc_id = client.get('/documents?sort=-id&per_page=1').get_json()[0]["id"]
+
+    response = client.get(f'/document/{doc_id}')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+
+    response = client.get(f'/document/{doc_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    client.put(f'/document/{doc_id}', json={"metadata": {"title": "ETag changed"}})
+    response = client.get(f'/document/{doc_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_raw_json_responses(app, client):
+    client.post('/save', json={"file_url": "http://example.com/raw.pdf", "metadata": {"Name": "Vélo", "Size": "L"}})
+    expected = client.get('/documents?sort=-id&per_page=5').get_json()
+    doc_id = expected[0]["id"]
+    detail = client.get(f'/document/{doc_id}').get_json()
+
+    app.config['JSON_RAW_RESPONSES'] = True
+    response = client.get('/documents?sort=-id&per_page=5')
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == expected
+    assert client.get(f'/documents?after={doc_id - 1}&limit=1').get_json()["items"] == [detail]
+    response = client.get(f'/document/{doc_id}')
+    assert response.get_json() == detail
+    assert response.headers['ETag']
+
+def test_patch_document_with_if_match(client):
+    client.post('/save', json={"file_url": "http://example.com/patch.pdf",
+                               "metadata": {"Name": "Bike", "Color": "Red", "Size": "L"}})
+    doc_id = client.get('/documents?sort=-id&per_page=1').get_json()[0]["id"]
+    etag = client.get(f'/document/{doc_id}').headers['ETag']
+
+    response = client.patch(f'/document/{doc_id}', json={"metadata": {"Color": "Blue", "Size": None}},
+                            headers={'If-Match': etag})
     assert response.status_code == 200
+    body = response.get_json()
+    assert body["metadata"] == {"Name": "Bike", "Color": "Blue"}
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    assert new_etag == f'"{doc_id}-{body["version"]}"'
+    assert client.get(f'/document/{doc_id}', headers={'If-None-Match': new_etag}).status_code == 304
+
+    # A second editor still holding the old ETag is refused.
+    response = client.patch(f'/document/{doc_id}', json={"metadata": {"Color": "Green"}},
+                            headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert response.headers['ETag'] == new_etag
+    assert client.get(f'/document/{doc_id}').get_json()["metadata"]["Color"] == "Blue"
+
+def test_patch_document_without_if_match(client):
+    client.post('/save', json={"file_url": "http://example.com/patch2.pdf", "metadata": {"Name": "Bike"}})
+    doc_id = client.get('/documents?sort=-id&per_page=1').get_json()[0]["id"]
+
+    response = client.patch(f'/document/{doc_id}', data=json.dumps({"metadata": {"Color": "Red"}}),
+                            content_type='application/merge-patch+json')
+    assert response.status_code == 200
+    assert response.get_json()["metadata"] == {"Name": "Bike", "Color": "Red"}
+
+def test_patch_document_errors(client):
+    assert client.patch('/document/999999', json={"metadata": {}}).status_code == 404
+
+    client.post('/save', json={"file_url": "http://example.com/patch3.pdf", "metadata": {"Name": "Bike"}})
+    doc_id = client.get('/documents?sort=-id&per_page=1').get_json()[0]["id"]
+    assert client.patch(f'/document/{doc_id}', json={"metadata": "Red"}).status_code == 400
+    assert client.patch(f'/document/{doc_id}', json={"file_url": "x", "metadata": {}}).status_code == 400
+
+def test_patch_document_deleted_during_update(client):
+    # The row disappears between the version check and the UPDATE.
+    with patch('routes.document_routes.document_version', side_effect=[3, None]), \
+         patch('routes.document_routes.patch_document', return_value=None):
+        response = client.patch('/document/5', json={"metadata": {}}, headers={'If-Match': '"5-3"'})
+    assert response.status_code == 404
+
+    # Without If-Match nothing but a deletion makes the patch fail.
+    with patch('routes.document_routes.document_version', side_effect=[3, 4]), \
+         patch('routes.document_routes.patch_document', return_value=None):
+        response = client.patch('/document/5', json={"metadata": {}})
+    assert response.status_code == 404
+
+def test_serve_file_caching_and_range(client):
+    with open(os.path.join(UPLOAD_FOLDER, 'range_test.pdf'), 'wb') as f:
+        f.write(b"0123456789")
+
+    response = client.get('/files/range_test.pdf')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+
+    response = client.get('/files/range_test.pdf', headers={'If-None-Match': etag})
+    assert response.status_code == 304
 
+    response = client.get('/files/range_test.pdf', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.get_data() == b"2345"
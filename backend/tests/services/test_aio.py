@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from services import aio
+
+
+def test_submit_runs_on_shared_loop():
+    async def where():
+        return threading.current_thread().name
+
+    assert aio.submit(where()).result(timeout=5) == "aio-loop"
+
+
+def test_run_from_another_loop():
+    async def answer():
+        return asyncio.get_running_loop()
+
+    loop = asyncio.run(aio.run(answer()))
+    assert loop is aio.get_loop()
+
+
+def test_run_blocking_uses_thread_pool():
+    async def blocking():
+        return await aio.run_blocking(lambda x, y=0: (threading.current_thread().name, x + y), 1, y=2)
+
+    name, total = aio.submit(blocking()).result(timeout=5)
+    assert name.startswith("aio-blocking")
+    assert total == 3
+
+
+def test_bounded_caps_concurrency(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(aio, "_slots", asyncio.Semaphore(2))
+        running = peak = 0
+
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(aio.bounded(work()) for _ in range(6)))
+        return peak
+
+    assert aio.submit(scenario()).result(timeout=5) == 2
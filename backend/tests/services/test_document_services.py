@@ -1,10 +1,30 @@
+import csv
+import hashlib
 import io
+import json
 import os
+import time
 import pytest
-from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import call, patch, MagicMock
 
 import services.document_services as ds
 
+UPLOAD_FOLDER = "tests/uploads"
+
+
+def stored_key(content, ext=".pdf"):
+    return hashlib.sha256(content).hexdigest() + ext
+
+
+def stored_path(content):
+    key = stored_key(content)
+    return os.path.join(UPLOAD_FOLDER, key[:2], key[2:4], key)
+
+
+def remove_stored(content):
+    ds.storage.get_storage(UPLOAD_FOLDER).delete(stored_key(content))
+
 
 def test_allowed_file():
     assert ds.allowed_file("file.pdf")
@@ -13,17 +33,15 @@ def test_allowed_file():
     assert not ds.allowed_file("file.PDFX")
 
 
-@patch("services.document_services.secure_filename", side_effect=lambda x: x)
-@patch("services.document_services.os.path.exists", side_effect=[True, True, False])
 @patch("services.document_services.pdf_parser.extract_text_from_pdf")
 @patch("services.document_services.extractor.extract_metadata_from_text")
-def test_process_upload_success(mock_extract_meta, mock_extract_text, mock_exists, mock_secure):
+@patch("services.document_services.extraction_cache")
+def test_process_upload_success(mock_cache, mock_extract_meta, mock_extract_text):
     class DummyFile:
         filename = "test.pdf"
-        def save(self, path):
-            # simulate saving file
-            open(path, 'wb').write(b"dummy pdf content")
+        stream = io.BytesIO(b"dummy pdf content")
 
+    mock_cache.lookup.return_value = None
     mock_extract_text.return_value = "some extracted text"
     mock_extract_meta.return_value = {"title": "doc title"}
 
@@ -33,42 +51,166 @@ def test_process_upload_success(mock_extract_meta, mock_extract_text, mock_exist
 
     result = ds.process_upload(dummy_file, upload_folder, "http://localhost")
     assert "metadata" in result and result["metadata"]["title"] == "doc title"
-    assert "file_url" in result and result["file_url"].endswith("/files/test.pdf")
+    assert "file_url" in result and result["file_url"].endswith("/files/" + stored_key(b"dummy pdf content"))
+    mock_extract_text.assert_called_once_with(stored_path(b"dummy pdf content"))
+
+    content_hash = hashlib.sha256(b"dummy pdf content").hexdigest()
+    # Looked up before extracting, and again, uncounted, once the single-flight slot is held.
+    assert mock_cache.lookup.call_args_list == [call(content_hash), call(content_hash, record=False)]
+    mock_cache.store.assert_called_once_with(content_hash, "some extracted text", {"title": "doc title"})
 
     # Cleanup
-    os.remove(os.path.join(upload_folder, "test.pdf"))
+    remove_stored(b"dummy pdf content")
+
+
+@patch("services.document_services.pdf_parser.extract_text_from_pdf")
+@patch("services.document_services.extraction_cache")
+def test_process_upload_cache_hit_skips_extraction(mock_cache, mock_extract_text):
+    class DummyFile:
+        filename = "cached.pdf"
+        stream = io.BytesIO(b"same bytes")
+
+    mock_cache.lookup.return_value = {"title": "cached"}
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    result = ds.process_upload(DummyFile(), upload_folder, "http://localhost")
+
+    assert result["metadata"] == {"title": "cached"}
+    mock_extract_text.assert_not_called()
+    mock_cache.store.assert_not_called()
+
+    remove_stored(b"same bytes")
+
+
+def test_failed_duplicate_upload_keeps_shared_file():
+    class DummyFile:
+        def __init__(self):
+            self.filename = "shared.pdf"
+            self.stream = io.BytesIO(b"shared bytes")
+
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", return_value="text"), \
+         patch("services.document_services.extractor.extract_metadata_from_text", return_value={}), \
+         patch("services.document_services.extraction_cache.lookup", return_value=None), \
+         patch("services.document_services.extraction_cache.store"):
+        ds.process_upload(DummyFile(), upload_folder, "http://localhost")
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=Exception("fail")), \
+         patch("services.document_services.extraction_cache.lookup", return_value=None):
+        with pytest.raises(RuntimeError):
+            ds.process_upload(DummyFile(), upload_folder, "http://localhost")
+
+    assert os.path.exists(stored_path(b"shared bytes"))
+
+    remove_stored(b"shared bytes")
+
+
+def test_upload_counts_one_cache_lookup(session):
+    class DummyFile:
+        def __init__(self):
+            self.filename = "counted.pdf"
+            self.stream = io.BytesIO(b"counted once")
+
+    ds.extraction_cache.reset_stats()
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", return_value="text"), \
+         patch("services.document_services.extractor.extract_metadata_from_text", return_value={"Name": "Bike"}):
+        ds.process_upload(DummyFile(), UPLOAD_FOLDER, "http://localhost")
+        ds.process_upload(DummyFile(), UPLOAD_FOLDER, "http://localhost")
+
+    stats = ds.extraction_cache.stats()
+    assert (stats["misses"], stats["hits"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    remove_stored(b"counted once")
+
+
+def test_identical_concurrent_uploads_extract_once():
+    import threading
+
+    class DummyFile:
+        def __init__(self):
+            self.filename = "double_click.pdf"
+            self.stream = io.BytesIO(b"double click")
+
+    release = threading.Event()
+    calls = []
+
+    def parse(path):
+        calls.append(path)
+        release.wait(5)
+        return "text"
+
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+    results = []
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=parse), \
+         patch("services.document_services.extractor.extract_metadata_from_text", return_value={"Name": "Bike"}), \
+         patch("services.document_services.extraction_cache") as mock_cache:
+        mock_cache.lookup.return_value = None
+        coalesced = ds.singleflight.extractions.stats()["coalesced"]
+        threads = [threading.Thread(target=lambda: results.append(
+            ds.process_upload(DummyFile(), upload_folder, "http://localhost"))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while ds.singleflight.extractions.stats()["coalesced"] < coalesced + 2 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+    assert len(calls) == 1
+    assert [r["metadata"] for r in results] == [{"Name": "Bike"}] * 3
+
+    remove_stored(b"double click")
 
 
 def test_process_upload_unsupported_file():
     class DummyFile:
         filename = "badfile.txt"
-        def save(self, path):
-            pass
+        stream = io.BytesIO(b"")
 
     with pytest.raises(ValueError, match="Unsupported file type"):
         ds.process_upload(DummyFile(), "any_folder", "http://localhost")
 
 
+def test_collect_garbage(tmp_path):
+    store = ds.storage.LocalStorage(str(tmp_path))
+    with patch("services.storage.time.time", return_value=0):
+        saved, orphan = (store.save(io.BytesIO(content), "file.pdf") for content in (b"saved", b"orphan"))
+    recent = store.save(io.BytesIO(b"recent"), "file.pdf")
+
+    with patch("services.document_services.storage.get_storage", return_value=store), \
+         patch("services.document_services.referenced_file_keys", return_value={saved.key}):
+        removed = ds.collect_garbage(str(tmp_path), grace=3600)
+
+    assert removed == [orphan.key]
+    assert sorted(key for key, _ in store.iter_files()) == sorted([saved.key, recent.key])
+
+
 def test_process_upload_extraction_failure():
     class DummyFile:
         filename = "fail.pdf"
-        def save(self, path):
-            with open(path, "wb") as f:
-                f.write(b"content")
+        stream = io.BytesIO(b"failing content")
 
     dummy_file = DummyFile()
     upload_folder = "tests/uploads"
     os.makedirs(upload_folder, exist_ok=True)
 
     with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=Exception("fail")), \
-         patch("services.document_services.extractor.extract_metadata_from_text"):
+         patch("services.document_services.extractor.extract_metadata_from_text"), \
+         patch("services.document_services.extraction_cache.lookup", return_value=None):
 
         with pytest.raises(RuntimeError, match="Failed to extract metadata"):
             ds.process_upload(dummy_file, upload_folder, "http://localhost")
 
-        # File should be removed after failure
-        path = os.path.join(upload_folder, "fail.pdf")
-        assert not os.path.exists(path)
+        # Identical uploads may share the file, so it is left for collect_garbage.
+        assert os.path.exists(stored_path(b"failing content"))
+
+    remove_stored(b"failing content")
 
 
 def test_list_documents_valid_and_invalid():
@@ -77,7 +219,7 @@ def test_list_documents_valid_and_invalid():
         mock_get_docs.return_value = [{"id": 1}]
         res = ds.list_documents("1", "5", "")
         assert isinstance(res, list)
-        mock_get_docs.assert_called_with(offset=0, limit=5, search_query="")
+        mock_get_docs.assert_called_with(offset=0, limit=5, search_query="", filters=None, sort=None, raw=False)
 
         # invalid page/per_page raises
         with pytest.raises(ValueError):
@@ -135,3 +277,336 @@ def test_update_document_invalid_and_valid():
         # Valid
         ds.update_document(1, {"metadata": {"a": 1}})
         mock_update.assert_called_once_with(1, {"a": 1})
+
+
+def test_enqueue_upload_creates_job():
+    class DummyFile:
+        filename = "queued.pdf"
+        stream = io.BytesIO(b"content")
+
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    with patch("services.document_services.insert_job", return_value=7) as mock_insert, \
+         patch("services.document_services.extraction_cache.lookup", return_value=None), \
+         patch("services.document_services.job_queue.submit") as mock_submit:
+        result = ds.enqueue_upload(DummyFile(), upload_folder, "http://localhost/")
+
+    path = stored_path(b"content")
+    assert result == {"job_id": 7, "status": "queued"}
+    content_hash = hashlib.sha256(b"content").hexdigest()
+    mock_insert.assert_called_once_with(path, "http://localhost/files/" + stored_key(b"content"), content_hash)
+    assert mock_submit.call_args.args == (7, ds.extract_file, path, content_hash)
+
+    remove_stored(b"content")
+
+
+def test_enqueue_upload_on_event_loop():
+    class DummyFile:
+        filename = "queued.pdf"
+        stream = io.BytesIO(b"coroutine")
+
+    with patch("services.document_services.JOB_EXECUTOR", "async"), \
+         patch("services.document_services.insert_job", return_value=8), \
+         patch("services.document_services.extraction_cache.lookup", return_value=None), \
+         patch("services.document_services.job_queue.submit_async") as mock_submit:
+        ds.enqueue_upload(DummyFile(), "tests/uploads", "http://localhost/")
+
+    content_hash = hashlib.sha256(b"coroutine").hexdigest()
+    assert mock_submit.call_args.args == (8, ds.extract_file_async, stored_path(b"coroutine"), content_hash)
+
+    remove_stored(b"coroutine")
+
+
+def test_get_job_invalid_and_valid():
+    with patch("services.document_services.get_job_by_id") as mock_get_job:
+        with pytest.raises(ValueError):
+            ds.get_job(0)
+
+        mock_get_job.return_value = {"id": 1, "status": "done"}
+        assert ds.get_job(1) == {"id": 1, "status": "done"}
+
+
+def test_process_batch_upload_isolates_failures():
+    class DummyFile:
+        def __init__(self, filename, content):
+            self.filename = filename
+            self.stream = io.BytesIO(content)
+
+    def parse(path):
+        with open(path, "rb") as f:
+            content = f.read().decode()
+        if content == "broken":
+            raise Exception("bad pdf")
+        return "text of " + content
+
+    files = [
+        DummyFile("good.pdf", b"good"),
+        DummyFile("notes.txt", b"txt"),
+        DummyFile("broken.pdf", b"broken"),
+    ]
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=2) as parse_pool, \
+         patch("services.document_services._get_parse_pool", return_value=parse_pool), \
+         patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=parse), \
+         patch("services.document_services.extractor.extract_metadata_from_text",
+               side_effect=lambda text: {"text": text}), \
+         patch("services.document_services.extraction_cache") as mock_cache:
+        mock_cache.lookup.return_value = None
+        results = {r["index"]: r for r in ds.process_batch_upload(files, upload_folder, "http://localhost")}
+
+    assert results[0]["metadata"] == {"text": "text of good"}
+    assert results[0]["file_url"] == "http://localhost/files/" + stored_key(b"good")
+    assert results[1]["error"] == "Unsupported file type"
+    assert "bad pdf" in results[2]["error"]
+    assert os.path.exists(stored_path(b"broken"))
+
+    remove_stored(b"good")
+    remove_stored(b"broken")
+
+
+def test_broken_parse_pool_is_replaced():
+    broken = MagicMock()
+    broken.submit.side_effect = ds.BrokenProcessPool("worker died")
+    fresh = MagicMock()
+
+    with patch("services.document_services._parse_pool", broken), \
+         patch("services.document_services.ProcessPoolExecutor", return_value=fresh):
+        assert ds._submit_parse("a.pdf") is fresh.submit.return_value
+        assert ds._parse_pool is fresh
+
+    broken.shutdown.assert_called_once_with(wait=False)
+    fresh.submit.assert_called_once_with(ds.pdf_parser.extract_text_from_pdf, "a.pdf")
+
+
+def test_extract_file_async_runs_on_shared_loop():
+    import threading
+    from unittest.mock import AsyncMock
+
+    threads = []
+
+    def parse(path):
+        threads.append(threading.current_thread().name)
+        return "text"
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=parse), \
+         patch("services.document_services.extractor.extract_metadata_from_text_async",
+               new_callable=AsyncMock, return_value={"Name": "Bike"}), \
+         patch("services.document_services.extraction_cache") as mock_cache:
+        metadata = ds.aio.submit(ds.extract_file_async("async.pdf", "abc")).result(timeout=5)
+
+    assert metadata == {"Name": "Bike"}
+    assert threads[0].startswith("aio-blocking")
+    mock_cache.store.assert_called_once_with("abc", "text", {"Name": "Bike"})
+
+
+def test_stream_upload_reports_progress():
+    class DummyFile:
+        filename = "streamed.pdf"
+        stream = io.BytesIO(b"streamed")
+
+    def parse(path, progress):
+        progress(1, 2)
+        progress(2, 2)
+        return "text"
+
+    def extract(text, on_event):
+        on_event("started", {"backend": "llm", "fields": ["Name"]})
+        return {"Name": "Bike"}
+
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=parse), \
+         patch("services.document_services.extractor.extract_metadata_from_text", side_effect=extract), \
+         patch("services.document_services.extraction_cache") as mock_cache:
+        mock_cache.lookup.return_value = None
+        events = list(ds.stream_upload(DummyFile(), upload_folder, "http://localhost"))
+
+    file_url = "http://localhost/files/" + stored_key(b"streamed")
+    assert events == [
+        ("saved", {"filename": "streamed.pdf", "file_url": file_url}),
+        ("pages", {"parsed": 1, "total": 2}),
+        ("pages", {"parsed": 2, "total": 2}),
+        ("started", {"backend": "llm", "fields": ["Name"]}),
+        ("done", {"metadata": {"Name": "Bike"}, "file_url": file_url}),
+    ]
+    mock_cache.store.assert_called_once()
+
+    remove_stored(b"streamed")
+
+
+def test_stream_upload_reports_errors():
+    class DummyFile:
+        filename = "stream_broken.pdf"
+        stream = io.BytesIO(b"broken")
+
+    upload_folder = "tests/uploads"
+    os.makedirs(upload_folder, exist_ok=True)
+
+    with patch("services.document_services.pdf_parser.extract_text_from_pdf", side_effect=Exception("bad pdf")), \
+         patch("services.document_services.extraction_cache") as mock_cache:
+        mock_cache.lookup.return_value = None
+        events = list(ds.stream_upload(DummyFile(), upload_folder, "http://localhost"))
+
+    assert events[-1][0] == "error"
+    assert "bad pdf" in events[-1][1]["error"]
+    assert os.path.exists(stored_path(b"broken"))
+
+    remove_stored(b"broken")
+
+
+def test_list_documents_caps_per_page():
+    with patch("services.document_services.get_documents") as mock_get_docs:
+        ds.list_documents("2", "1000000", "")
+        mock_get_docs.assert_called_with(offset=ds.MAX_PER_PAGE, limit=ds.MAX_PER_PAGE, search_query="",
+                                         filters=None, sort=None, raw=False)
+
+
+def test_list_documents_cursor_mode():
+    with patch("services.document_services.get_documents") as mock_get_docs:
+        mock_get_docs.return_value = [{"id": 4}, {"id": 7}, {"id": 9}]
+        res = ds.list_documents("1", "10", "bike", after="3", limit="2")
+        mock_get_docs.assert_called_with(limit=3, search_query="bike", after_id=3, filters=None, raw=False)
+        assert res == {"items": [{"id": 4}, {"id": 7}], "next_cursor": 7}
+
+        mock_get_docs.return_value = [{"id": 9}]
+        assert ds.list_documents("1", "10", after="7", limit="2")["next_cursor"] is None
+
+        with pytest.raises(ValueError):
+            ds.list_documents("1", "10", after="x")
+        with pytest.raises(ValueError):
+            ds.list_documents("1", "10", after="-1", limit="2")
+
+
+def test_parse_filters_and_sort():
+    args = {"color": "Black", "product_line": "R", "list_price_min": "100",
+            "product_model_id": "7", "unknown": "x"}
+    assert ds.parse_filters(args) == {
+        "color": "Black", "product_line": "R", "list_price_min": 100.0, "product_model_id": 7
+    }
+    with pytest.raises(ValueError):
+        ds.parse_filters({"list_price_max": "cheap"})
+
+    assert ds.parse_sort("-list_price") == "-list_price"
+    assert ds.parse_sort("class") == "product_class"
+    with pytest.raises(ValueError):
+        ds.parse_sort("metadata")
+    with pytest.raises(ValueError):
+        ds.list_documents("1", "10", after="0", sort="color")
+
+
+def test_save_documents_bulk_batches_and_reports_errors():
+    records = [
+        {"file_url": "a", "metadata": {"x": 1}},
+        {"file_url": "b"},
+        '{"file_url": "c", "metadata": {"x": 3}}',
+        b"not json",
+        {"file_url": "d", "metadata": {"x": 4}},
+    ]
+    batches = []
+
+    def insert(batch):
+        batches.append(batch)
+        return [100 + len(batches) * 10 + i for i in range(len(batch))]
+
+    with patch("services.document_services.insert_documents", side_effect=insert):
+        results = ds.save_documents_bulk(records, batch_size=2)
+
+    assert batches == [[("a", {"x": 1}), ("c", {"x": 3})], [("d", {"x": 4})]]
+    assert results == [
+        {"index": 0, "id": 110},
+        {"index": 1, "error": "Missing or invalid metadata"},
+        {"index": 2, "id": 111},
+        {"index": 3, "error": "Invalid JSON"},
+        {"index": 4, "id": 120},
+    ]
+
+
+def test_save_documents_bulk_failed_batch():
+    with patch("services.document_services.insert_documents", side_effect=Exception("locked")):
+        results = ds.save_documents_bulk([{"file_url": "a", "metadata": {"x": 1}}])
+
+    assert results == [{"index": 0, "error": "Failed to save document"}]
+
+
+def test_save_documents_bulk_isolates_bad_rows():
+    records = [{"file_url": url, "metadata": {"x": 1}} for url in "abcde"]
+    calls = []
+
+    def insert(batch):
+        calls.append(len(batch))
+        if any(url == "c" for url, _ in batch):
+            raise Exception("constraint failed")
+        return [ord(url) for url, _ in batch]
+
+    with patch("services.document_services.insert_documents", side_effect=insert):
+        results = ds.save_documents_bulk(records, batch_size=5)
+
+    assert results == [
+        {"index": 0, "id": ord("a")},
+        {"index": 1, "id": ord("b")},
+        {"index": 2, "error": "Failed to save document"},
+        {"index": 3, "id": ord("d")},
+        {"index": 4, "id": ord("e")},
+    ]
+    assert calls == [5, 2, 3, 1, 2]
+
+
+def test_export_documents_ndjson_and_csv():
+    docs = [
+        {"id": 1, "metadata": {"Name": "Bike", "Color": "Red", "Extra": "x"}, "file_url": "a"},
+        {"id": 2, "metadata": {"Name": "Helmet, small"}, "file_url": "b"},
+    ]
+    with patch("services.document_services.iter_documents", return_value=iter(docs)) as mock_iter:
+        lines = "".join(ds.export_documents("ndjson", "bike", filters={"color": "Red"})).splitlines()
+    mock_iter.assert_called_once_with(search_query="bike", filters={"color": "Red"}, sort=None)
+    assert [json.loads(line) for line in lines] == docs
+
+    with patch("services.document_services.iter_documents", return_value=iter(docs)):
+        rows = list(csv.reader(io.StringIO("".join(ds.export_documents("csv")))))
+    assert rows[0][:4] == ["id", "file_url", "ProductID", "Name"]
+    assert len(rows[0]) == 16
+    assert rows[1][3] == "Bike" and rows[2][3] == "Helmet, small"
+
+    with pytest.raises(ValueError):
+        ds.export_documents("xml")
+
+
+def test_document_etag():
+    with patch("services.document_services.get_document_version") as mock_version:
+        mock_version.return_value = 3
+        assert ds.document_etag(5) == "5-3"
+
+        mock_version.return_value = None
+        assert ds.document_etag(5) is None
+
+        with pytest.raises(ValueError):
+            ds.document_etag(0)
+
+
+def test_patch_document():
+    with patch("services.document_services.patch_document_metadata") as mock_patch:
+        mock_patch.return_value = (4, {"Color": "Blue"})
+        assert ds.patch_document(5, {"metadata": {"Color": "Blue"}}, expected_version=3) == {
+            "id": 5, "version": 4, "metadata": {"Color": "Blue"}}
+        mock_patch.assert_called_once_with(5, {"Color": "Blue"}, 3)
+
+        mock_patch.return_value = None
+        assert ds.patch_document(5, {"metadata": {}}) is None
+
+
+@pytest.mark.parametrize("doc_id, data", [
+    (0, {"metadata": {}}),
+    (5, ["metadata"]),
+    (5, {"file_url": "x", "metadata": {}}),
+    (5, {}),
+    (5, {"metadata": "Blue"}),
+])
+def test_patch_document_invalid(doc_id, data):
+    with patch("services.document_services.patch_document_metadata") as mock_patch:
+        with pytest.raises(ValueError):
+            ds.patch_document(doc_id, data)
+    mock_patch.assert_not_called()
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+from services import extraction_cache
+
+
+def setup_function():
+    extraction_cache.reset_stats()
+
+
+def test_store_then_lookup_hits(session):
+    assert extraction_cache.lookup("abc") is None
+
+    extraction_cache.store("abc", "some text", {"Name": "Bike"})
+
+    assert extraction_cache.lookup("abc") == {"Name": "Bike"}
+    stats = extraction_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_model_change_invalidates_entry(session):
+    extraction_cache.store("abc", "some text", {"Name": "Bike"})
+
+    with patch("services.extraction_cache.LLM_MODEL", "another/model"):
+        assert extraction_cache.lookup("abc") is None
+
+    assert extraction_cache.stats()["stale"] == 1
+
+
+def test_prompt_change_invalidates_entry(session):
+    extraction_cache.store("abc", "some text", {"Name": "Bike"})
+
+    with patch("services.extraction_cache.PROMPT_VERSION", "edited"):
+        assert extraction_cache.lookup("abc") is None
+        extraction_cache.store("abc", "some text", {"Name": "Bike v2"})
+        assert extraction_cache.lookup("abc") == {"Name": "Bike v2"}
+
+
+def test_lookup_without_record_leaves_stats(session):
+    extraction_cache.store("abc", "some text", {"Name": "Bike"})
+
+    assert extraction_cache.lookup("missing", record=False) is None
+    assert extraction_cache.lookup("abc", record=False) == {"Name": "Bike"}
+
+    assert extraction_cache.stats() == {"hits": 0, "misses": 0, "stale": 0, "hit_rate": 0.0}
@@ -1,5 +1,6 @@
 import pytest
 import json
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
 import services.extractor as extractor  # adjust import path if needed
@@ -34,7 +35,7 @@ def test_extract_metadata_success():
         ]
     }
 
-    with patch("services.extractor.requests.post") as mock_post:
+    with patch("services.llm_client.client.session.post") as mock_post:
         mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = fake_api_response
 
@@ -47,7 +48,7 @@ def test_extract_metadata_success():
 
 
 def test_extract_metadata_api_failure():
-    with patch("services.extractor.requests.post") as mock_post:
+    with patch("services.llm_client.client.session.post") as mock_post:
         mock_post.return_value.status_code = 500
         mock_post.return_value.text = "Internal Server Error"
 
@@ -58,7 +59,7 @@ def test_extract_metadata_api_failure():
 
 
 def test_extract_metadata_invalid_json():
-    with patch("services.extractor.requests.post") as mock_post:
+    with patch("services.llm_client.client.session.post") as mock_post:
         mock_post.return_value.status_code = 200
         # Return invalid JSON in content
         fake_api_response = {
@@ -74,3 +75,312 @@ def test_extract_metadata_invalid_json():
 
         with pytest.raises(json.JSONDecodeError):
             extractor.extract_metadata_from_text("some text")
+
+
+def test_extract_metadata_retries_rate_limit():
+    rate_limited = MagicMock(status_code=429, headers={"Retry-After": "2"})
+    ok = MagicMock(status_code=200)
+    ok.json.return_value = {"choices": [{"message": {"content": "{\"Name\": \"Bike\"}"}}]}
+
+    with patch("services.llm_client.client.session.post", side_effect=[rate_limited, ok]) as mock_post, \
+         patch("services.llm_client.time.sleep") as mock_sleep:
+        result = extractor.extract_metadata_from_text("some text")
+
+    assert result == {"Name": "Bike"}
+    assert mock_post.call_count == 2
+    mock_sleep.assert_called_once_with(2.0)
+
+
+def test_extract_metadata_records_token_usage():
+    ok = MagicMock(status_code=200)
+    ok.json.return_value = {
+        "choices": [{"message": {"content": "{}"}}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": 30},
+    }
+    before = extractor.LLM_TOKENS.value(type="prompt")
+
+    with patch("services.llm_client.client.session.post", return_value=ok):
+        extractor.extract_metadata_from_text("some text")
+
+    assert extractor.LLM_TOKENS.value(type="prompt") == before + 120
+
+
+CATALOG_TEXT = """Product Catalog
+Mountain Bike (#MB-100)
+Product ID: 1
+Make Flag: True
+Finished Goods Flag: True
+Color: Red
+Standard Cost: $500.00
+List Price: $800.00
+Size: L
+Product Line: M
+Class: H
+Style: U
+Subcategory ID: 1
+Model ID: 101"""
+
+
+def test_rule_based_extractor_reads_all_fields():
+    result = extractor.RuleBasedExtractor().extract(CATALOG_TEXT)
+
+    assert set(result) == set(extractor.METADATA_FIELDS)
+    assert result["Name"] == "Mountain Bike"
+    assert result["ProductNumber"] == "MB-100"
+    assert result["StandardCost"] == "$500.00"
+    assert result["ProductSubcategoryID"] == "1"
+    assert result["ProductModelID"] == "101"
+
+
+def test_rule_based_extractor_ignores_non_template_text():
+    assert extractor.RuleBasedExtractor().extract("A red bike.\nColor: Red") == {}
+
+
+def test_templated_catalog_skips_llm():
+    extractor.reset_stats()
+    with patch("services.llm_client.client.session.post") as mock_post:
+        result = extractor.extract_metadata_from_text(CATALOG_TEXT)
+
+    mock_post.assert_not_called()
+    assert list(result) == list(extractor.METADATA_FIELDS)
+    assert extractor.stats()["rules"] == {"calls": 1, "hits": 1, "complete": 1, "invalid": 0, "fields": 14,
+                                          "hit_rate": 1.0}
+
+
+def test_llm_fills_only_missing_fields():
+    text = CATALOG_TEXT.replace("Color: Red\n", "").replace("Size: L\n", "")
+    ok = MagicMock(status_code=200)
+    ok.json.return_value = {"choices": [{"message": {"content": json.dumps(
+        {"Color": "Red", "Size": "L", "ProductID": "999"})}}]}
+    extractor.reset_stats()
+
+    with patch("services.llm_client.client.session.post", return_value=ok) as mock_post:
+        result = extractor.extract_metadata_from_text(text)
+
+    prompt = mock_post.call_args.kwargs["json"]["messages"][-1]["content"]
+    assert '"Color": ""' in prompt and '"Size": ""' in prompt
+    assert '"ProductID": ""' not in prompt
+    assert result["Color"] == "Red" and result["Size"] == "L"
+    assert result["ProductID"] == "1"
+    stats = extractor.stats()
+    assert stats["rules"]["complete"] == 0 and stats["rules"]["fields"] == 12
+    assert stats["llm"]["complete"] == 1 and stats["llm"]["fields"] == 2
+
+
+@pytest.mark.parametrize("answer", [["Red"], "Red", None])
+def test_non_object_answer_is_a_miss(answer):
+    class Odd(extractor.Extractor):
+        name = "odd"
+
+        def extract(self, text, fields=extractor.METADATA_FIELDS):
+            return answer
+
+    class Fallback(extractor.Extractor):
+        name = "fallback"
+
+        def extract(self, text, fields=extractor.METADATA_FIELDS):
+            return {"Color": "Red"}
+
+    extractor.reset_stats()
+    result = extractor.extract_metadata_from_text("text", backends=[Odd(), Fallback()])
+
+    assert result == {"Color": "Red"}
+    assert extractor.stats()["odd"]["invalid"] == 1
+
+
+def test_backend_without_extract_cannot_be_created():
+    class Incomplete(extractor.Extractor):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        extractor._build_chain(["rules", "ocr"])
+
+
+@pytest.mark.parametrize("setting, value", [
+    ("EXTRACTOR_BACKENDS", ["llm"]),
+    ("RULES_MIN_FIELDS", 9),
+    ("FIELD_LABELS", {"Name": ("Title",)}),
+    ("PROMPT_TOKEN_BUDGET", 100),
+    ("PROMPT_MAX_CHUNKS", 1),
+    ("BATCH_PROMPT_TEMPLATE", "{fields}{documents}"),
+])
+def test_prompt_version_tracks_extraction_settings(setting, value):
+    with patch.object(extractor, setting, value):
+        assert extractor._prompt_version() != extractor.PROMPT_VERSION
+
+
+def test_chunked_answers_are_merged():
+    answers = {"first": {"ProductID": "7", "Color": ""}, "second": {"Color": "Red"}}
+
+    with patch.object(extractor.prompt_builder, "plan", return_value=["first", "second"]), \
+         patch.object(extractor.LLMExtractor, "_extract_chunk", lambda self, chunk, fields: answers[chunk]):
+        result = extractor.LLMExtractor().extract("long text")
+
+    assert result["ProductID"] == "7"
+    assert result["Color"] == "Red"
+    assert result["Name"] == ""
+
+
+def sse_response(*deltas, usage=None):
+    lines = [b": OPENROUTER PROCESSING", b""]
+    for delta in deltas:
+        lines.append(b"data: " + json.dumps({"choices": [{"delta": {"content": delta}}]}).encode())
+    if usage:
+        lines.append(b"data: " + json.dumps({"choices": [], "usage": usage}).encode())
+    lines.append(b"data: [DONE]")
+    response = MagicMock(status_code=200)
+    response.iter_lines.return_value = lines
+    return response
+
+
+def test_streamed_extraction_reports_tokens_and_partial_fields():
+    response = sse_response('{"Name": "Bi', 'ke", "Col', 'or": "Red"}', usage={"completion_tokens": 9})
+    events = []
+
+    with patch("services.llm_client.client.session.post", return_value=response) as mock_post:
+        result = extractor.extract_metadata_from_text(
+            "free text", on_event=lambda event, data: events.append((event, data)))
+
+    assert mock_post.call_args.kwargs["json"]["stream"] is True
+    assert mock_post.call_args.kwargs["stream"] is True
+    assert result == {"Name": "Bike", "Color": "Red"}
+    names = [event for event, _ in events]
+    assert names[0] == "started" and names.count("token") == 3
+    partial = [data["fields"] for event, data in events if event == "fields" and data.get("partial")]
+    assert partial == [{"Name": "Bike"}, {"Color": "Red"}]
+    assert events[-1] == ("fields", {"backend": "llm", "fields": {"Name": "Bike", "Color": "Red"}})
+    response.close.assert_called_once()
+
+
+def test_streamed_fields_found_one_character_at_a_time():
+    answer = json.dumps({"ProductID": 7, "Name": 'Bike "Pro"', "Color": "Red", "Size": "L"})
+    events = []
+
+    with patch("services.llm_client.client.session.post", return_value=sse_response(*answer)):
+        extractor.extract_metadata_from_text("free text", on_event=lambda event, data: events.append((event, data)))
+
+    partial = [data["fields"] for event, data in events if event == "fields" and data.get("partial")]
+    assert partial == [{"Name": 'Bike "Pro"'}, {"Color": "Red"}, {"Size": "L"}]
+
+
+def test_streamed_extraction_of_template_reports_rule_fields():
+    events = []
+
+    with patch("services.llm_client.client.session.post") as mock_post:
+        extractor.extract_metadata_from_text(CATALOG_TEXT, on_event=lambda *e: events.append(e))
+
+    mock_post.assert_not_called()
+    assert [event for event, _ in events] == ["started", "fields"]
+    assert events[1][1]["backend"] == "rules"
+    assert len(events[1][1]["fields"]) == 14
+
+
+def test_async_extraction_uses_async_client():
+    import asyncio
+    from unittest.mock import AsyncMock
+
+    text = CATALOG_TEXT.replace("Color: Red\n", "")
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"choices": [{"message": {"content": '{"Color": "Red"}'}}]}
+    async_client = MagicMock()
+    async_client.post = AsyncMock(return_value=response)
+
+    with patch("services.llm_client.get_async_client", return_value=async_client), \
+         patch("services.llm_client.client.session.post") as blocking_post:
+        result = asyncio.run(extractor.extract_metadata_from_text_async(text))
+
+    blocking_post.assert_not_called()
+    assert result["Color"] == "Red"
+    assert result["ProductID"] == "1"
+    assert list(result) == list(extractor.METADATA_FIELDS)
+    assert '"Color": ""' in async_client.post.call_args.args[0]["messages"][-1]["content"]
+
+
+def test_async_extraction_api_failure():
+    import asyncio
+    from unittest.mock import AsyncMock
+
+    async_client = MagicMock()
+    async_client.post = AsyncMock(return_value=MagicMock(status_code=500, text="Internal Server Error"))
+
+    with patch("services.llm_client.get_async_client", return_value=async_client):
+        with pytest.raises(Exception) as excinfo:
+            asyncio.run(extractor.extract_metadata_from_text_async("some text"))
+
+    assert "LLM API Error" in str(excinfo.value)
+
+
+def batch_reply(answer):
+    response = MagicMock(status_code=200)
+    response.json.return_value = {"choices": [{"message": {"content": json.dumps(answer)}}]}
+    return response
+
+
+def test_split_batch_matches_documents_by_index():
+    requests = [("a", ("Color",)), ("b", ("Color", "Size")), ("c", ("Color",)), ("d", ("Color",))]
+    answer = json.dumps([
+        {"index": 1, "Color": "Blue", "Size": "L", "Style": "U"},
+        {"index": 0, "Color": "Red"},
+        {"index": 2, "Name": "Bike"},
+        "not an object",
+    ])
+
+    assert extractor._split_batch(answer, requests) == [
+        {"Color": "Red"}, {"Color": "Blue", "Size": "L"}, None, None]
+    assert extractor._split_batch('{"0": {"Color": "Red"}}', requests[:1]) == [{"Color": "Red"}]
+    assert extractor._split_batch("not json", requests) == [None] * 4
+
+
+def test_batched_documents_share_one_call():
+    from services.llm_batcher import Batcher
+
+    batcher = Batcher("test", extractor._extract_batch, token_budget=1000, linger_ms=50)
+    backend = extractor.BatchingLLMExtractor(batcher)
+    texts = ["A red bike.", "A blue bike."]
+    ok = batch_reply([{"index": 0, "Color": "Red"}, {"index": 1, "Color": "Blue"}])
+
+    with patch("services.llm_client.client.session.post", return_value=ok) as mock_post:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(lambda text: backend.extract(text, ["Color"]), texts))
+
+    assert results == [{"Color": "Red"}, {"Color": "Blue"}]
+    assert mock_post.call_count == 1
+    prompt = mock_post.call_args.kwargs["json"]["messages"][-1]["content"]
+    assert "[Document 0]\nA red bike." in prompt and "[Document 1]\nA blue bike." in prompt
+    assert '"index": 0' in prompt
+
+
+def test_unanswered_document_is_retried_alone():
+    from services.llm_batcher import Batcher
+
+    batcher = Batcher("test", extractor._extract_batch, token_budget=1000, linger_ms=50)
+    backend = extractor.BatchingLLMExtractor(batcher)
+    replies = [batch_reply([{"index": 0, "Color": "Red"}]), batch_reply({"Color": "Blue"})]
+
+    with patch("services.llm_client.client.session.post", side_effect=replies) as mock_post:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(lambda text: backend.extract(text, ["Color"]), ["A red bike.", "A blue bike."]))
+
+    assert results == [{"Color": "Red"}, {"Color": "Blue"}]
+    assert mock_post.call_count == 2
+    retry_prompt = mock_post.call_args.kwargs["json"]["messages"][-1]["content"]
+    assert "[Document" not in retry_prompt and "A blue bike." in retry_prompt
+    assert batcher.stats()["unanswered"] == 1
+
+
+def test_async_batched_extraction():
+    import asyncio
+    from services.llm_batcher import Batcher
+
+    batcher = Batcher("test", extractor._extract_batch, token_budget=1000, linger_ms=1)
+    backend = extractor.BatchingLLMExtractor(batcher)
+
+    with patch("services.llm_client.client.session.post", return_value=batch_reply({"Color": "Red"})):
+        result = asyncio.run(extractor.extract_metadata_from_text_async("A red bike.", backends=[backend]))
+
+    assert result == {"Color": "Red"}
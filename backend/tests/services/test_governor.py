@@ -0,0 +1,225 @@
+import asyncio
+import threading
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from services.governor import FAILURE, SUCCESS, THROTTLED, Governor, GovernorRejected, outcome_for_status
+from services.llm_client import LLMClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def make_governor(clock, **kwargs):
+    options = dict(rate_per_minute=0, burst=1, initial_limit=4, min_limit=1, max_limit=8,
+                   latency_target=10, breaker_threshold=3, breaker_cooldown=30, queue_timeout=0)
+    options.update(kwargs)
+    return Governor(clock=clock, **options)
+
+
+def test_token_bucket_limits_rate():
+    clock = FakeClock()
+    governor = make_governor(clock, rate_per_minute=60, burst=2)
+
+    governor.acquire().done(SUCCESS)
+    governor.acquire().done(SUCCESS)
+    with pytest.raises(GovernorRejected) as rejected:
+        governor.acquire()
+    assert rejected.value.reason == "timeout"
+    assert rejected.value.retry_after == pytest.approx(1)
+
+    clock.advance(1)
+    governor.acquire().done(SUCCESS)
+
+
+def test_wait_past_deadline_rejected_at_once():
+    clock = FakeClock()
+    governor = make_governor(clock, rate_per_minute=6, burst=1)
+    governor.acquire().done(SUCCESS)
+
+    # The next token is 10s away, beyond the 5s deadline: no point in waiting.
+    with pytest.raises(GovernorRejected):
+        governor.acquire(timeout=5)
+    assert governor.stats()["rejected"] == {"timeout": 1, "open": 0}
+
+
+def test_concurrency_limit_and_wakeup():
+    governor = Governor(rate_per_minute=0, initial_limit=1, max_limit=1, queue_timeout=5)
+    held = governor.acquire()
+
+    with pytest.raises(GovernorRejected):
+        governor.acquire(timeout=0)
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(governor.acquire()))
+    waiter.start()
+    held.done(SUCCESS)
+    waiter.join(timeout=5)
+
+    assert len(acquired) == 1
+    assert governor.stats()["in_flight"] == 1
+
+
+def test_limit_grows_then_halves_once_per_burst():
+    clock = FakeClock()
+    governor = make_governor(clock, initial_limit=2)
+
+    governor.acquire().done(SUCCESS)
+    assert governor.limit == 3  # slow start: +1 per success
+
+    first, second = governor.acquire(), governor.acquire()
+    first.done(THROTTLED)
+    assert governor.limit == 1
+    # Started before the decrease: the same burst of 429s does not halve again.
+    clock.advance(1)
+    second.done(THROTTLED)
+    assert governor.limit == 1
+    assert governor.stats()["decreases"] == 1
+
+    for _ in range(4):
+        governor.acquire().done(SUCCESS)
+    # After a decrease the limit grows by 1/limit per success.
+    assert 2 <= governor.limit < 4
+
+
+def test_slow_success_halves_limit():
+    clock = FakeClock()
+    governor = make_governor(clock, initial_limit=4, latency_target=10)
+
+    slot = governor.acquire()
+    clock.advance(11)
+    slot.done(SUCCESS)
+
+    assert governor.limit == 2
+
+
+def test_throttling_drains_bucket():
+    clock = FakeClock()
+    governor = make_governor(clock, rate_per_minute=60, burst=5)
+
+    governor.acquire().done(THROTTLED)
+
+    with pytest.raises(GovernorRejected):
+        governor.acquire()
+
+
+def test_breaker_opens_then_probes():
+    clock = FakeClock()
+    governor = make_governor(clock, breaker_threshold=2, breaker_cooldown=30)
+
+    governor.acquire().done(FAILURE)
+    governor.acquire().done(FAILURE)
+    assert governor.stats()["circuit"] == "open"
+    # The breaker stays open past the 10s deadline: rejected without waiting.
+    with pytest.raises(GovernorRejected) as rejected:
+        governor.acquire(timeout=10)
+    assert rejected.value.reason == "open"
+    assert rejected.value.retry_after == pytest.approx(30)
+
+    clock.advance(30)
+    probe = governor.acquire()
+    # While the probe is out everyone else is turned away at once, not queued.
+    with pytest.raises(GovernorRejected) as rejected:
+        governor.acquire(timeout=60)
+    assert rejected.value.reason == "open"
+
+    probe.done(SUCCESS)
+    assert governor.stats()["circuit"] == "closed"
+    governor.acquire().done(SUCCESS)
+
+
+def test_failed_probe_reopens_breaker():
+    clock = FakeClock()
+    governor = make_governor(clock, breaker_threshold=1, breaker_cooldown=30)
+    governor.acquire().done(FAILURE)
+
+    clock.advance(30)
+    governor.acquire().done(FAILURE)
+
+    stats = governor.stats()
+    assert stats["circuit"] == "open"
+    assert stats["trips"] == 2
+    with pytest.raises(GovernorRejected):
+        governor.acquire()
+
+
+def test_throttling_does_not_trip_breaker():
+    clock = FakeClock()
+    governor = make_governor(clock, breaker_threshold=1)
+
+    governor.acquire().done(THROTTLED)
+
+    assert governor.stats()["circuit"] == "closed"
+
+
+def test_acquire_async():
+    clock = FakeClock()
+    governor = make_governor(clock, rate_per_minute=60, burst=1)
+
+    async def run():
+        (await governor.acquire_async()).done(SUCCESS)
+        with pytest.raises(GovernorRejected):
+            await governor.acquire_async()
+
+    asyncio.run(run())
+    assert governor.stats()["queued"] == 0
+
+
+def test_reset():
+    clock = FakeClock()
+    governor = make_governor(clock, breaker_threshold=1)
+    governor.acquire().done(FAILURE)
+
+    governor.reset()
+
+    stats = governor.stats()
+    assert stats["circuit"] == "closed"
+    assert stats["limit"] == 4
+    assert stats["rejected"] == {"timeout": 0, "open": 0}
+
+
+def test_outcome_for_status():
+    assert outcome_for_status(200) == SUCCESS
+    assert outcome_for_status(400) == SUCCESS
+    assert outcome_for_status(429) == THROTTLED
+    assert outcome_for_status(503) == FAILURE
+
+
+def test_client_reports_every_attempt():
+    clock = FakeClock()
+    governor = make_governor(clock, initial_limit=4)
+    client = LLMClient("http://llm.test/v1/chat/completions", "key", max_retries=1, governor=governor)
+    throttled = MagicMock(status_code=429, headers={})
+    ok = MagicMock(status_code=200)
+
+    with patch.object(client.session, "post", side_effect=[throttled, ok]), \
+         patch("services.llm_client.time.sleep"):
+        assert client.post({}) is ok
+
+    stats = governor.stats()
+    assert stats["granted"] == 2
+    assert stats["decreases"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_client_raises_rejection():
+    clock = FakeClock()
+    governor = make_governor(clock, breaker_threshold=1)
+    governor.acquire().done(FAILURE)
+    client = LLMClient("http://llm.test/v1/chat/completions", "key", governor=governor)
+
+    with patch.object(client.session, "post") as mock_post:
+        with pytest.raises(GovernorRejected):
+            client.post({})
+
+    mock_post.assert_not_called()
+    assert client.stats()["errors"] == 1
@@ -0,0 +1,57 @@
+from unittest.mock import patch, MagicMock
+
+from services import job_queue
+
+
+def test_submit_records_result():
+    with patch("services.job_queue.claim_job", return_value=True) as mock_claim, \
+         patch("services.job_queue.update_job") as mock_update:
+        future = job_queue.submit(1, lambda path: {"Name": path}, "a.pdf")
+        future.result(timeout=5)
+
+    owner = job_queue._owner()
+    mock_claim.assert_called_once_with(1, owner, None)
+    mock_update.assert_called_with(1, "done", metadata={"Name": "a.pdf"}, owner=owner)
+
+
+def test_submit_records_failure_and_cleans_up():
+    def boom(path):
+        raise Exception("parse failed")
+
+    on_error = MagicMock()
+    with patch("services.job_queue.claim_job", return_value=True), \
+         patch("services.job_queue.update_job") as mock_update:
+        job_queue.submit(2, boom, "a.pdf", on_error=on_error).result(timeout=5)
+
+    on_error.assert_called_once()
+    mock_update.assert_called_with(2, "failed", error="parse failed", owner=job_queue._owner())
+
+
+def test_job_claimed_elsewhere_is_skipped():
+    work = MagicMock()
+    with patch("services.job_queue.claim_job", return_value=False), \
+         patch("services.job_queue.update_job") as mock_update:
+        job_queue.submit(5, work, "a.pdf").result(timeout=5)
+        job_queue.submit_async(6, work, "a.pdf").result(timeout=5)
+
+    work.assert_not_called()
+    mock_update.assert_not_called()
+
+
+def test_submit_async_records_result_and_failure():
+    async def extract(path):
+        if path == "bad.pdf":
+            raise Exception("parse failed")
+        return {"Name": path}
+
+    on_error = MagicMock()
+    owner = job_queue._owner()
+    with patch("services.job_queue.claim_job", return_value=True), \
+         patch("services.job_queue.update_job") as mock_update:
+        job_queue.submit_async(3, extract, "a.pdf").result(timeout=5)
+        mock_update.assert_called_with(3, "done", metadata={"Name": "a.pdf"}, owner=owner)
+
+        job_queue.submit_async(4, extract, "bad.pdf", on_error=on_error).result(timeout=5)
+        mock_update.assert_called_with(4, "failed", error="parse failed", owner=owner)
+
+    on_error.assert_called_once()
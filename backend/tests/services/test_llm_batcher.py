@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.llm_batcher import Batcher
+
+
+def test_concurrent_submits_share_batches():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = Batcher("test", run_batch, token_budget=1000, max_items=50, linger_ms=50)
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda n: batcher.submit(n, 10).result(timeout=5), range(10)))
+
+    assert results == [n * 10 for n in range(10)]
+    assert len(batches) < 10
+    assert batcher.stats()["items"] == 10
+
+
+def test_token_budget_splits_batches():
+    batches = []
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(5)
+        batches.append(list(items))
+        return list(items)
+
+    batcher = Batcher("test", run_batch, token_budget=100, linger_ms=50)
+    # The first item holds the thread until all the others are queued.
+    futures = [batcher.submit("first", 10)]
+    futures += [batcher.submit(name, 60) for name in ("a", "b", "c")]
+    release.set()
+
+    assert [future.result(timeout=5) for future in futures] == ["first", "a", "b", "c"]
+    assert all(sum(60 if item != "first" else 10 for item in batch) <= 100 for batch in batches)
+    assert len(batches) >= 3
+
+
+def test_oversized_item_runs_alone():
+    batcher = Batcher("test", lambda items: [len(items)] * len(items), token_budget=10, linger_ms=1)
+
+    assert batcher.submit("big", 500).result(timeout=5) == 1
+
+
+def test_failed_batch_propagates_and_thread_survives():
+    calls = []
+
+    def run_batch(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("LLM API Error")
+        return [None] * len(items)
+
+    batcher = Batcher("test", run_batch, token_budget=100, linger_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit("a", 1).result(timeout=5)
+
+    assert batcher.submit("b", 1).result(timeout=5) is None
+    assert batcher.stats()["unanswered"] == 1
+
+
+def test_stats_in_metrics():
+    import metrics
+    Batcher("metrics_test", lambda items: list(items), token_budget=10, linger_ms=1).submit("a", 1).result(timeout=5)
+
+    rendered = metrics.render()
+    assert 'llm_batches_total{batcher="metrics_test"} 1' in rendered
+    assert 'llm_batch_items_total{batcher="metrics_test",outcome="answered"} 1' in rendered
+
+
+def test_short_result_list_leaves_every_item_unanswered():
+    batcher = Batcher("test", lambda items: list(items)[:1], token_budget=1000, max_items=2, linger_ms=200)
+
+    futures = [batcher.submit("a", 10), batcher.submit("b", 10)]
+
+    assert [future.result(timeout=5) for future in futures] == [None, None]
+    assert batcher.stats()["unanswered"] == 2
@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+
+from services.llm_client import AsyncLLMClient, LLMClient, _parse_retry_after
+
+
+def make_client(**kwargs):
+    return LLMClient("http://llm.test/v1/chat/completions", "key", **kwargs)
+
+
+def test_post_sets_timeouts_and_auth():
+    client = make_client(connect_timeout=1, read_timeout=2)
+    with patch.object(client.session, "post", return_value=MagicMock(status_code=200)) as mock_post:
+        client.post({"model": "m"})
+
+    _, kwargs = mock_post.call_args
+    assert kwargs["timeout"] == (1, 2)
+    assert client.session.headers["Authorization"] == "Bearer key"
+
+
+def test_post_retries_with_backoff_then_gives_up():
+    client = make_client(max_retries=2, backoff_base=1, backoff_max=10)
+    unavailable = MagicMock(status_code=503, headers={})
+
+    with patch.object(client.session, "post", return_value=unavailable) as mock_post, \
+         patch("services.llm_client.time.sleep") as mock_sleep:
+        response = client.post({})
+
+    assert response.status_code == 503
+    assert mock_post.call_count == 3
+    delays = [call.args[0] for call in mock_sleep.call_args_list]
+    assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+
+    stats = client.stats()
+    assert stats["calls"] == 1
+    assert stats["retries"] == 2
+    assert stats["errors"] == 1
+
+
+def test_post_does_not_retry_client_errors():
+    client = make_client()
+    with patch.object(client.session, "post", return_value=MagicMock(status_code=400)) as mock_post:
+        assert client.post({}).status_code == 400
+    assert mock_post.call_count == 1
+
+
+def test_post_retries_connection_errors():
+    client = make_client(max_retries=1)
+    ok = MagicMock(status_code=200)
+    with patch.object(client.session, "post", side_effect=[requests.ConnectionError(), ok]), \
+         patch("services.llm_client.time.sleep"):
+        assert client.post({}) is ok
+
+    with patch.object(client.session, "post", side_effect=requests.ConnectionError()), \
+         patch("services.llm_client.time.sleep"):
+        with pytest.raises(requests.ConnectionError):
+            client.post({})
+
+
+def test_parse_retry_after():
+    assert _parse_retry_after("3") == 3.0
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("garbage") is None
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def make_async_client(handler, **kwargs):
+    return AsyncLLMClient("http://llm.test/v1/chat/completions", "key",
+                          transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_async_post_retries_rate_limit():
+    statuses = iter([429, 200])
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["Authorization"])
+        return httpx.Response(next(statuses), headers={"Retry-After": "1"}, json={})
+
+    client = make_async_client(handler)
+    with patch("services.llm_client.asyncio.sleep") as mock_sleep:
+        response = asyncio.run(client.post({"model": "m"}))
+
+    assert response.status_code == 200
+    assert seen == ["Bearer key", "Bearer key"]
+    mock_sleep.assert_called_once_with(1.0)
+    assert client.stats()["retries"] == 1
+
+
+def test_async_post_gives_up_on_connection_errors():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    client = make_async_client(handler, max_retries=1, backoff_base=0)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(client.post({}))
+
+    assert client.stats()["errors"] == 1
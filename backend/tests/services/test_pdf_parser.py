@@ -1,5 +1,5 @@
-import pytest
 from unittest.mock import patch, MagicMock
+from reportlab.pdfgen import canvas
 from services import pdf_parser
 
 def test_extract_text_from_pdf_mocked():
@@ -16,3 +16,69 @@ def test_extract_text_from_pdf_mocked():
 
     assert result == "Hello World"
     mock_pdf_reader.assert_called_once_with("dummy_path.pdf")
+
+
+def make_reader(*texts):
+    pages = []
+    for text in texts:
+        page = MagicMock()
+        page.extract_text.return_value = text
+        pages.append(page)
+    reader = MagicMock()
+    reader.pages = pages
+    return reader
+
+
+def test_extract_text_stops_at_max_pages():
+    reader = make_reader("one ", "two ", "three")
+
+    with patch('services.pdf_parser.PdfReader', return_value=reader):
+        result = pdf_parser.extract_text_from_pdf("dummy_path.pdf", max_pages=2)
+
+    assert result == "one two"
+    reader.pages[2].extract_text.assert_not_called()
+
+
+def test_extract_text_stops_at_max_chars():
+    reader = make_reader("abcdef", "ghijkl", "mnopqr")
+
+    with patch('services.pdf_parser.PdfReader', return_value=reader):
+        result = pdf_parser.extract_text_from_pdf("dummy_path.pdf", max_chars=8)
+
+    assert result == "abcdefgh"
+    reader.pages[2].extract_text.assert_not_called()
+
+
+def test_iter_page_texts_is_lazy():
+    reader = make_reader("a", None, "c")
+    pages = pdf_parser.iter_page_texts(reader)
+
+    assert next(pages) == "a"
+    reader.pages[1].extract_text.assert_not_called()
+    assert list(pages) == ["", "c"]
+
+
+def test_extract_text_parallel_matches_sequential(tmp_path):
+    path = str(tmp_path / "catalog.pdf")
+    pdf = canvas.Canvas(path)
+    for number in range(6):
+        pdf.drawString(100, 750, f"page {number}")
+        pdf.showPage()
+    pdf.save()
+
+    with patch('services.pdf_parser.PDF_PARALLEL_WORKERS', 3):
+        parallel = pdf_parser.extract_text_from_pdf(path, parallel=True)
+    sequential = pdf_parser.extract_text_from_pdf(path, parallel=False)
+
+    assert parallel == sequential
+    assert "page 0" in parallel and "page 5" in parallel
+
+
+def test_extract_text_reports_progress():
+    reader = make_reader("one ", "two ", "three")
+    progress = []
+
+    with patch('services.pdf_parser.PdfReader', return_value=reader):
+        pdf_parser.extract_text_from_pdf("dummy_path.pdf", max_pages=2, progress=lambda *p: progress.append(p))
+
+    assert progress == [(1, 2), (2, 2)]
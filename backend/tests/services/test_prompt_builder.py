@@ -0,0 +1,82 @@
+import re
+import threading
+
+from services import prompt_builder
+
+LABEL = re.compile(r"^Color:")
+
+
+def filler(lines):
+    return "\n".join(f"filler line {i} with nothing of interest here" for i in range(lines))
+
+
+def test_short_text_sent_whole():
+    assert prompt_builder.plan("Color: Red", [LABEL], budget=100) == ["Color: Red"]
+
+
+def test_select_spans_keeps_lines_around_labels():
+    text = "\n".join([filler(50), "before", "Color: Red", "after", filler(50)])
+
+    selected, complete = prompt_builder.select_spans(text, budget=100, markers=[LABEL], context=1)
+
+    assert complete
+    assert selected == "before\nColor: Red\nafter"
+
+
+def test_select_spans_without_matches_keeps_document_start():
+    text = filler(100)
+
+    selected, complete = prompt_builder.select_spans(text, budget=10, markers=[LABEL])
+
+    assert not complete
+    assert text.startswith(selected)
+    assert prompt_builder.estimate_tokens(selected) <= 10
+
+
+def test_chunk_text_respects_budget():
+    text = filler(100) + "\n" + "x" * 500
+
+    chunks = prompt_builder.chunk_text(text, budget=50)
+
+    assert len(chunks) > 1
+    assert all(prompt_builder.estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+
+def test_plan_chunks_when_spans_do_not_fit():
+    text = "\n".join(f"Color: Red {i}\n" + filler(5) for i in range(40))
+
+    chunks = prompt_builder.plan(text, [LABEL], budget=60, max_chunks=3)
+
+    assert len(chunks) == 3
+    assert all(prompt_builder.estimate_tokens(chunk) <= 60 for chunk in chunks)
+
+
+def test_plan_logs_truncation(caplog):
+    caplog.set_level("INFO", logger="services.prompt_builder")
+
+    prompt_builder.plan(filler(100), [LABEL], budget=20, max_chunks=1)
+
+    assert "truncated" in caplog.text
+
+
+def test_map_chunks_runs_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def extract(chunk):
+        barrier.wait()
+        return {"Name": chunk}
+
+    assert prompt_builder.map_chunks(extract, ["a", "b"]) == [{"Name": "a"}, {"Name": "b"}]
+
+
+def test_merge_results_field_by_field():
+    results = [
+        {"Name": "", "Color": "Red", "Size": "L"},
+        {"Name": "Bike", "Color": "Blue", "Size": ""},
+        {"Name": "Bike", "Color": "Blue", "Note": "extra"},
+    ]
+
+    merged = prompt_builder.merge_results(results, ["Name", "Color", "Size", "Style"])
+
+    assert merged == {"Name": "Bike", "Color": "Blue", "Size": "L", "Style": "", "Note": "extra"}
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+from services.singleflight import Group
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_waiters(group, count):
+    deadline = time.time() + 5
+    while group.stats()["coalesced"] < count and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_concurrent_callers_share_one_call():
+    group = Group("test")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return {"Name": "Bike"}
+
+    threads, results = run_in_threads(4, lambda: group.do("abc", work))
+    wait_for_waiters(group, 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == [{"Name": "Bike"}] * 4
+    assert group.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_errors_are_shared():
+    group = Group("test")
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        raise RuntimeError("bad pdf")
+
+    threads, results = run_in_threads(2, lambda: group.do("abc", work))
+    wait_for_waiters(group, 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_finished_keys_run_again():
+    group = Group("test")
+    calls = []
+
+    assert group.do("abc", lambda: calls.append(1) or len(calls)) == 1
+    assert group.do("abc", lambda: calls.append(1) or len(calls)) == 2
+
+
+def test_recheck_skips_work():
+    group = Group("test")
+
+    def work():
+        raise AssertionError("should not run")
+
+    assert group.do("abc", work, recheck=lambda: {"Name": "Cached"}) == {"Name": "Cached"}
+
+
+def test_async_callers_on_different_loops_share_one_call():
+    group = Group("test")
+    release = threading.Event()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return "done"
+
+    threads, results = run_in_threads(2, lambda: asyncio.run(group.do_async("abc", work)))
+    wait_for_waiters(group, 1)
+    # A blocking caller joins the same flight.
+    sync_threads, sync_results = run_in_threads(1, lambda: group.do("abc", lambda: "other"))
+    wait_for_waiters(group, 2)
+    release.set()
+    for thread in threads + sync_threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results + sync_results == ["done"] * 3
+
+
+def test_file_lock_serializes_processes(tmp_path):
+    # Two groups stand in for two worker processes sharing a lock directory.
+    first, second = Group("a", lock_dir=str(tmp_path)), Group("b", lock_dir=str(tmp_path))
+    stored = {}
+    holding = threading.Event()
+    release = threading.Event()
+
+    def slow_work():
+        holding.set()
+        release.wait(5)
+        stored["abc"] = "from first"
+        return "from first"
+
+    leader = threading.Thread(target=lambda: first.do("abc", slow_work))
+    leader.start()
+    holding.wait(5)
+
+    threads, results = run_in_threads(1, lambda: second.do(
+        "abc", lambda: "from second", recheck=lambda: stored.get("abc")))
+    time.sleep(0.1)
+    assert results == [None]  # still waiting for the lock
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+
+    assert results == ["from first"]
+    assert (tmp_path / "abc.lock").exists()
+
+
+def test_stats_in_metrics():
+    import metrics
+    Group("metrics_test").do("abc", lambda: 1)
+
+    rendered = metrics.render()
+    assert 'singleflight_calls_total{group="metrics_test",role="leaders"} 1' in rendered
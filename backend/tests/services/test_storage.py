@@ -0,0 +1,137 @@
+import hashlib
+import io
+import os
+
+import pytest
+from unittest.mock import patch
+
+from services import storage
+
+
+def key_of(content):
+    return hashlib.sha256(content).hexdigest() + ".pdf"
+
+
+def test_local_save_shards_by_content_hash(tmp_path):
+    store = storage.LocalStorage(str(tmp_path))
+
+    stored = store.save(io.BytesIO(b"catalog"), "catalog.pdf")
+
+    key = key_of(b"catalog")
+    assert stored == storage.StoredFile(key, key[:-4], 7, "catalog.pdf", created=True)
+    assert store.local_path(key) == os.path.join(str(tmp_path), key[:2], key[2:4], key)
+    with store.open(key) as f:
+        assert f.read() == b"catalog"
+    assert store.info(key) == {"filename": "catalog.pdf", "size": 7}
+    assert os.listdir(tmp_path / ".tmp") == []
+
+
+def test_local_save_deduplicates(tmp_path):
+    store = storage.LocalStorage(str(tmp_path))
+
+    first = store.save(io.BytesIO(b"same"), "a.pdf")
+    second = store.save(io.BytesIO(b"same"), "b.pdf")
+
+    assert first.key == second.key
+    assert first.created and not second.created
+    assert store.info(first.key)["filename"] == "a.pdf"
+    assert os.listdir(tmp_path / ".tmp") == []
+
+
+def test_local_save_cleans_up_after_failed_read(tmp_path):
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            raise OSError("connection reset")
+
+    store = storage.LocalStorage(str(tmp_path))
+
+    with pytest.raises(OSError):
+        store.save(Broken(), "broken.pdf")
+
+    assert os.listdir(tmp_path / ".tmp") == []
+
+
+def test_local_reads_legacy_flat_files(tmp_path):
+    (tmp_path / "old_upload.pdf").write_bytes(b"legacy")
+    store = storage.LocalStorage(str(tmp_path))
+
+    assert store.local_path("old_upload.pdf") == os.path.join(str(tmp_path), "old_upload.pdf")
+    assert store.info("old_upload.pdf") == {"filename": "old_upload.pdf", "size": 6}
+
+
+def test_local_rejects_paths_outside_root(tmp_path):
+    store = storage.LocalStorage(str(tmp_path / "uploads"))
+    (tmp_path / "secret.pdf").write_bytes(b"secret")
+
+    with pytest.raises(FileNotFoundError):
+        store.local_path("../secret.pdf")
+
+
+def test_local_delete(tmp_path):
+    store = storage.LocalStorage(str(tmp_path))
+    stored = store.save(io.BytesIO(b"gone"), "gone.pdf")
+
+    store.delete(stored.key)
+    store.delete(stored.key)
+
+    with pytest.raises(FileNotFoundError):
+        store.info(stored.key)
+
+
+def test_memory_storage(tmp_path):
+    store = storage.MemoryStorage(cache_dir=str(tmp_path))
+
+    stored = store.save(io.BytesIO(b"in memory"), "memory.pdf")
+    assert not store.save(io.BytesIO(b"in memory"), "again.pdf").created
+
+    assert store.open(stored.key).read() == b"in memory"
+    assert store.info(stored.key) == {"filename": "memory.pdf", "size": 9}
+    with open(store.local_path(stored.key), "rb") as f:
+        assert f.read() == b"in memory"
+
+    store.delete(stored.key)
+    with pytest.raises(FileNotFoundError):
+        store.open(stored.key)
+    assert os.listdir(tmp_path) == []
+
+
+def test_get_storage_unknown_backend(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "ftp")
+
+    with pytest.raises(ValueError, match="Unknown storage backend"):
+        storage.get_storage("/nowhere")
+
+
+def test_local_iter_files(tmp_path):
+    store = storage.LocalStorage(str(tmp_path))
+    with patch("services.storage.time.time", return_value=0):
+        stored = store.save(io.BytesIO(b"listed"), "listed.pdf")
+    (tmp_path / "legacy.pdf").write_bytes(b"legacy")
+    modified = os.path.getmtime(store.local_path(stored.key))
+
+    assert list(store.iter_files()) == [(stored.key, 0)]
+
+    # Uploading the same bytes again restarts the file's grace period, but
+    # leaves the file itself (and the ETag served for it) alone.
+    store.save(io.BytesIO(b"listed"), "again.pdf")
+    assert list(store.iter_files())[0][1] > 0
+    assert os.path.getmtime(store.local_path(stored.key)) == modified
+    assert store.info(stored.key) == {"filename": "listed.pdf", "size": 6}
+
+
+def test_memory_iter_files(tmp_path):
+    store = storage.MemoryStorage(cache_dir=str(tmp_path))
+    stored = store.save(io.BytesIO(b"listed"), "listed.pdf")
+
+    assert [key for key, _ in store.iter_files()] == [stored.key]
+    store.delete(stored.key)
+    assert list(store.iter_files()) == []
+
+
+def test_incomplete_backend_cannot_be_created():
+    class WriteOnly(storage.StorageBackend):
+        def save(self, stream, filename):
+            return None
+
+    with pytest.raises(TypeError):
+        WriteOnly()
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+
+import jsonlib
+
+
+def test_dumps_and_loads_round_trip():
+    data = {"Name": "Vélo", "Price": 1.5, "Tags": [1, None, True], 3: "x"}
+
+    encoded = jsonlib.dumps(data)
+
+    assert encoded == '{"Name":"Vélo","Price":1.5,"Tags":[1,null,true],"3":"x"}'
+    assert jsonlib.loads(encoded) == json.loads(encoded)
+
+
+def test_falls_back_to_json_module():
+    assert jsonlib.dumps({"big": 2 ** 70}) == '{"big":1180591620717411303424}'
+    # Rows written by json.dumps may hold NaN, which orjson rejects.
+    value = jsonlib.loads('{"cost": NaN}')["cost"]
+    assert value != value
+    with pytest.raises(json.JSONDecodeError):
+        jsonlib.loads("not json")
+
+
+def test_dumps_raw_splices_stored_json():
+    doc = {"id": 1, "metadata": jsonlib.RawJSON('{"Color": "Red"}'), "file_url": "http://x/a.pdf"}
+
+    encoded = jsonlib.dumps_raw([doc])
+
+    assert encoded == '[{"id":1,"metadata":{"Color": "Red"},"file_url":"http://x/a.pdf"}]'
+    assert json.loads(encoded) == [{"id": 1, "metadata": {"Color": "Red"}, "file_url": "http://x/a.pdf"}]
+
+
+def test_flask_provider_matches_default_provider():
+    app = Flask(__name__)
+    app.json = jsonlib.JSONProvider(app)
+    app.json.sort_keys = False
+    data = {"b": 1, "a": Decimal("2.5"), "when": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+
+    with app.app_context():
+        body = app.json.response(data).get_data(as_text=True)
+
+    assert json.loads(body) == {"b": 1, "a": "2.5", "when": "Tue, 02 Jan 2024 00:00:00 GMT"}
+    assert body.index('"b"') < body.index('"a"')
+    assert app.json.loads(b'{"a": [1]}') == {"a": [1]}
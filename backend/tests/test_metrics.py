@@ -0,0 +1,46 @@
+import metrics
+
+
+def test_histogram_buckets_and_render():
+    histogram = metrics.Histogram("test_latency_seconds", "Test latency.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="parse")
+    histogram.observe(0.5, stage="parse")
+    histogram.observe(5, stage="parse")
+
+    text = metrics.render()
+    assert '# TYPE test_latency_seconds histogram' in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="parse",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="parse"} 3' in text
+    assert histogram.count(stage="parse") == 3
+
+
+def test_counter_gauge_and_label_escaping():
+    counter = metrics.Counter("test_events_total", "Test events.", ("kind",))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    gauge = metrics.Gauge("test_in_flight", "Test gauge.")
+    gauge.inc()
+    gauge.dec()
+    gauge.set(4)
+
+    text = metrics.render()
+    assert 'test_events_total{kind="a\\"b"} 3' in text
+    assert 'test_in_flight 4' in text
+
+
+def test_collectors_are_rendered():
+    metrics.register_collector(lambda: [("test_collected", "gauge", "Collected.", {"cache": "x"}, 7)])
+    assert 'test_collected{cache="x"} 7' in metrics.render()
+
+
+def test_metrics_endpoint_reports_requests(client):
+    client.get('/documents')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/documents",status="200"}' in body
+    assert 'db_operation_duration_seconds_count{operation="get_documents"}' in body
+    assert 'http_requests_in_flight' in body